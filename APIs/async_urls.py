@@ -0,0 +1,10 @@
+from django.urls import path
+from APIs import async_views
+
+#Async (ASGI) twins of the public read endpoints in APIs/urls.py
+urlpatterns = [
+    path('', async_views.home, name='api_async_home'),
+    path('branches/', async_views.preview_branches, name='api_async_branches_all'),
+    path('branches/<slug:branch_slug>/', async_views.preview_rooms_by_branch, name='api_async_branch_details'),
+    path('branches/<slug:branch_slug>/contact-us/', async_views.contact_us, name='api_async_branch_contact_us'),
+]
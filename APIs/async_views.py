@@ -0,0 +1,135 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_response_headers
+from django.views.decorators.http import require_GET
+from django.core.paginator import InvalidPage, Page
+from rest_framework.request import Request
+from rest_framework.exceptions import NotFound
+from bookings.models import Branch, Room
+from APIs.serializers import BranchSerializer
+from APIs.views import HomeAPIView, PreviewBranchesAPIView, PreviewRoomsByBranchAPIView
+from bookings.caching import apage_cache_prefix, make_etag
+
+#Async twins of the public read endpoints (home, branches, rooms by branch, contact us), served under /api/async/
+#They only await the ORM and the cache, so under an ASGI worker one process keeps many slow clients
+#in flight instead of one per sync worker; responses match the DRF views (their serializers and paginators)
+
+ROOM_TYPE_ORDER = [r_type for r_type, _ in Room.ROOM_TYPES]
+
+
+#Cache the response data of a read endpoint per url under its tags' versions (see bookings.caching)
+#(async cache calls; None, i.e. not found, isn't cached)
+async def cached_data(request, prefix, compute):
+    key = f'{prefix}:async-api:{request.get_full_path()}'
+    data = await cache.aget(key)
+    if data is None:
+        data = await compute()
+        if data is not None:
+            await cache.aset(key, data, timeout=settings.PAGE_CACHE_TIMEOUT)
+    return data
+
+
+def branch_not_found():
+    return JsonResponse({'detail': 'No Branch matches the given query.'}, status=404)
+
+
+#Cached data as a response with an ETag of the tags' versions, like cache_page_tagged
+#(a 304 before anything is computed when the client's copy is current)
+async def cached_response(request, tags, compute):
+    prefix = await apage_cache_prefix(tags)
+    etag = make_etag(request, prefix)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    data = await cached_data(request, prefix, compute)
+    if data is None:
+        return branch_not_found()
+    if 'detail' in data:
+        return JsonResponse(data, status=404)
+    response = JsonResponse(data)
+    response['ETag'] = etag
+    patch_response_headers(response, settings.PAGE_CLIENT_MAX_AGE)
+    return response
+
+
+#Page of a queryset from the sync twin's paginator (same page size, query params and envelope)
+#The count and the page's rows are awaited here; the paginator only checks the page number and builds the links
+async def paginate(request, queryset, view_class):
+    pagination = view_class.pagination_class()
+    drf_request = Request(request)
+    page_size = pagination.get_page_size(drf_request)
+    paginator = pagination.django_paginator_class(queryset, page_size)
+    paginator.count = await queryset.acount()   #cached property, so the paginator doesn't count again
+
+    page_number = drf_request.query_params.get(pagination.page_query_param) or 1
+    if page_number in pagination.last_page_strings:
+        page_number = paginator.num_pages
+    try:
+        number = paginator.validate_number(page_number)
+    except InvalidPage:
+        return None
+
+    bottom = (number - 1) * page_size
+    objects = [obj async for obj in queryset[bottom:bottom + page_size]]
+    pagination.page, pagination.request = Page(objects, number, paginator), drf_request
+    return paginated_data(pagination, view_class, objects)
+
+
+def paginated_data(pagination, view_class, objects):
+    data = view_class.serializer_class(objects, many=True, context={'request': pagination.request}).data
+    return pagination.get_paginated_response(data).data
+
+
+async def paginated_response(request, view_class, tags):
+    async def compute():
+        return await paginate(request, view_class.queryset.all(), view_class) or {'detail': 'Invalid page.'}
+
+    return await cached_response(request, tags, compute)
+
+
+#Home page (async)
+@require_GET
+async def home(request):
+    return await paginated_response(request, HomeAPIView, ['branches'])
+
+
+#Preview branches (async)
+@require_GET
+async def preview_branches(request):
+    return await paginated_response(request, PreviewBranchesAPIView, ['branches'])
+
+
+#Preview rooms by single branch (async): one sample room per type in a single DISTINCT ON query
+@require_GET
+async def preview_rooms_by_branch(request, branch_slug):
+    async def compute():
+        branch = await Branch.objects.filter(branch_slug=branch_slug).afirst()
+        if branch is None:
+            return None
+        rooms = (Room.objects.select_related('branch')
+                 .filter(branch=branch, room_type__in=ROOM_TYPE_ORDER)
+                 .order_by('room_type', 'room_number')
+                 .distinct('room_type'))
+        room_samples = sorted([room async for room in rooms], key=lambda room: ROOM_TYPE_ORDER.index(room.room_type))
+        pagination = PreviewRoomsByBranchAPIView.pagination_class()
+        try:   #a list, so paginating it doesn't touch the database
+            page = pagination.paginate_queryset(room_samples, Request(request))
+        except NotFound:
+            return {'detail': 'Invalid page.'}
+        return paginated_data(pagination, PreviewRoomsByBranchAPIView, page)
+
+    return await cached_response(request, [f'branch:{branch_slug}'], compute)
+
+
+#Contact us page (async)
+@require_GET
+async def contact_us(request, branch_slug):
+    async def compute():
+        branch = await Branch.objects.filter(branch_slug=branch_slug).afirst()
+        if branch is None:
+            return None
+        return BranchSerializer(branch, context={'request': request}).data
+
+    return await cached_response(request, [f'branch:{branch_slug}'], compute)
@@ -1,7 +1,16 @@
+from django import forms
 from django.db.models import Q
 from bookings.models import Booking, Room, Branch
-from django_filters import (FilterSet, ChoiceFilter, CharFilter, NumberFilter, 
-                           BooleanFilter, ModelChoiceFilter, DateFilter, DateFromToRangeFilter)
+from bookings.caching import cached_filter_available
+from bookings.availability import stay_error
+from bookings.filters import CachedBranchChoiceFilter
+from django_filters import (FilterSet, ChoiceFilter, CharFilter, NumberFilter, BaseInFilter,
+                           BooleanFilter, DateFilter, DateFromToRangeFilter)
+
+
+#Filter accepting comma-separated values (e.g. ?branches=cairo,giza)
+class CharInFilter(BaseInFilter, CharFilter):
+    pass
 
 
 #Filter for branches
@@ -31,17 +40,64 @@ class RoomFilter(FilterSet):
     price_min = NumberFilter(field_name='price_per_night', lookup_expr='gte')
     price_max = NumberFilter(field_name='price_per_night', lookup_expr='lte')
 
+    branches = CharInFilter(field_name='branch__branch_slug', lookup_expr='in')
+    room_types = CharInFilter(field_name='room_type', lookup_expr='in')
+    guests = NumberFilter(method='filter_guests')
+    check_in = DateFilter(method='filter_stay')
+    check_out = DateFilter(method='filter_stay')
+
     class Meta:
         model = Room
         fields = ['branch', 'room_number', 'room_type', 'is_available', 'price_min', 'price_max']
 
+    #keep only room types large enough for the party
+    def filter_guests(self, queryset, name, value):
+        return queryset.filter(room_type__in=Room.room_types_for_guests(value))
+
+    #dates are applied together in filter_queryset()
+    def filter_stay(self, queryset, name, value):
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        check_in = self.form.cleaned_data.get('check_in')
+        check_out = self.form.cleaned_data.get('check_out')
+
+        #keep only rooms that are free for every night of the stay (cached per branch and week)
+        if check_in and check_out:
+            queryset = cached_filter_available(queryset, check_in, check_out)
+        return queryset
+
+
+#Form validating the stay of an availability search (anonymous clients may search, so the
+#stay is bounded: every night costs hold and cache keys and pricing work)
+class RoomAvailabilityForm(forms.Form):
+    def clean(self):
+        cleaned_data = super().clean()
+        check_in = cleaned_data.get('check_in')
+        check_out = cleaned_data.get('check_out')
+
+        error = stay_error(check_in, check_out) if check_in and check_out else None
+        if error:
+            raise forms.ValidationError(error)
+        return cleaned_data
+
+
+#Filter for searching free rooms across branches (stay dates are required)
+class RoomAvailabilityFilter(RoomFilter):
+    check_in = DateFilter(method='filter_stay', required=True)
+    check_out = DateFilter(method='filter_stay', required=True)
+
+    class Meta(RoomFilter.Meta):
+        form = RoomAvailabilityForm
+
 
 #Filter for bookings  
 class BookingFilter(FilterSet):
     guest_first_name = CharFilter(field_name='guest_first_name', lookup_expr='istartswith')
     guest_last_name = CharFilter(field_name='guest_last_name', lookup_expr='istartswith')
     nationality = CharFilter(field_name='nationality', lookup_expr='icontains')
-    branch = ModelChoiceFilter(field_name='room__branch', queryset=Branch.objects.all())
+    branch = CachedBranchChoiceFilter(field_name='room__branch', queryset=Branch.objects.all())
     room_number = NumberFilter(field_name='room__room_number', lookup_expr='exact')
     room_type = ChoiceFilter(field_name='room__room_type', choices=Room.ROOM_TYPES)
     check_in_after = DateFilter(field_name='check_in_date', lookup_expr='gte')
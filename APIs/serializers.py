@@ -3,14 +3,27 @@ from rest_framework import serializers
 from datetime import datetime, timedelta
 from django.contrib.auth import authenticate
 from accounts.models import User, Guest 
-from bookings.models import Booking, Branch, Room 
+from bookings.models import Booking, ArchivedBooking, Branch, Room 
+from bookings.availability import available_rooms, is_room_available, stay_error, ROOM_UNAVAILABLE_MESSAGE
+from bookings.lookups import find_guest_booking, find_guest_booking_by_contact
+from bookings.reference import branch_rows
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.db.models import Q 
 
 #Accepted date formats
 DATE_INPUT_FORMATS = ['%d-%m-%Y', '%d/%m/%Y', '%Y-%m-%d', '%m/%d/%Y', '%d.%m.%Y', '%Y/%m/%d', 'iso-8601']
 
+#Branch field listing its choices (browsable API, OPTIONS) from the reference cache; 
+#the submitted branch is still validated against the field's queryset
+class CachedBranchField(serializers.PrimaryKeyRelatedField):
+    def get_choices(self, cutoff=None):
+        queryset = self.get_queryset()
+        if queryset is None or queryset.query.is_empty():
+            return {}
+        rows = branch_rows() if cutoff is None else branch_rows()[:cutoff]
+        return {self.to_representation(branch): self.display_value(branch) for branch in rows}
+
+
 #Account Management Serializers 
 #Custom JWT authentication serializer 
 class CreateTokenSerializer(TokenObtainPairSerializer):  #used for logins
@@ -46,7 +59,7 @@ class CreateTokenSerializer(TokenObtainPairSerializer):  #used for logins
 #Staff Registeration Serializer 
 class StaffRegistrationSerializer(serializers.ModelSerializer):
     role = serializers.CharField(max_length=20)
-    branch = serializers.PrimaryKeyRelatedField(queryset=Branch.objects.all())
+    branch = CachedBranchField(queryset=Branch.objects.all())
     shift_time = serializers.ChoiceField(choices=[('morning', 'Morning Shift'), ('night', 'Night Shift')])
     password1 = serializers.CharField(write_only=True)
     password2 = serializers.CharField(write_only=True)
@@ -88,11 +101,12 @@ class CreateBookingSerializer(serializers.ModelSerializer):
     date_of_birth = serializers.DateField(input_formats=['%Y-%m-%d', '%d-%m-%Y'])
     check_in_date = serializers.DateField(input_formats=['%Y-%m-%d', '%d-%m-%Y'])
     check_out_date = serializers.DateField(input_formats=['%Y-%m-%d', '%d-%m-%Y'])
+    hold_token = serializers.CharField(write_only=True, required=False)  #room hold placed before booking
 
     class Meta:
         model = Booking
         fields = ['branch_name', 'guest_first_name', 'guest_last_name', 'gender', 'date_of_birth', 'nationality',
-                'phone_number', 'email', 'id_number', 'id_photo',  'room', 'check_in_date', 'check_out_date']
+                'phone_number', 'email', 'id_number', 'id_photo',  'room', 'check_in_date', 'check_out_date', 'hold_token']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -102,13 +116,22 @@ class CreateBookingSerializer(serializers.ModelSerializer):
         if branch:
             self.branch = branch
             self.fields['branch_name'].default = branch.name
+            #rooms in service; free nights are checked against the chosen dates
             self.fields['room'].queryset = Room.objects.select_related('branch').filter(branch=branch, is_available=True)
 
 
-    def validate_room(self, room):
-        if room and not room.is_available:
-            raise serializers.ValidationError('This room is already booked!')
-        return room
+    def validate(self, data):
+        room = data.get('room')
+        check_in = data.get('check_in_date')
+        check_out = data.get('check_out_date')
+
+        if check_in >= check_out:
+            raise serializers.ValidationError('Check-out date must be after check-in date.')
+
+        #check the room is free for [check_in, check_out) and not held by another guest
+        if room and not is_room_available(room, check_in, check_out, hold_token=data.get('hold_token')):
+            raise serializers.ValidationError({'room': ROOM_UNAVAILABLE_MESSAGE})
+        return data
   
 
 #Request Booking Serializer 
@@ -128,24 +151,8 @@ class RequestBookingSerializer(serializers.ModelSerializer):
         if not (guest_first_name and guest_last_name and guest_email_or_phone):
             return data 
         
-        #validate name 
-        if not Booking.objects.filter(guest_first_name__iexact=guest_first_name, guest_last_name__iexact=guest_last_name):
-            raise serializers.ValidationError('No booking with the name provided.')
-        
-        #validate email or phone number
-        if '@' in guest_email_or_phone:
-            if not Booking.objects.filter(email__iexact=guest_email_or_phone):
-                raise serializers.ValidationError('No booking with the email address provided.')
-        else:
-            guest_email_or_phone = User.normalize_phone_number(guest_email_or_phone)
-            if not Booking.objects.filter(phone_number=guest_email_or_phone).exists():
-                raise serializers.ValidationError('No booking with the phone number provided.')
-
-        #get requested booking and pass it to cleaned data
-        requested_booking = Booking.objects.filter(
-            (Q(guest_first_name=guest_first_name) & Q(guest_last_name=guest_last_name)) & 
-            (Q(email=guest_email_or_phone) | Q(phone_number=guest_email_or_phone))   
-        ).first()
+        #get requested booking and pass it to data (one indexed query on the normalized keys)
+        requested_booking = find_guest_booking_by_contact(guest_first_name, guest_last_name, guest_email_or_phone)
 
         #validate that booking exists
         if not requested_booking:
@@ -158,7 +165,7 @@ class RequestBookingSerializer(serializers.ModelSerializer):
 #Change Booking Serializer 
 class ChangeBookingSerializer(serializers.ModelSerializer):
     old_branch = serializers.CharField(read_only=True, label='Current Branch')
-    new_branch = serializers.PrimaryKeyRelatedField(queryset=Branch.objects.none())
+    new_branch = CachedBranchField(queryset=Branch.objects.none())
     old_room = serializers.CharField(read_only=True)
     new_room = serializers.PrimaryKeyRelatedField(queryset=Room.objects.none())
     new_check_in_date = serializers.DateField()
@@ -179,7 +186,7 @@ class ChangeBookingSerializer(serializers.ModelSerializer):
             self.fields['old_branch'].default = old_booking.branch.name
             self.fields['old_room'].default = old_booking.room.room_number
             self.fields['new_room'].queryset = Room.objects.select_related('branch').filter(branch=old_booking.branch, is_available=True).order_by('room_number')
-            self.fields['new_branch'].queryset = Branch.objects.all().order_by('name')
+            self.fields['new_branch'].queryset = Branch.objects.all()
         else:
             self.fields['new_room'].queryset = Room.objects.none()
             self.fields['new_branch'].queryset = Branch.objects.none()
@@ -194,24 +201,13 @@ class ChangeBookingSerializer(serializers.ModelSerializer):
         new_check_in = data.get('new_check_in_date')
         new_check_out = data.get('new_check_out_date')
         
-        #normalize phone number 
-        guest_phone_normalized = User.normalize_phone_number(guest_phone)
-
-        #retrieve booking object 
-        booking = Booking.objects.filter(
-            guest_first_name=guest_first_name, 
-            guest_last_name=guest_last_name, 
-            phone_number=guest_phone_normalized)
-        
-        if not booking.exists():
+        #check a booking with the details provided exists in the database
+        if not find_guest_booking(guest_first_name, guest_last_name, phone_number=guest_phone):
             raise serializers.ValidationError('No booking with the credentials provided!')
 
         if old_booking.branch == new_branch and int(old_booking.room.room_number) == int(new_room.room_number):
             raise serializers.ValidationError("You're already booked in this room. Please choose a different one.")
 
-        if not new_room.is_available:
-            raise serializers.ValidationError('This room is already booked.')
-
         now = datetime.now().date()
         if (old_booking.check_in_date - now) < timedelta(days=1):
             raise serializers.ValidationError('Booking cannot change within 24 hours of check-in.')
@@ -219,6 +215,10 @@ class ChangeBookingSerializer(serializers.ModelSerializer):
         if new_check_in >= new_check_out:
             raise serializers.ValidationError('Check-out date cannot be before check-in date.')
 
+        #check the new room is free for the new dates (ignoring this booking's own nights)
+        if not is_room_available(new_room, new_check_in, new_check_out, exclude_booking=old_booking):
+            raise serializers.ValidationError(ROOM_UNAVAILABLE_MESSAGE)
+
         return data
 
 #Change Room Serializer
@@ -238,11 +238,11 @@ class ChangeRoomSerializer(serializers.ModelSerializer):
         old_booking = self.context.get('booking', None) 
 
         if old_booking:
-            #Initialize fields and filter rooms to only those available in the same hotel
+            #Initialize fields and filter rooms to those free for the booked dates in the same hotel
             self.fields['current_branch'].default = old_booking.branch.name
             self.fields['old_room'].default = old_booking.room.room_number
-            self.fields['new_room'].queryset = Room.objects.select_related('branch').filter(
-                branch=old_booking.branch, is_available=True).order_by('room_number')
+            self.fields['new_room'].queryset = available_rooms(old_booking.branch, old_booking.check_in_date, 
+                                                               old_booking.check_out_date, exclude_booking=old_booking)
         else:
             self.fields['new_room'].queryset = Room.objects.none()
 
@@ -253,21 +253,11 @@ class ChangeRoomSerializer(serializers.ModelSerializer):
         guest_phone = data.get('phone_number')
         new_room = data.get('new_room')
 
-        #normalize phone number 
-        guest_phone_normalized = User.normalize_phone_number(guest_phone)
-
-        #retrieve booking object 
-        booking = Booking.objects.filter(
-            guest_first_name=guest_first_name,
-            guest_last_name=guest_last_name,
-            phone_number=guest_phone_normalized)
-        
-        if not booking.exists():
+        #check a booking with the details provided exists in the database
+        if not find_guest_booking(guest_first_name, guest_last_name, phone_number=guest_phone):
             raise serializers.ValidationError('No room booked with the credentials provided!')
 
-        if not new_room.is_available:
-            raise serializers.ValidationError('This room is already booked.')
-
+        #room availability is enforced by the new_room queryset (free for the booked dates)
         if int(old_booking.room.room_number) == int(new_room.room_number):
             raise serializers.ValidationError('This is the same room as before!')
 
@@ -288,11 +278,8 @@ class DeleteBookingSerializer(serializers.ModelSerializer):
         guest_phone_normalized = User.normalize_phone_number(guest_phone)
         data['phone_number'] = guest_phone_normalized
 
-        try:
-            booking = Booking.objects.get(guest_first_name=guest_first_name, 
-                                          guest_last_name=guest_last_name,
-                                          phone_number=guest_phone_normalized)
-        except Booking.DoesNotExist:
+        booking = find_guest_booking(guest_first_name, guest_last_name, phone_number=guest_phone_normalized)
+        if not booking:
             raise serializers.ValidationError('No booking found with the credentials provided.')
 
         #assign booking to data (to be used by the relevant view)
@@ -314,6 +301,15 @@ class BookingSerializer(serializers.ModelSerializer):
         model = Booking 
         fields = '__all__'
 
+#Bookings read from the archive (past bookings)
+class ArchivedBookingSerializer(serializers.ModelSerializer):
+    branch = serializers.PrimaryKeyRelatedField(read_only=True)
+    room = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    class Meta:
+        model = ArchivedBooking
+        fields = '__all__'
+
 class BranchSerializer(serializers.ModelSerializer):
     class Meta:
         model = Branch 
@@ -333,7 +329,7 @@ class RoomSerializer(serializers.ModelSerializer):
 #Serializer for registered guest's me page
 class GuestMeSerializer(serializers.Serializer):
     active_bookings = BookingSerializer(many=True)
-    past_bookings = BookingSerializer(many=True)
+    past_bookings = ArchivedBookingSerializer(many=True)
 
 #Serializer for previewing rooms by branch
 class RoomsByBranchSerializer(serializers.Serializer):
@@ -341,5 +337,70 @@ class RoomsByBranchSerializer(serializers.Serializer):
     branch_slug = serializers.CharField()
     room_samples = RoomSerializer(many=True)
 
+#Allotment Booking Serializer (room is assigned from the partner's allotment)
+class AllotmentBookingSerializer(serializers.ModelSerializer):
+    branch_name = serializers.CharField(source='branch.name', read_only=True)
+    room_number = serializers.IntegerField(source='room.room_number', read_only=True)
+    room_type = serializers.ChoiceField(choices=Room.ROOM_TYPES, write_only=True)
+    date_of_birth = serializers.DateField(input_formats=['%Y-%m-%d', '%d-%m-%Y'])
+    check_in_date = serializers.DateField(input_formats=['%Y-%m-%d', '%d-%m-%Y'])
+    check_out_date = serializers.DateField(input_formats=['%Y-%m-%d', '%d-%m-%Y'])
+
+    class Meta:
+        model = Booking
+        fields = ['branch_name', 'allotment_partner', 'guest_first_name', 'guest_last_name', 'gender', 'date_of_birth', 
+                  'nationality', 'phone_number', 'email', 'id_number', 'room_type', 'room_number', 
+                  'check_in_date', 'check_out_date']
+        read_only_fields = ['allotment_partner']
+
+    def validate(self, data):
+        if data.get('check_in_date') >= data.get('check_out_date'):
+            raise serializers.ValidationError('Check-out date must be after check-in date.')
+        return data
+
+
+#Serializer to hold a room while the guest completes the booking
+class RoomHoldSerializer(serializers.Serializer):
+    room = serializers.PrimaryKeyRelatedField(queryset=Room.objects.none())
+    check_in_date = serializers.DateField(input_formats=['%Y-%m-%d', '%d-%m-%Y'])
+    check_out_date = serializers.DateField(input_formats=['%Y-%m-%d', '%d-%m-%Y'])
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        branch = self.context.get('branch')  #branch object passed from view (RoomHoldAPIView)
+        if branch:
+            self.fields['room'].queryset = Room.objects.filter(branch=branch, is_available=True)
+
+    def validate(self, data):
+        room = data.get('room')
+        check_in = data.get('check_in_date')
+        check_out = data.get('check_out_date')
+
+        error = stay_error(check_in, check_out)
+        if error:
+            raise serializers.ValidationError(error)
+
+        if not is_room_available(room, check_in, check_out):
+            raise serializers.ValidationError({'room': ROOM_UNAVAILABLE_MESSAGE})
+        return data
+
+
+#Room with the total price of the searched stay (quotes are passed by the view as context)
+class QuotedRoomSerializer(RoomSerializer):
+    total_price = serializers.SerializerMethodField()
+
+    class Meta(RoomSerializer.Meta):
+        fields = RoomSerializer.Meta.fields + ['total_price']
+
+    def get_total_price(self, room):
+        return self.context.get('quotes', {}).get(room.pk)
+
+
+#Serializer for free rooms grouped by branch (availability search)
+class AvailableRoomsByBranchSerializer(serializers.Serializer):
+    branch_name = serializers.CharField()
+    branch_slug = serializers.CharField()
+    rooms = QuotedRoomSerializer(many=True)
+
 
 
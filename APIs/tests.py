@@ -1,3 +1,162 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from django.urls import reverse
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework.test import APITestCase
+from bookings.models import RatePlan, StayDiscount
+from bookings.tests import sequence, make_branch, make_room, make_booking, night
+from bookings.holds import release_hold, MAX_HOLDS_PER_CLIENT
+from bookings.caching import bump_versions, page_tag_key
 
-# Create your tests here.
+
+#Anonymous requests are throttled per IP address (counted in the shared cache between test runs)
+def reset_throttle():
+    cache.delete('throttle_anon_127.0.0.1')
+
+
+#Availability search: free rooms for a stay, grouped by branch, paginated and filtered
+class RoomSearchAPITests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        n = next(sequence)
+        cls.cairo, cls.giza = make_branch(name=f'Cairo {n}'), make_branch(name=f'Giza {n}')
+        cls.cairo_double = make_room(cls.cairo)
+        cls.cairo_suite = make_room(cls.cairo, 'suite', price_per_night=300)
+        cls.giza_single = make_room(cls.giza, 'single', price_per_night=50)
+        make_booking(cls.cairo_double, night(10), night(12))
+
+    def setUp(self):
+        reset_throttle()
+
+    def search(self, check_in=10, check_out=12, **params):
+        stay = {'check_in': night(check_in).isoformat(), 'check_out': night(check_out).isoformat()}
+        return self.client.get(reverse('api_room_search'), {**stay, **params})
+
+    def found(self, response):
+        self.assertEqual(response.status_code, 200, response.data)
+        return {group['branch_slug']: [room['id'] for room in group['rooms']] for group in response.data['results']}
+
+    def test_free_rooms_are_grouped_by_branch(self):
+        response = self.search()
+        self.assertEqual([group['branch_slug'] for group in response.data['results']],
+                         [self.cairo.branch_slug, self.giza.branch_slug])
+        self.assertEqual(self.found(response), {self.cairo.branch_slug: [self.cairo_suite.id],
+                                                self.giza.branch_slug: [self.giza_single.id]})
+        self.assertEqual(self.found(self.search(12, 14))[self.cairo.branch_slug], [self.cairo_double.id, self.cairo_suite.id])
+
+    def test_results_are_paginated_by_room(self):
+        response = self.search(size=1)
+        self.assertEqual((response.data['total_items'], response.data['total_pages']), (2, 2))
+        self.assertEqual(self.found(response), {self.cairo.branch_slug: [self.cairo_suite.id]})
+        self.assertEqual(self.found(self.search(size=1, page=2)), {self.giza.branch_slug: [self.giza_single.id]})
+
+    def test_filters(self):
+        self.assertEqual(self.found(self.search(12, 14, guests=3)), {self.cairo.branch_slug: [self.cairo_suite.id]})
+        self.assertEqual(self.found(self.search(branches=self.giza.branch_slug)), {self.giza.branch_slug: [self.giza_single.id]})
+        self.assertEqual(self.found(self.search(12, 14, room_types='double')), {self.cairo.branch_slug: [self.cairo_double.id]})
+        self.assertEqual(self.found(self.search(12, 14, price_max=100)),
+                         {self.cairo.branch_slug: [self.cairo_double.id], self.giza.branch_slug: [self.giza_single.id]})
+
+    def test_rooms_are_quoted_for_the_stay(self):
+        plan = RatePlan.objects.create(name='Cairo rates', branch=self.cairo)
+        StayDiscount.objects.create(rate_plan=plan, min_nights=2, discount_percent=10)
+        response = self.search(12, 14)
+        prices = {room['id']: room['total_price'] for group in response.data['results'] for room in group['rooms']}
+        self.assertEqual(prices, {self.cairo_double.id: Decimal('180.00'), self.cairo_suite.id: Decimal('540.00'),
+                                  self.giza_single.id: Decimal('100.00')})
+
+    def test_bad_stays_are_rejected(self):
+        self.assertEqual(self.client.get(reverse('api_room_search')).status_code, 400)
+        self.assertEqual(self.search(12, 10).status_code, 400)
+        self.assertEqual(self.search(-1, 2).status_code, 400)
+
+    @override_settings(MAX_STAY_NIGHTS=7)
+    def test_stays_are_limited_in_length(self):
+        self.assertEqual(self.search(10, 17).status_code, 200)
+        self.assertEqual(self.search(10, 18).status_code, 400)
+        response = self.client.get(reverse('api_room_search'), {'check_in': night(1).isoformat(),
+                                                                 'check_out': (night(1) + timedelta(days=3650)).isoformat()})
+        self.assertEqual(response.status_code, 400)
+
+
+#Room holds: same stay rules as the search, and a limited number of live holds per client
+class RoomHoldAPITests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch(name=f'Aswan {next(sequence)}')
+        cls.rooms = [make_room(cls.branch) for _ in range(MAX_HOLDS_PER_CLIENT + 1)]
+
+    def setUp(self):
+        reset_throttle()
+
+    def hold(self, room, check_in=10, check_out=12, **extra):
+        response = self.client.post(reverse('api_room_hold', args=[self.branch.branch_slug]),
+                                    {'room': room.pk, 'check_in_date': night(check_in).isoformat(),
+                                     'check_out_date': night(check_out).isoformat()}, **extra)
+        if response.status_code == 201:
+            self.addCleanup(release_hold, response.data['hold_token'])
+        return response
+
+    @override_settings(MAX_STAY_NIGHTS=7)
+    def test_stays_are_limited_in_length(self):
+        self.assertEqual(self.hold(self.rooms[0], 10, 18).status_code, 400)
+        self.assertEqual(self.hold(self.rooms[0], -1, 2).status_code, 400)
+        self.assertEqual(self.hold(self.rooms[0], 10, 17).status_code, 201)
+
+    def test_clients_have_a_limited_number_of_live_holds(self):
+        for room in self.rooms[:-1]:
+            self.assertEqual(self.hold(room).status_code, 201)
+        response = self.hold(self.rooms[-1])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('room', response.data)
+        self.assertEqual(self.hold(self.rooms[-1], REMOTE_ADDR='10.0.0.2').status_code, 201)   #another client
+
+    def test_released_holds_free_a_slot(self):
+        tokens = [self.hold(room).data['hold_token'] for room in self.rooms[:-1]]
+        self.client.delete(reverse('api_room_hold_release', args=[tokens[0]]))
+        self.assertEqual(self.hold(self.rooms[-1]).status_code, 201)
+
+
+#Async twins of the public read endpoints (/api/async/) answer exactly like the DRF views
+class AsyncAPITests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        n = next(sequence)
+        cls.branches = [make_branch(name=f'Luxor {n} {i:02d}') for i in range(26)]   #more than a page
+        cls.branch = cls.branches[0]
+        for room_type in ('suite', 'double', 'double', 'single'):
+            make_room(cls.branch, room_type)
+
+    def setUp(self):
+        reset_throttle()
+        #branch saves only bump page versions on commit, so start from fresh pages
+        bump_versions([page_tag_key('branches'), page_tag_key(f'branch:{self.branch.branch_slug}')])
+
+    def assertSameResponse(self, name, args=(), **params):
+        sync = self.client.get(reverse(f'api_{name}', args=args), params)
+        response = async_to_sync(self.async_client.get)(reverse(f'api_async_{name}', args=args), params)
+        self.assertEqual(response.status_code, sync.status_code)
+        self.assertEqual(json.loads(response.content.decode().replace('/api/async/', '/api/')), sync.json())
+
+    def test_home(self):
+        self.assertSameResponse('home')
+        self.assertSameResponse('home', page=2)
+        self.assertSameResponse('home', page='last')
+        self.assertSameResponse('home', page=99)
+
+    def test_branches(self):
+        self.assertSameResponse('branches_all')
+        self.assertSameResponse('branches_all', page=2)
+        self.assertSameResponse('branches_all', page='two')
+
+    def test_branch_rooms(self):
+        self.assertSameResponse('branch_details', [self.branch.branch_slug])
+        self.assertSameResponse('branch_details', [self.branches[1].branch_slug])
+        self.assertSameResponse('branch_details', ['no-such-branch'])
+
+    def test_contact_us(self):
+        self.assertSameResponse('branch_contact_us', [self.branch.branch_slug])
+        self.assertSameResponse('branch_contact_us', ['no-such-branch'])
@@ -22,8 +22,10 @@ urlpatterns = [
     #URLs for viewing branch details (including about and contact pages)
     path('branches/', views.PreviewBranchesAPIView.as_view(), name='api_branches_all'),
     path('branches/<slug:branch_slug>/', views.PreviewRoomsByBranchAPIView.as_view(), name='api_branch_details'),
+    path('rooms/search/', views.SearchAvailableRoomsAPIView.as_view(), name='api_room_search'),
     path('branches/<slug:branch_slug>/contact-us/', views.ContactUsAPIView.as_view(), name='api_branch_contact_us'),  
     path('branches/<slug:branch_slug>/about/', views.AboutAPIView.as_view(), name='api_branch_about'),   
+    path('branches/<slug:branch_slug>/availability/', views.BranchAvailabilityCalendarAPIView.as_view(), name='api_branch_availability'),
 
     #URLs for registration
     path('staff/accounts/registration/', views.StaffRegistrationAPIView.as_view(), name='api_staff_registration'),
@@ -31,6 +33,9 @@ urlpatterns = [
 
     #URL for booking 
     path('branches/<slug:branch_slug>/make-booking/', views.CreateBookingAPIView.as_view(), name='api_create_booking'),  
+    path('branches/<slug:branch_slug>/allotments/<slug:partner>/make-booking/', views.CreateAllotmentBookingAPIView.as_view(), name='api_create_allotment_booking'),
+    path('branches/<slug:branch_slug>/room-holds/', views.RoomHoldAPIView.as_view(), name='api_room_hold'),
+    path('room-holds/<str:hold_token>/', views.ReleaseRoomHoldAPIView.as_view(), name='api_room_hold_release'),
     
     #URLs for staff members to view and modify data
     path('staff/guest-bookings/<slug:branch_slug>/rooms/', views.DisplayBookings_byBranchAPIView.as_view(), name='api_bookings_by_branch'),  
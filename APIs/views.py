@@ -3,8 +3,11 @@ from rest_framework.response import Response
 from bookings.models import Booking, Branch, Room
 from accounts.models import User, Guest, Staff 
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from APIs.paginators import PageNumberPagination
+from bookings.caching import cache_page_tagged
+from bookings.conditional import booking_condition
+from itertools import groupby
+from datetime import date, datetime
+from APIs.paginators import PageNumberPagination, CustomPaginator
 from django.shortcuts import get_object_or_404
 from rest_framework.permissions import AllowAny
 from APIs.permissions import StaffOnly, GuestOnly
@@ -14,8 +17,15 @@ from bookings.signals import booking_updated_signal, room_changed_signal
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import OrderingFilter
-from APIs.filters import BookingFilter
+from APIs.filters import BookingFilter, RoomAvailabilityFilter
 from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from bookings.inventory import month_calendar
+from bookings.pricing import quote_rooms
+from bookings.services import create_booking, change_booking, create_allotment_booking
+from bookings.archive import guest_booking_history
+from bookings.holds import place_hold, get_hold, release_hold, hold_client, HoldLimitReached, HOLD_TTL, ROOM_HELD_MESSAGE
+from django.core.exceptions import ValidationError as DjangoValidationError
 from APIs.serializers import *
 
 
@@ -29,7 +39,7 @@ class HomeAPIView(generics.ListAPIView):
     serializer_class = BranchSerializer
     permission_classes = [AllowAny]
 
-    @method_decorator(cache_page(60*30))
+    @method_decorator(cache_page_tagged('branches'))
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
@@ -45,7 +55,7 @@ class ContactUsAPIView(generics.RetrieveAPIView):
         #return branch by its url slug 
         return get_object_or_404(Branch, branch_slug=self.kwargs['branch_slug'])
 
-    @method_decorator(cache_page(60*30))
+    @method_decorator(cache_page_tagged('branch:{branch_slug}'))
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
@@ -57,7 +67,7 @@ class AboutAPIView(generics.RetrieveAPIView):
     lookup_field = 'branch_slug'
     lookup_url_kwarg = 'branch_slug'
 
-    @method_decorator(cache_page(60*30))
+    @method_decorator(cache_page_tagged('branch:{branch_slug}'))
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
@@ -67,7 +77,7 @@ class GuestHomeAPIView(generics.ListAPIView):
     serializer_class = BranchSerializer
     permission_classes = [AllowAny]
 
-    @method_decorator(cache_page(60*30))
+    @method_decorator(cache_page_tagged('branches'))
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
     
@@ -81,17 +91,10 @@ class GuestMeAPIView(generics.GenericAPIView):
     ordering = ['-check_out_date']
 
     def get(self, request, *args, **kwargs):
-        guest = Guest.objects.select_related('guest').get(guest=self.request.user)
-        guest_bookings = Booking.all_objects.filter(guest_first_name=guest.guest.first_name, 
-                                                    guest_last_name=guest.guest.last_name, 
-                                                    phone_number=guest.guest.phone_number,
-                                                    email=guest.guest.email)
-        
-        active_bookings = guest_bookings.filter(is_deleted=False)
-        past_bookings = guest_bookings.filter(is_deleted=True)
+        active_bookings, past_bookings = guest_booking_history(request.user)
 
         active_serialized = self.get_serializer(active_bookings, many=True).data
-        past_serialized = self.get_serializer(past_bookings, many=True).data
+        past_serialized = ArchivedBookingSerializer(past_bookings, many=True).data
 
         return Response({'active_bookings': active_serialized, 'past_bookings': past_serialized}, status=status.HTTP_200_OK)
 
@@ -163,7 +166,7 @@ class PreviewBranchesAPIView(generics.ListAPIView):
     serializer_class = BranchSerializer
     permission_classes = [AllowAny]
 
-    @method_decorator(cache_page(60*15))
+    @method_decorator(cache_page_tagged('branches'))
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
     
@@ -186,11 +189,72 @@ class PreviewRoomsByBranchAPIView(generics.ListAPIView):
 
         return room_samples
 
-    @method_decorator(cache_page(60*15))
+    @method_decorator(cache_page_tagged('branch:{branch_slug}'))
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
+
+
+#Search free rooms across branches API view 
+#(e.g. ?check_in=2026-11-01&check_out=2026-11-04&guests=2&branches=cairo,giza&room_types=double,suite&price_max=300)
+class SearchAvailableRoomsAPIView(generics.ListAPIView):
+    serializer_class = AvailableRoomsByBranchSerializer
+    permission_classes = [AllowAny]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = RoomAvailabilityFilter
+    pagination_class = CustomPaginator
+
+    def get_queryset(self):
+        #one set-based query; ordering keeps rooms of a branch together
+        return Room.objects.select_related('branch').filter(branch__isnull=False).order_by('branch__name', 'room_number')
+
+    def list(self, request, *args, **kwargs):
+        #filter through the filterset directly to reuse its cleaned stay dates for pricing
+        filterset = DjangoFilterBackend().get_filterset(request, self.get_queryset(), self)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        queryset = filterset.qs
+        page = self.paginate_queryset(queryset)
+        rooms = list(page if page is not None else queryset)
+
+        #price the stay for every room of the page in one call
+        stay = filterset.form.cleaned_data
+        quotes = quote_rooms(rooms, stay['check_in'], stay['check_out'])
+
+        #group the page of free rooms by branch
+        grouped = [{'branch_name': branch.name, 'branch_slug': branch.branch_slug, 'rooms': list(branch_rooms)}
+                   for branch, branch_rooms in groupby(rooms, key=lambda room: room.branch)]
+        serialized = self.get_serializer(grouped, many=True, context={**self.get_serializer_context(), 'quotes': quotes}).data
+
+        if page is not None:
+            return self.get_paginated_response(serialized)
+        return Response(serialized, status=status.HTTP_200_OK)
     
 
+#Monthly availability calendar per branch API view (e.g. ?month=2026-11&room_type=double)
+class BranchAvailabilityCalendarAPIView(generics.GenericAPIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        branch = get_object_or_404(Branch, branch_slug=self.kwargs['branch_slug'])
+
+        #default to the current month
+        month_param = request.query_params.get('month') or date.today().strftime('%Y-%m')
+        try:
+            month_start = datetime.strptime(month_param, '%Y-%m').date()
+        except ValueError:
+            raise ValidationError({'month': 'Month must be in YYYY-MM format.'})
+
+        room_type = request.query_params.get('room_type')
+        if room_type and room_type not in dict(Room.ROOM_TYPES):
+            raise ValidationError({'room_type': 'Unknown room type.'})
+
+        nights = month_calendar(branch, month_start.year, month_start.month, room_type=room_type)
+        return Response({'branch_name': branch.name, 
+                         'branch_slug': branch.branch_slug, 
+                         'month': month_start.strftime('%Y-%m'), 
+                         'nights': nights}, status=status.HTTP_200_OK)
+
+
 #Display bookings by branch API view (for staff)
 class DisplayBookings_byBranchAPIView(generics.ListAPIView):
     queryset = Branch.objects.all()
@@ -220,26 +284,85 @@ class CreateBookingAPIView(generics.CreateAPIView):
         serializer_context['branch'] = get_object_or_404(Branch, branch_slug=self.kwargs['branch_slug'])
         return serializer_context
 
-    @transaction.atomic
     def perform_create(self, serializer):
         #Get validated data 
         validated_data = serializer.validated_data
 
-        #Create new booking
+        #Create new booking while holding a lock on its room
         #branch = get_object_or_404(Branch, branch_slug=self.kwargs['branch_slug'])
         branch = self.get_serializer_context()['branch']
-        booking = Booking.objects.create(**validated_data, branch=branch)
-        booking.save() 
+        hold_token = validated_data.pop('hold_token', None)
 
-        #update room availability 
-        room = booking.room 
-        room.is_available = False 
-        room.save(update_fields=['is_available'])
+        #link bookings made by registered guests to their account
+        user = self.request.user if (self.request.user.is_authenticated and not self.request.user.is_staff) else None
+        try:
+            booking = create_booking(Booking(**validated_data, branch=branch, user=user), hold_token=hold_token)
+        except DjangoValidationError as exc:
+            raise ValidationError(exc.message_dict)
 
         #assign new booking to the serializer's instance 
         serializer.instance = booking
 
 
+#Create booking from a partner's allotment API view (for staff)
+class CreateAllotmentBookingAPIView(generics.CreateAPIView):
+    serializer_class = AllotmentBookingSerializer
+    permission_classes = [StaffOnly]
+
+    def perform_create(self, serializer):
+        validated_data = serializer.validated_data
+        room_type = validated_data.pop('room_type')
+        branch = get_object_or_404(Branch, branch_slug=self.kwargs['branch_slug'])
+
+        #take the rooms off the allotment and book the first free room of the type
+        try:
+            booking = create_allotment_booking(Booking(**validated_data, branch=branch), 
+                                               self.kwargs['partner'], room_type)
+        except DjangoValidationError as exc:
+            raise ValidationError(exc.message_dict)
+        serializer.instance = booking
+
+
+#Room hold API views (hold a room's nights while the guest completes the booking)
+class RoomHoldAPIView(generics.GenericAPIView):
+    serializer_class = RoomHoldSerializer
+    permission_classes = [AllowAny]
+
+    def get_serializer_context(self):
+        serializer_context = super().get_serializer_context()
+        serializer_context['branch'] = get_object_or_404(Branch, branch_slug=self.kwargs['branch_slug'])
+        return serializer_context
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        try:
+            hold = place_hold(data['room'].pk, data['check_in_date'], data['check_out_date'],
+                              client=hold_client(request))
+        except HoldLimitReached as exc:
+            raise ValidationError({'room': str(exc)})
+        if hold is None:
+            raise ValidationError({'room': ROOM_HELD_MESSAGE})
+
+        return Response({'hold_token': hold['token'],
+                         'room': hold['room_id'],
+                         'check_in_date': hold['check_in'],
+                         'check_out_date': hold['check_out'],
+                         'expires_in': HOLD_TTL}, status=status.HTTP_201_CREATED)
+
+
+class ReleaseRoomHoldAPIView(generics.GenericAPIView):
+    permission_classes = [AllowAny]
+
+    def delete(self, request, *args, **kwargs):
+        if not get_hold(self.kwargs['hold_token']):
+            raise NotFound('Room hold not found or expired.')
+        release_hold(self.kwargs['hold_token'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 #Request booking API view 
 class RequestBookingAPIView(generics.CreateAPIView):
     serializer_class = RequestBookingSerializer
@@ -259,6 +382,7 @@ class RequestBookingAPIView(generics.CreateAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 #Display bookings by detail API view (for guests and staff)
+@method_decorator(booking_condition, name='get')
 class DisplayBookingDetailAPIView(generics.RetrieveAPIView):
     queryset = Booking.objects.select_related('branch', 'room').all()
     serializer_class = BookingSerializer
@@ -293,12 +417,14 @@ class ChangeBookingAPIView(generics.UpdateAPIView):
     serializer_class = ChangeBookingSerializer
     permission_classes = [AllowAny]
 
+    #fetch the booking once per request (update(), the serializer context and perform_update() all need it)
     def get_object(self):
-        queryset = self.get_queryset()   
-        branch_slug = self.kwargs.get('branch_slug')
-        room_number = self.kwargs.get('room_number')
-
-        return get_object_or_404(queryset, branch__branch_slug=branch_slug, room__room_number=room_number)
+        if not hasattr(self, '_booking'):
+            queryset = self.get_queryset()   
+            branch_slug = self.kwargs.get('branch_slug')
+            room_number = self.kwargs.get('room_number')
+            self._booking = get_object_or_404(queryset, branch__branch_slug=branch_slug, room__room_number=room_number)
+        return self._booking
 
     #pass current booking object to serializer (from urls)
     def get_serializer_context(self):
@@ -306,7 +432,6 @@ class ChangeBookingAPIView(generics.UpdateAPIView):
         context['booking'] = self.get_object()  
         return context
 
-    @transaction.atomic
     def perform_update(self, serializer):
         #Get guest's booking 
         booking = self.get_object()
@@ -320,22 +445,12 @@ class ChangeBookingAPIView(generics.UpdateAPIView):
         new_check_in_date  = validated_data.get('new_check_in_date')
         new_check_out_date = validated_data.get('new_check_out_date')
 
-        #change new room's availability 
-        new_room.is_available = False 
-        new_room.save(update_fields=['is_available'])
-
-        #change old room's availability 
-        old_room = booking.room 
-        old_room.is_available = True 
-        old_room.save(update_fields=['is_available'])
-
-        #update guest booking's details with the new data 
-        booking.branch = new_branch
-        booking.room = new_room
-        booking.check_in_date = new_check_in_date
-        booking.check_out_date = new_check_out_date
-        #save changes 
-        booking.save(update_fields=['branch', 'room', 'check_in_date', 'check_out_date'])
+        #apply the new details in one locked update 
+        try:
+            change_booking(booking, new_room, new_branch=new_branch, 
+                           check_in=new_check_in_date, check_out=new_check_out_date)
+        except DjangoValidationError as exc:
+            raise ValidationError(exc.message_dict)
 
         #trigger booking update email signal 
         booking_updated_signal.send(sender=self.__class__, booking=booking)        
@@ -346,11 +461,14 @@ class ChangeRoomAPIView(generics.UpdateAPIView):
     serializer_class = ChangeRoomSerializer
     permission_classes = [AllowAny]
 
+    #fetch the booking once per request
     def get_object(self):
-        queryset = self.get_queryset()        
-        branch_slug = self.kwargs.get('branch_slug')  
-        room_number = self.kwargs.get('room_number')
-        return get_object_or_404(queryset, branch__branch_slug=branch_slug, room__room_number=room_number)
+        if not hasattr(self, '_booking'):
+            queryset = self.get_queryset()        
+            branch_slug = self.kwargs.get('branch_slug')  
+            room_number = self.kwargs.get('room_number')
+            self._booking = get_object_or_404(queryset, branch__branch_slug=branch_slug, room__room_number=room_number)
+        return self._booking
 
     #pass current booking object to serializer (from urls)
     def get_serializer_context(self):
@@ -358,7 +476,6 @@ class ChangeRoomAPIView(generics.UpdateAPIView):
         context['booking'] = self.get_object()  
         return context
 
-    @transaction.atomic
     def perform_update(self, serializer):
         #Get guest's booking 
         booking = self.get_object()
@@ -366,21 +483,17 @@ class ChangeRoomAPIView(generics.UpdateAPIView):
         #Fetch new room from serializer 
         new_room = serializer.validated_data.get('new_room')
 
-        #change new room's availability 
-        new_room.is_available = False 
-        new_room.save(update_fields=['is_available'])
-
-        #change old room's availability 
+        #keep old room for the email signal 
         old_room = booking.room 
-        old_room.is_available = True 
-        old_room.save(update_fields=['is_available'])
 
-        #Change room and save 
-        booking.room = new_room
-        booking.save(update_fields=['room'])
+        #Change room in one locked update 
+        try:
+            change_booking(booking, new_room)
+        except DjangoValidationError as exc:
+            raise ValidationError(exc.message_dict)
 
         #trigger room change email signal 
-        room_changed_signal.send(sender=self.__class__, booking=booking)        
+        room_changed_signal.send(sender=self.__class__, booking=booking, old_room=old_room)        
 
 
 #Delete booking API view (for staff and guests)
@@ -422,7 +535,7 @@ class DeleteBookingAPIView(generics.GenericAPIView):
             else:
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        #Call manager method to safely delete and update room availability
+        #Call manager method to safely delete the booking (frees the room's nights)
         Booking.all_objects.remove_canceled_booking(booking_id=booking.id)
         return Response({"detail": "Booking deleted successfully."}, status=status.HTTP_200_OK)
 
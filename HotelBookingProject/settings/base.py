@@ -21,6 +21,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'accounts.apps.AccountsConfig',
     'bookings.apps.BookingsConfig',
     'APIs.apps.ApisConfig',
@@ -166,6 +167,25 @@ CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 CELERY_RESULT_BACKEND = 'django-db'
 
 
+#Longest stay an availability search (or room hold) may cover; every night of it costs cache keys and pricing work
+MAX_STAY_NIGHTS = int(os.environ.get('MAX_STAY_NIGHTS', 30))
+
+#Send check-in reminders with one Celery task per branch
+CHECK_IN_REMINDER_FAN_OUT = os.environ.get('CHECK_IN_REMINDER_FAN_OUT', 'False') == 'True'
+
+#Cached public pages (bookings.caching.cache_page_tagged); edits invalidate them right away, so this can be long
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', 60 * 60 * 6))
+#max-age sent to browsers and nginx, after which they revalidate their copy with its ETag (a 304 when unchanged)
+PAGE_CLIENT_MAX_AGE = int(os.environ.get('PAGE_CLIENT_MAX_AGE', 60))
+
+#Seconds a worker keeps its own copy of reference data (bookings.reference); changes are also pushed over Redis pub/sub
+REFERENCE_CACHE_TTL = int(os.environ.get('REFERENCE_CACHE_TTL', 30))
+
+#Pooled SMTP sessions (accounts.email_backends.PooledEmailBackend)
+EMAIL_POOL_IDLE_TIMEOUT = 60   #seconds an idle session is kept open
+EMAIL_POOL_MAX_MESSAGES = 500   #messages per session before it is recycled
+
+
 #Django REST's settings 
 REST_FRAMEWORK = {
             'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
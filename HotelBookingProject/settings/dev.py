@@ -65,7 +65,7 @@ EMAIL_HOST_USER = ''
 EMAIL_HOST_PASSWORD = ''
 EMAIL_USE_TLS = False
 DEFAULT_FROM_EMAIL = 'no-reply@KhalifaHotels.com'  
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = 'accounts.email_backends.PooledEmailBackend'   #keeps SMTP sessions open between sends
 
 
 #Configure Celery settings
@@ -29,7 +29,17 @@ EMAIL_HOST_PASSWORD = os.environ['BREVO_SMTP_PASSWORD']
 EMAIL_PORT = int(os.environ['BREVO_SMTP_PORT'])
 EMAIL_USE_TLS = True
 DEFAULT_FROM_EMAIL = 'no-reply@KhalifaHotels.com'  
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = 'accounts.email_backends.PooledEmailBackend'   #keeps SMTP sessions open between sends
+
+
+#Templates are compiled once per process and kept in memory
+TEMPLATES[0]['APP_DIRS'] = False
+TEMPLATES[0]['OPTIONS']['loaders'] = [
+    ('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]),
+]
 
 
 #Celery Broker
@@ -10,6 +10,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('accounts.urls')),
     path('', include('bookings.urls')),
+    path('api/async/', include('APIs.async_urls')),   #async read endpoints (served best by an ASGI worker)
     path('api/', include('APIs.urls')), 
     path('health/', lambda request: HttpResponse('OK')),
 ]
@@ -1,6 +1,6 @@
 from django.contrib import admin, messages
 from django.contrib import admin
-from accounts.models import User, Guest, Staff, Management
+from accounts.models import User, Guest, Staff, Management, OutboundEmail
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
 
@@ -131,3 +131,12 @@ class ManagementAdmin(admin.ModelAdmin):
 
     manager_full_name.short_description = 'Full Name'
     manager_email.short_description = 'Email'
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    search_fields = ['subject']
+    list_filter = ['status', 'created_at']
+    ordering = ['-created_at']
+    readonly_fields = ['created_at', 'sent_at', 'last_error']
@@ -0,0 +1,181 @@
+import os
+import time
+import atexit
+import logging
+import smtplib
+import threading
+from django.conf import settings
+from django.core.mail.backends.smtp import EmailBackend
+
+#Instantiate logger
+logger = logging.getLogger(__name__)
+
+#Authenticated SMTP sessions kept open per worker process, keyed by server and credentials
+_pool = {}
+_in_use = {}   #stats of the sessions backends have checked out, per key
+_closed = {}   #totals of the sessions closed for good, per key
+_pool_lock = threading.RLock()
+_pool_pid = os.getpid()
+
+
+#Throughput metrics of one SMTP session
+class SessionStats:
+    def __init__(self):
+        self.opened_at = time.monotonic()
+        self.last_used = self.opened_at
+        self.messages = 0
+        self.failures = 0
+        self.broken = False
+
+    @property
+    def age(self):
+        return time.monotonic() - self.opened_at
+
+    @property
+    def throughput(self):   #messages per second over the life of the session
+        return self.messages / self.age if self.age else 0.0
+
+    def as_dict(self):
+        return {'messages': self.messages, 'failures': self.failures, 'age': round(self.age, 1),
+                'messages_per_second': round(self.throughput, 2)}
+
+
+#Forked worker: the sessions belong to the parent process (left open for it)
+def reset_if_forked():
+    global _pool_pid
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            _pool.clear()
+            _in_use.clear()
+            _closed.clear()
+            _pool_pid = os.getpid()
+
+
+#Quit a session for good, adding its metrics to the totals of its server
+def discard_session(key, connection, stats, reason):
+    logger.info(f'Closing SMTP session ({reason}): {stats.as_dict()}')
+    with _pool_lock:
+        totals = _closed.setdefault(key, {'sessions': 0, 'messages': 0, 'failures': 0})
+        totals['sessions'] += 1
+        totals['messages'] += stats.messages
+        totals['failures'] += stats.failures
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        pass
+
+
+#Mark a session as used by a backend until it is checked in or discarded
+def track_session(key, stats):
+    with _pool_lock:
+        _in_use.setdefault(key, []).append(stats)
+
+
+def untrack_session(key, stats):
+    with _pool_lock:
+        sessions = _in_use.get(key, [])
+        if stats in sessions:
+            sessions.remove(stats)
+
+
+#Take an idle session from the pool (dropping the ones that timed out or no longer answer)
+def checkout_session(key):
+    reset_if_forked()
+    with _pool_lock:
+        sessions = _pool.get(key, [])
+        while sessions:
+            connection, stats = sessions.pop()
+            if time.monotonic() - stats.last_used > settings.EMAIL_POOL_IDLE_TIMEOUT:
+                discard_session(key, connection, stats, 'idle timeout')
+                continue
+            try:
+                if connection.noop()[0] == 250:
+                    track_session(key, stats)
+                    return connection, stats
+            except (smtplib.SMTPException, OSError):
+                pass
+            discard_session(key, connection, stats, 'not responding')
+    return None
+
+
+#Return a session to the pool for the next batch
+def checkin_session(key, connection, stats):
+    with _pool_lock:
+        untrack_session(key, stats)
+        _pool.setdefault(key, []).append((connection, stats))
+
+
+#Metrics of this worker's sessions per server: idle in the pool, in use by a backend and closed so far
+def pool_stats():
+    with _pool_lock:
+        keys = set(_pool) | set(_in_use) | set(_closed)
+        return {f'{key[0]}:{key[1]}': {'idle': [stats.as_dict() for _, stats in _pool.get(key, [])],
+                                       'in_use': [stats.as_dict() for stats in _in_use.get(key, [])],
+                                       'closed': dict(_closed.get(key, {'sessions': 0, 'messages': 0, 'failures': 0}))}
+                for key in keys}
+
+
+@atexit.register
+def close_pool():
+    with _pool_lock:
+        for key, sessions in _pool.items():
+            for connection, stats in sessions:
+                discard_session(key, connection, stats, 'worker exit')
+        _pool.clear()
+
+
+#SMTP backend that keeps authenticated sessions open between sends instead of a TLS handshake per email
+#(close() hands the session back to the pool; sessions are recycled after EMAIL_POOL_MAX_MESSAGES)
+class PooledEmailBackend(EmailBackend):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = None
+
+    def pool_key(self):
+        return (self.host, self.port, self.username, self.use_tls, self.use_ssl)
+
+    def open(self):
+        if self.connection:
+            return False
+
+        pooled = checkout_session(self.pool_key())
+        if pooled:
+            self.connection, self.stats = pooled
+            return True
+
+        opened = super().open()
+        if self.connection:
+            self.stats = SessionStats()
+            track_session(self.pool_key(), self.stats)
+        return opened
+
+    def close(self):
+        if self.connection is None:
+            return
+
+        stats = self.stats
+        if stats.broken or stats.messages >= settings.EMAIL_POOL_MAX_MESSAGES:
+            untrack_session(self.pool_key(), stats)
+            discard_session(self.pool_key(), self.connection, stats, 'broken' if stats.broken else 'message limit')
+        else:
+            stats.last_used = time.monotonic()
+            checkin_session(self.pool_key(), self.connection, stats)
+        self.connection = None
+        self.stats = None
+
+    def _send(self, email_message):
+        try:
+            sent = super()._send(email_message)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            self.stats.failures += 1
+            self.stats.broken = True
+            raise
+        except smtplib.SMTPException:   #rejected message; the session is still usable
+            self.stats.failures += 1
+            raise
+
+        if sent:
+            self.stats.messages += 1
+        else:
+            self.stats.failures += 1
+        return sent
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.template.loader import get_template
+from accounts.utils import queue_email
+
+
+#Text and HTML variants of an email (emails/<name>.txt and emails/<name>.html),
+#compiled once per process by the cached template loader in production
+def email_templates(name):
+    return get_template(f'emails/{name}.txt'), get_template(f'emails/{name}.html')
+
+
+#Render both variants of an email from the same context, as (text, html)
+def render_email(name, context):
+    text_template, html_template = email_templates(name)
+    return text_template.render(context), html_template.render(context)
+
+
+#Render an email for many contexts at once (e.g. a chunk of check-in reminders)
+def render_emails(name, contexts):
+    text_template, html_template = email_templates(name)
+    return [(text_template.render(context), html_template.render(context)) for context in contexts]
+
+
+#Render an email and queue it in the outbox
+def queue_templated_email(name, subject, context, recipient_list):
+    text, html = render_email(name, context)
+    return queue_email(subject=subject, message=text, html_message=html, 
+                       from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=recipient_list)
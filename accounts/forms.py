@@ -2,6 +2,7 @@ import re
 from django import forms
 from django.db import transaction
 from bookings.models import Branch 
+from bookings.forms import CachedBranchChoiceField
 from accounts.models import User, Staff, Guest
 from django.contrib.auth import authenticate
 from django.contrib.auth.forms import UserCreationForm 
@@ -15,7 +16,7 @@ class StaffRegistrationForm(UserCreationForm):
             attrs={'placeholder': 'DD-MM-YYYY', 'type': 'date'}),
     )
     role = forms.CharField(max_length=20)
-    branch = forms.ModelChoiceField(queryset=Branch.objects.all()) 
+    branch = CachedBranchChoiceField() 
     shift_time = forms.ChoiceField(choices=(('', '---------'), ('morning', 'Morning Shift'), ('night', 'Night Shift')), required=True)
 
     class Meta:
@@ -2,6 +2,7 @@ import re
 import random
 import datetime
 from django.db import models  
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from accounts.validators import validate_age, validate_image_size, validate_phone_number
 
@@ -106,4 +107,36 @@ class Management(models.Model):
         db_table = 'Management_table'
         verbose_name_plural = 'Management'
         ordering = ['manager__first_name', 'manager__last_name']
-    
+
+
+#Outgoing emails (written by the request path, sent in batches by accounts.tasks.dispatch_email_outbox_task)
+class OutboundEmail(models.Model):
+    STATUSES = [
+        ('pending', 'Pending'), 
+        ('sent', 'Sent'), 
+        ('failed', 'Failed')   #gave up after the maximum number of attempts
+    ]
+
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    html_message = models.TextField(blank=True, null=True)
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'Email_Outbox_table'
+        verbose_name_plural = 'Email Outbox'
+        ordering = ['-created_at']
+        indexes = [
+            #the dispatcher only ever scans emails that are due
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='pending'), name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} -> {", ".join(self.recipients)}'
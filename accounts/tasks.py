@@ -0,0 +1,104 @@
+import smtplib
+import logging
+from datetime import timedelta
+from celery import shared_task
+from django.db import transaction
+from django.utils import timezone
+from django.core.mail import get_connection, EmailMultiAlternatives
+from accounts.models import OutboundEmail
+from accounts.email_backends import pool_stats
+
+#Instantiate logger 
+logger = logging.getLogger(__name__) 
+
+EMAIL_BATCH_SIZE = 50   #emails sent over one SMTP connection
+EMAIL_MAX_BATCHES = 20   #per task run, so a backlog can't hold a worker forever
+EMAIL_MAX_ATTEMPTS = 6
+EMAIL_RETRY_DELAY = 60   #seconds, doubled after every failed attempt (capped at an hour)
+EMAIL_RETENTION_DAYS = 30   #sent emails are kept this long
+EMAIL_LEASE = timedelta(minutes=10)   #claimed emails aren't due again for this long (sent again if a worker dies mid-batch)
+
+
+#Wait before the next attempt of an email that failed a number of times
+def retry_delay(attempts):
+    return timedelta(seconds=min(EMAIL_RETRY_DELAY * 2 ** (attempts - 1), 60 * 60))
+
+
+#Mail server errors worth another attempt later (anything else is a bug that retrying won't fix)
+TRANSIENT_ERRORS = (smtplib.SMTPException, OSError)
+
+
+#Record a failed attempt (gives up after the maximum number of attempts, or at once if permanent)
+def mark_failed(email, exc, now, permanent=False):
+    email.attempts += 1
+    email.last_error = str(exc)
+    if permanent or email.attempts >= EMAIL_MAX_ATTEMPTS:
+        email.status = 'failed'
+        logger.error(f'Giving up on email {email.pk} after {email.attempts} attempts: {exc}')
+    else:
+        email.next_attempt_at = now + retry_delay(email.attempts)
+
+
+#Send a batch of emails over one SMTP session (kept open between batches by the pooled backend)
+def send_batch(emails):
+    now = timezone.now()
+    connection = get_connection()
+    try:
+        connection.open()
+    except TRANSIENT_ERRORS as exc:   #mail server unreachable: retry the whole batch later
+        for email in emails:
+            mark_failed(email, exc, now)
+        return 0
+
+    sent = 0
+    try:
+        for email in emails:
+            message = EmailMultiAlternatives(subject=email.subject, body=email.message, from_email=email.from_email,
+                                             to=email.recipients, connection=connection)
+            if email.html_message:
+                message.attach_alternative(email.html_message, 'text/html')
+            try:
+                message.send()
+                email.status = 'sent'
+                email.sent_at = now
+                email.attempts += 1
+                sent += 1
+            except TRANSIENT_ERRORS as exc:
+                mark_failed(email, exc, now)
+            except Exception as exc:   #can't be built or sent as it is: don't send it again with the next batch
+                logger.exception(f'Email {email.pk} could not be sent.')
+                mark_failed(email, exc, now, permanent=True)
+    finally:
+        connection.close()
+    return sent
+
+
+#Claim a batch of due emails by pushing them past the lease, in a short transaction of its own
+#(rows being claimed by another worker are skipped rather than waited for)
+def claim_batch():
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(OutboundEmail.objects
+                     .select_for_update(skip_locked=True)
+                     .filter(status='pending', next_attempt_at__lte=now)
+                     .order_by('next_attempt_at')[:EMAIL_BATCH_SIZE])
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in batch]).update(next_attempt_at=now + EMAIL_LEASE)
+    return batch
+
+
+#Send emails that are due from the outbox: claimed, sent over SMTP outside of any transaction
+#(no row locks held while the mail server answers), then the results written back
+@shared_task(bind=True)
+def dispatch_email_outbox_task(self):
+    total_sent = 0
+    for _ in range(EMAIL_MAX_BATCHES):
+        batch = claim_batch()
+        if not batch:
+            break
+
+        total_sent += send_batch(batch)
+        OutboundEmail.objects.bulk_update(batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+
+    #drop old sent emails
+    OutboundEmail.objects.filter(status='sent', sent_at__lt=timezone.now() - timedelta(days=EMAIL_RETENTION_DAYS)).delete()
+    logger.info(f'Email outbox dispatch completed. {total_sent} emails sent. SMTP sessions: {pool_stats()}')
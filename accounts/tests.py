@@ -1,3 +1,185 @@
-from django.test import TestCase
+import os
+import smtplib
+from unittest import mock
+from datetime import timedelta
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from accounts.models import OutboundEmail
+from accounts.utils import queue_email
+from accounts.tasks import claim_batch, dispatch_email_outbox_task, EMAIL_LEASE
+from accounts.emails import render_email, render_emails
+from accounts.email_backends import PooledEmailBackend, pool_stats
 
-# Create your tests here.
+
+#Mail server that can't be reached
+class UnreachableBackend(BaseEmailBackend):
+    def open(self):
+        raise ConnectionRefusedError('Connection refused')
+
+
+#Mail backend with a bug
+class MisconfiguredBackend(BaseEmailBackend):
+    def open(self):
+        raise TypeError('open() missing argument')
+
+
+#Mail server that can't send one particular email
+class BrokenMessageBackend(LocmemBackend):
+    def send_messages(self, messages):
+        if any(message.subject == 'Broken' for message in messages):
+            raise ValueError('Header values may not contain linefeed')
+        return super().send_messages(messages)
+
+
+#Outbox dispatcher: emails are claimed in one short transaction, sent outside of it and written back
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailOutboxTests(TestCase):
+    def queue(self, subject='Booking confirmed'):
+        return queue_email(subject, 'See you soon.', 'hotel@example.com', ['guest@example.com'])
+
+    def test_due_emails_are_sent(self):
+        email = self.queue()
+        dispatch_email_outbox_task()
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'sent')
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual([message.subject for message in mail.outbox], ['Booking confirmed'])
+
+    def test_emails_without_recipients_are_not_queued(self):
+        self.assertIsNone(queue_email('Booking confirmed', 'See you soon.', 'hotel@example.com', ['']))
+
+    def test_emails_not_due_wait(self):
+        email = self.queue()
+        OutboundEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now() + timedelta(minutes=5))
+        dispatch_email_outbox_task()
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'pending')
+        self.assertEqual(mail.outbox, [])
+
+    def test_claimed_emails_are_leased(self):
+        email = self.queue()
+        self.assertEqual(claim_batch(), [email])
+        self.assertEqual(claim_batch(), [])   #another worker finds nothing due
+        email.refresh_from_db()
+        self.assertGreater(email.next_attempt_at, timezone.now() + EMAIL_LEASE - timedelta(minutes=1))
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.UnreachableBackend')
+    def test_unreachable_server_schedules_a_retry(self):
+        email = self.queue()
+        dispatch_email_outbox_task()
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'pending')
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('Connection refused', email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.BrokenMessageBackend')
+    def test_emails_that_cannot_be_sent_fail_at_once(self):
+        broken, email = self.queue('Broken'), self.queue()
+        with self.assertLogs('accounts.tasks', 'ERROR'):
+            dispatch_email_outbox_task()
+        broken.refresh_from_db()
+        email.refresh_from_db()
+        self.assertEqual((broken.status, broken.attempts), ('failed', 1))
+        self.assertEqual(email.status, 'sent')
+        self.assertEqual([message.subject for message in mail.outbox], ['Booking confirmed'])
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.MisconfiguredBackend')
+    def test_backend_bugs_are_not_retried_as_outages(self):
+        email = self.queue()
+        with self.assertRaises(TypeError):
+            dispatch_email_outbox_task()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 0))
+
+
+#Pooled SMTP sessions (against a mocked smtplib.SMTP, one mock per session opened)
+@override_settings(EMAIL_HOST='smtp.example.com', EMAIL_PORT=25, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+                   EMAIL_USE_TLS=False, EMAIL_POOL_MAX_MESSAGES=3)
+class PooledEmailBackendTests(SimpleTestCase):
+    def setUp(self):
+        for pool in ('_pool', '_in_use', '_closed'):
+            mock.patch.dict(f'accounts.email_backends.{pool}', clear=True).start()
+        mock.patch('accounts.email_backends._pool_pid', os.getpid()).start()
+        mock.patch('smtplib.SMTP', side_effect=self.new_session).start()
+        self.addCleanup(mock.patch.stopall)
+        self.sessions = []
+
+    def new_session(self, *args, **kwargs):
+        session = mock.MagicMock()
+        session.noop.return_value = (250, b'OK')
+        session.sendmail.return_value = {}
+        self.sessions.append(session)
+        return session
+
+    def send(self, count=1):
+        messages = [EmailMessage('Booking confirmed', 'See you soon.', 'hotel@example.com', ['guest@example.com'])
+                    for _ in range(count)]
+        return PooledEmailBackend().send_messages(messages)
+
+    def stats(self):
+        return pool_stats()['smtp.example.com:25']
+
+    def test_sessions_are_reused_across_close(self):
+        self.assertEqual(self.send(), 1)
+        self.assertEqual(self.send(), 1)
+        self.assertEqual(len(self.sessions), 1)
+        self.assertEqual(self.sessions[0].sendmail.call_count, 2)
+        self.sessions[0].quit.assert_not_called()
+        self.assertEqual([stats['messages'] for stats in self.stats()['idle']], [2])
+
+    def test_busy_sessions_are_reported(self):
+        backend = PooledEmailBackend()
+        backend.open()
+        backend.send_messages([EmailMessage('Booking confirmed', 'See you soon.', 'hotel@example.com', ['guest@example.com'])])
+        stats = self.stats()
+        self.assertEqual((stats['idle'], [session['messages'] for session in stats['in_use']]), ([], [1]))
+        backend.close()
+        self.assertEqual((len(self.stats()['idle']), self.stats()['in_use']), (1, []))
+
+    def test_sessions_are_recycled_after_the_message_limit(self):
+        self.send(2)
+        self.send(2)   #reaches the limit of 3 on the first session, which is closed for good
+        self.sessions[0].quit.assert_called_once()
+        self.send()
+        self.assertEqual(len(self.sessions), 2)
+        self.assertEqual(self.stats()['closed'], {'sessions': 1, 'messages': 4, 'failures': 0})
+
+    def test_dead_sessions_are_dropped(self):
+        self.send()
+        self.sessions[0].noop.side_effect = smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        self.assertEqual(self.send(), 1)
+        self.assertEqual(len(self.sessions), 2)
+        self.assertEqual(self.sessions[1].sendmail.call_count, 1)
+        self.assertEqual(self.stats()['closed']['sessions'], 1)
+        self.assertEqual(len(self.stats()['idle']), 1)
+
+    def test_forked_workers_open_their_own_sessions(self):
+        self.send()
+        with mock.patch('accounts.email_backends.os.getpid', return_value=-1):
+            self.send()
+        self.assertEqual(len(self.sessions), 2)
+        self.sessions[0].quit.assert_not_called()   #still the parent's to close
+        self.assertEqual(self.sessions[1].sendmail.call_count, 1)
+
+
+#Emails are rendered as plain text and HTML from the same context
+class EmailRenderingTests(SimpleTestCase):
+    def context(self, first_name):
+        return {'booking': {'guest_first_name': first_name, 'guest_last_name': 'Doe', 'branch': {'name': 'Cairo'},
+                            'room': {'room_number': 101}},
+                'booking_detail_url': 'https://example.com/guests/bookings/1'}
+
+    def test_both_variants_use_the_context(self):
+        text, html = render_email('check_in_reminder_email', self.context('Jane'))
+        self.assertIn('Jane', text)
+        self.assertIn('Jane', html)
+
+    def test_bulk_rendering_keeps_contexts_apart(self):
+        rendered = render_emails('check_in_reminder_email', [self.context('Jane'), self.context('Omar')])
+        self.assertIn('Jane', rendered[0][0])
+        self.assertIn('Omar', rendered[1][1])
@@ -1,35 +1,27 @@
-import threading
 import logging 
-from django.conf import settings
-from django.core.mail import send_mail
+from accounts.models import OutboundEmail
 
 #Instantiate logger
 logger = logging.getLogger(__name__)  
 
-#Email sending class using threading 
-class EmailThread(threading.Thread):
-    def __init__(self, subject, message, from_email, recipient_list, html_message=None, fail_silently=False):
-        self.subject = subject
-        self.message = message
-        self.from_email = from_email
-        self.recipient_list = recipient_list 
-        self.html_message = html_message
-        self.fail_silently = fail_silently
-        super().__init__()
+#Queue an email in the outbox (a single INSERT; sent in batches by the outbox dispatcher task)
+#Queued inside the caller's transaction, so an email is never sent for a change that was rolled back
+def queue_email(subject, message, from_email, recipient_list, html_message=None):
+    recipients = [recipient for recipient in recipient_list if recipient]   #e.g. bookings without an email
+    if not recipients:
+        return None
 
-    def run(self):
-        try:
-            mail_sent = send_mail(
-                subject=self.subject,
-                message=self.message,
-                html_message=self.html_message,
-                from_email=self.from_email,
-                recipient_list=self.recipient_list,
-                fail_silently=self.fail_silently)
-        
-            #log result        
-            logger.info(f'Mail sent successfully: {mail_sent}')
-        
-        except Exception as exc:
-            logger.warning(f'Failed to send email: {exc}')
+    return OutboundEmail.objects.create(
+        subject=subject,
+        message=message,
+        html_message=html_message,
+        from_email=from_email,
+        recipients=recipients)
 
+
+#Queue many emails with one bulk INSERT (dicts with the same arguments as queue_email)
+def queue_emails(emails, batch_size=1000):
+    rows = [OutboundEmail(subject=email['subject'], message=email['message'], html_message=email.get('html_message'),
+                          from_email=email['from_email'], recipients=[r for r in email['recipient_list'] if r])
+            for email in emails]
+    return OutboundEmail.objects.bulk_create([row for row in rows if row.recipients], batch_size=batch_size)
@@ -1,5 +1,5 @@
 from django.contrib import admin, messages
-from .models import Booking, Branch, Room 
+from .models import Booking, ArchivedBooking, Branch, Room, Allotment, RatePlan, Season, StayDiscount, OccupancyRate 
 from datetime import date, timedelta
 
 
@@ -154,7 +154,7 @@ class BookingsAdmin(admin.ModelAdmin):
         (
             'Room Details',
             {
-                'fields': ['branch', 'room', 'check_in_date', 'check_out_date', 'booking_date', 'last_modified'],
+                'fields': ['branch', 'room', 'check_in_date', 'check_out_date', 'allotment_partner', 'booking_date', 'last_modified'],
             },
         ),
     ]
@@ -178,4 +178,61 @@ class BookingsAdmin(admin.ModelAdmin):
         
         #send success feedback message to the admin 
         self.message_user(request, f'Booking successfully removed for:  {combined_message}', messages.SUCCESS)
+
+
+#Customize the Archived Bookings table in admin (read-only history)
+@admin.register(ArchivedBooking)
+class ArchivedBookingsAdmin(admin.ModelAdmin):
+    list_display = ['id', 'guest_first_name', 'guest_last_name', 'phone_number', 'email', 
+                    'branch', 'room', 'check_in_date', 'check_out_date', 'archived_at']
+    search_fields = ['^guest_first_name', '^guest_last_name', '=phone_number', '=email', '=id']
+    list_filter = ['branch', CheckOutDateFilter]
+    list_per_page = 25
+    list_select_related = ('branch', 'room')
+    ordering = ['-check_out_date']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+#Customize the Allotments table in admin
+@admin.register(Allotment)
+class AllotmentsAdmin(admin.ModelAdmin):
+    list_display = ['partner', 'branch', 'room_type', 'night', 'rooms', 'sold']
     
+    #sold is kept by the booking services
+    readonly_fields = ['sold']
+
+    search_fields = ['^partner', '^branch__name']
+    list_filter = ['partner', 'branch', 'room_type']
+    list_per_page = 50
+    list_select_related = ('branch',)
+    ordering = ['partner', 'branch', 'night', 'room_type']
+
+
+#Customize the Rate Plans table in admin (seasons, stay discounts and occupancy rates edited inline)
+class SeasonInline(admin.TabularInline):
+    model = Season
+    extra = 0
+
+
+class StayDiscountInline(admin.TabularInline):
+    model = StayDiscount
+    extra = 0
+
+
+class OccupancyRateInline(admin.TabularInline):
+    model = OccupancyRate
+    extra = 0
+
+
+@admin.register(RatePlan)
+class RatePlansAdmin(admin.ModelAdmin):
+    list_display = ['name', 'branch', 'room_type', 'weekend_multiplier', 'is_active']
+    list_filter = ['branch', 'room_type', 'is_active']
+    search_fields = ['name']
+    list_select_related = ('branch',)
+    inlines = [SeasonInline, StayDiscountInline, OccupancyRateInline]
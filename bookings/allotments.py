@@ -0,0 +1,54 @@
+from django.db.models import F, Min, Count
+from bookings.models import Allotment, Room
+from bookings.inventory import stay_nights
+from bookings.availability import filter_available
+
+ALLOTMENT_SOLD_OUT_MESSAGE = 'The allotment has no rooms of this type left for these dates.'
+NO_ROOM_LEFT_MESSAGE = 'No room of this type is free for these dates.'
+
+
+#Set aside a number of rooms of a type for a partner on every night of [start, end)
+def allot_rooms(partner, branch, room_type, start, end, rooms):
+    Allotment.objects.bulk_create(
+        [Allotment(partner=partner, branch=branch, room_type=room_type, night=night, rooms=rooms)
+         for night in stay_nights(start, end)],
+        update_conflicts=True,
+        unique_fields=['partner', 'branch', 'room_type', 'night'],
+        update_fields=['rooms'])
+
+
+#Rooms left in an allotment for the whole stay (0 when a night isn't allotted)
+def allotment_remaining(partner, branch_id, room_type, check_in, check_out):
+    nights = Allotment.objects.filter(partner=partner, branch_id=branch_id, room_type=room_type,
+                                      night__gte=check_in, night__lt=check_out)
+    summary = nights.aggregate(remaining=Min(F('rooms') - F('sold')), nights=Count('id'))
+    if summary['nights'] < len(stay_nights(check_in, check_out)):
+        return 0
+    return summary['remaining']
+
+
+#Take one room from the allotment for every night of the stay with a single conditional UPDATE
+#Returns False if any night is sold out; the caller's transaction must then roll back the partial update
+def claim_allotment(partner, branch_id, room_type, check_in, check_out):
+    claimed = (Allotment.objects
+               .filter(partner=partner, branch_id=branch_id, room_type=room_type,
+                       night__gte=check_in, night__lt=check_out, sold__lt=F('rooms'))
+               .update(sold=F('sold') + 1))
+    return claimed == len(stay_nights(check_in, check_out))
+
+
+#Give a room back to the allotment for every night of the stay
+def release_allotment(partner, branch_id, room_type, check_in, check_out):
+    (Allotment.objects
+     .filter(partner=partner, branch_id=branch_id, room_type=room_type,
+             night__gte=check_in, night__lt=check_out, sold__gt=0)
+     .update(sold=F('sold') - 1))
+
+
+#Lock the first free room of a type, skipping rooms other transactions are booking right now
+def pick_free_room(branch_id, room_type, check_in, check_out):
+    rooms = Room.objects.filter(branch_id=branch_id, room_type=room_type)
+    return (filter_available(rooms, check_in, check_out)
+            .order_by('room_number')
+            .select_for_update(skip_locked=True)
+            .first())
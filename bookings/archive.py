@@ -0,0 +1,55 @@
+from django.db import transaction
+from django.db.models import Q
+from bookings.models import Booking, ArchivedBooking, GUEST_KEYS
+from bookings.lookups import name_key, email_key, phone_key
+
+#Soft-deleted bookings are moved to the archive so Bookings_table (and its unique indexes) only
+#hold current bookings; each batch is copied and deleted in one transaction, and rows locked by
+#another transaction are left for the next run
+ARCHIVE_BATCH_SIZE = 1000
+
+
+def archive_deleted_bookings(batch_size=ARCHIVE_BATCH_SIZE):
+    archived = 0
+    while True:
+        with transaction.atomic():
+            batch = list(Booking.all_objects.filter(is_deleted=True)
+                         .order_by('id').select_for_update(skip_locked=True)[:batch_size])
+            if not batch:
+                break
+            #ignore_conflicts: an id restored to Bookings_table by hand may already be archived
+            ArchivedBooking.objects.bulk_create([ArchivedBooking.from_booking(booking) for booking in batch],
+                                                ignore_conflicts=True)
+            Booking.all_objects.filter(pk__in=[booking.pk for booking in batch]).delete()
+        archived += len(batch)
+    return archived
+
+
+#A registered guest's current bookings and booking history: one query on the guest's bookings
+#(active ones and those deleted since the archiver last ran) and one on the archive. Besides bookings
+#linked to the account, they take unlinked ones carrying the guest's names, phone number and email (made
+#while signed out, or not yet linked by link_bookings_to_users): active ones through the guest key index,
+#archived ones through the archive's guest index
+def guest_booking_history(user):
+    linked = Q(user=user)
+    unlinked_active = Q(is_deleted=False, user__isnull=True, first_name_key=name_key(user.first_name),
+                        last_name_key=name_key(user.last_name), phone_key=phone_key(user.phone_number),
+                        email_key=email_key(user.email))
+    unlinked_archived = Q(user__isnull=True, phone_number=user.phone_number, email=user.email,
+                          guest_first_name=user.first_name, guest_last_name=user.last_name)
+
+    bookings = (Booking.all_objects.alias(**GUEST_KEYS).filter(linked | unlinked_active)
+                .select_related('branch', 'room').order_by('check_in_date'))
+    archived = (ArchivedBooking.objects.filter(linked | unlinked_archived)
+                .select_related('branch', 'room').order_by('-check_out_date'))
+
+    active_bookings, past_bookings = [], list(archived)
+    for booking in bookings:
+        if not booking.is_deleted:
+            active_bookings.append(booking)
+            continue
+        past = ArchivedBooking.from_booking(booking)
+        past.branch, past.room = booking.branch, booking.room   #already fetched
+        past_bookings.append(past)
+    past_bookings.sort(key=lambda booking: booking.check_out_date, reverse=True)
+    return active_bookings, past_bookings
@@ -0,0 +1,73 @@
+from datetime import date
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.db.backends.postgresql.psycopg_any import DateRange
+from bookings.models import Booking, Room
+from bookings.holds import held_room_ids, is_room_held
+
+
+#Error message shared by forms and serializers
+ROOM_UNAVAILABLE_MESSAGE = 'The selected room is already booked for these dates.'
+
+#Why a stay can't be searched or held (None when it can): dates in order, not in the past and at most
+#settings.MAX_STAY_NIGHTS nights
+def stay_error(check_in, check_out):
+    if check_in >= check_out:
+        return 'Check-out date must be after check-in date.'
+    if check_in < date.today():
+        return 'Check-in date cannot be in the past.'
+    if (check_out - check_in).days > settings.MAX_STAY_NIGHTS:
+        return f'Stays can be at most {settings.MAX_STAY_NIGHTS} nights long.'
+    return None
+
+
+#Name of the exclusion constraint guarding against double-booking
+OVERLAP_CONSTRAINT = 'exclude_overlapping_room_stays'
+
+
+#Active bookings that overlap the half-open stay [check_in, check_out)
+def overlapping_bookings(check_in, check_out, exclude_booking=None):
+    #uses the GiST index behind the exclusion constraint on (room, stay)
+    bookings = Booking.objects.filter(stay__overlap=DateRange(check_in, check_out))
+    if exclude_booking is not None:
+        bookings = bookings.exclude(pk=exclude_booking.pk)
+    return bookings
+
+
+#Narrow a room queryset down to rooms that are in service and have no booking during the stay
+def filter_bookable(rooms, check_in, check_out, exclude_booking=None):
+    booked = overlapping_bookings(check_in, check_out, exclude_booking).filter(room=OuterRef('pk'))
+    return rooms.filter(is_available=True).exclude(Exists(booked))
+
+
+#Narrow a room queryset down to rooms that are in service, free and not on hold for the stay
+#(hold_token lets a guest see the room they hold themselves)
+def filter_available(rooms, check_in, check_out, exclude_booking=None, hold_token=None):
+    rooms = filter_bookable(rooms, check_in, check_out, exclude_booking)
+
+    held = held_room_ids(check_in, check_out, exclude_token=hold_token)
+    if held:
+        rooms = rooms.exclude(pk__in=held)
+    return rooms
+
+
+#Rooms of a branch that are free for the stay
+def available_rooms(branch, check_in, check_out, exclude_booking=None, hold_token=None):
+    rooms = Room.objects.select_related('branch').filter(branch=branch)
+    return filter_available(rooms, check_in, check_out, exclude_booking, hold_token).order_by('room_number')
+
+
+#Check a single room for the stay (one indexed EXISTS query, then the room's holds)
+def is_room_available(room, check_in, check_out, exclude_booking=None, hold_token=None):
+    if not room.is_available:   #room taken out of service
+        return False
+    if overlapping_bookings(check_in, check_out, exclude_booking).filter(room=room).exists():
+        return False
+    return not is_room_held(room.pk, check_in, check_out, exclude_token=hold_token)
+
+
+#Check whether a database error was raised by the double-booking constraint
+#(by the constraint name psycopg reports, not the message text, which depends on the server's locale)
+def is_overlap_violation(exc):
+    diag = getattr(exc.__cause__, 'diag', None)
+    return getattr(diag, 'constraint_name', None) == OVERLAP_CONSTRAINT
@@ -0,0 +1,296 @@
+import math
+import time
+import random
+import uuid
+import hashlib
+from functools import wraps
+from datetime import timedelta
+from collections import defaultdict
+from django.core.cache import cache
+from django.db import transaction
+from django.conf import settings
+from django_redis import get_redis_connection
+from django.utils.http import quote_etag
+from django.utils.cache import get_cache_key, learn_cache_key, patch_response_headers, get_conditional_response
+from bookings.inventory import stay_nights
+from bookings.availability import overlapping_bookings
+from bookings.holds import held_room_ids
+
+#Cached answers are only ever replaced by bumping their version keys (see bump_availability);
+#the timeout just reclaims the memory of superseded entries
+AVAILABILITY_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+#Monday of the week a night falls in (availability is invalidated per branch and week)
+def week_bucket(night):
+    return night - timedelta(days=night.weekday())
+
+def stay_buckets(check_in, check_out):
+    return sorted({week_bucket(night) for night in stay_nights(check_in, check_out)})
+
+
+#Version keys: one per branch and week of nights, plus one per branch for its rooms
+def bucket_version_key(branch_id, bucket):
+    return f'availability:version:{branch_id}:{bucket.isoformat()}'
+
+def rooms_version_key(branch_id):
+    return f'availability:version:{branch_id}:rooms'
+
+
+#Read version keys in one round trip; missing (or evicted) keys start from the current time,
+#so they can never fall back to a version an old entry was stored under
+def get_versions(keys):
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return versions
+
+
+async def aget_versions(keys):
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, time.time_ns(), timeout=None)
+            versions[key] = await cache.aget(key)
+    return versions
+
+
+def bump_versions(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:   #key was never read or got evicted
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+#Invalidate cached availability of a branch for the weeks of a stay, once the change is committed
+def bump_availability(branch_id, check_in, check_out):
+    keys = [bucket_version_key(branch_id, bucket) for bucket in stay_buckets(check_in, check_out)]
+    transaction.on_commit(lambda: bump_versions(keys))
+
+
+#Invalidate all cached availability of a branch (rooms added, removed or taken out of service)
+def bump_branch_rooms(branch_id):
+    transaction.on_commit(lambda: bump_versions([rooms_version_key(branch_id)]))
+
+
+#Ids of rooms with a booking during the stay, per branch (rooms out of service are left to the query,
+#so the lists only grow with bookings; one cache round trip for the versions, one for the entries,
+#one query for all branches missing)
+def booked_room_ids(branch_ids, check_in, check_out):
+    buckets = stay_buckets(check_in, check_out)
+    branch_version_keys = {branch_id: [rooms_version_key(branch_id)] + [bucket_version_key(branch_id, bucket) for bucket in buckets]
+                           for branch_id in branch_ids}
+    versions = get_versions([key for keys in branch_version_keys.values() for key in keys])
+
+    #entry keys carry the versions they were computed under
+    entry_keys = {branch_id: f'availability:booked:{branch_id}:{check_in.isoformat()}:{check_out.isoformat()}:'
+                             + '.'.join(str(versions[key]) for key in keys)
+                  for branch_id, keys in branch_version_keys.items()}
+    cached = cache.get_many(list(entry_keys.values()))
+
+    room_ids = {branch_id: cached[key] for branch_id, key in entry_keys.items() if key in cached}
+    missing = [branch_id for branch_id in branch_ids if branch_id not in room_ids]
+    if missing:
+        computed = defaultdict(list)
+        bookings = overlapping_bookings(check_in, check_out).filter(branch_id__in=missing)
+        for branch_id, room_id in bookings.values_list('branch_id', 'room_id').distinct():
+            computed[branch_id].append(room_id)
+        fresh = {branch_id: computed[branch_id] for branch_id in missing}
+        cache.set_many({entry_keys[branch_id]: ids for branch_id, ids in fresh.items()}, timeout=AVAILABILITY_CACHE_TIMEOUT)
+        room_ids.update(fresh)
+
+    return {room_id for ids in room_ids.values() for room_id in ids}
+
+
+#Cached equivalent of availability.filter_available for searches (holds are applied after the cache).
+#Only the branches the rooms belong to are looked up, and rooms are excluded by the few that are
+#booked or held rather than matched against every free room
+def cached_filter_available(rooms, check_in, check_out, hold_token=None):
+    branch_ids = list(rooms.order_by().values_list('branch_id', flat=True).distinct())
+    taken_ids = booked_room_ids(branch_ids, check_in, check_out)
+    taken_ids |= held_room_ids(check_in, check_out, exclude_token=hold_token)
+    rooms = rooms.filter(is_available=True)
+    if taken_ids:
+        rooms = rooms.exclude(pk__in=taken_ids)
+    return rooms
+
+
+#Public pages are cached under the versions of their tags: 'branches' for anything listing branches,
+#'branch:<slug>' for a branch's own pages (its details and rooms). Signals bump the tags when branches
+#or rooms change, so cached pages are replaced as soon as an edit is committed and can live for hours
+#(settings.PAGE_CACHE_TIMEOUT)
+
+
+def page_tag_key(tag):
+    return f'pages:version:{tag}'
+
+def page_cache_prefix(tags):
+    keys = [page_tag_key(tag) for tag in tags]
+    versions = get_versions(keys)
+    return 'pages:' + '.'.join(str(versions[key]) for key in keys)
+
+async def apage_cache_prefix(tags):
+    keys = [page_tag_key(tag) for tag in tags]
+    versions = await aget_versions(keys)
+    return 'pages:' + '.'.join(str(versions[key]) for key in keys)
+
+
+#Context for template fragment caching ({% cache fragment_timeout <name> fragment_version %}) of blocks built
+#from branches and rooms: fragments are keyed by the same tag versions as whole pages, so pages that can't be
+#cached whole (personalized ones like staff_home, or a page cached once per session cookie) still share them
+def fragment_cache_context(*tags):
+    return {'fragment_version': page_cache_prefix(tags), 'fragment_timeout': settings.PAGE_CACHE_TIMEOUT}
+
+
+#Parts of a request a body depends on besides the resource: content negotiation and who is asking
+#(session cookie for pages, token for the API), so one client's ETag never matches another's copy
+def requester_fingerprint(request):
+    return '|'.join([request.headers.get('Accept', ''), request.headers.get('Authorization', ''),
+                     request.headers.get('Cookie', '')])
+
+#ETag from the versions a response was built from (see bookings.conditional)
+def make_etag(request, *versions):
+    parts = [str(version) for version in versions] + [requester_fingerprint(request)]
+    return quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+
+
+#Invalidate every cached page carrying one of the tags, once the change is committed
+def bump_page_tags(*tags):
+    keys = [page_tag_key(tag) for tag in tags]
+    transaction.on_commit(lambda: bump_versions(keys))
+
+
+#Stampede protection for cached pages: when an entry expires under load only one worker (holding a
+#Redis lock) recomputes it while the others keep serving the expired copy for up to PAGE_STALE_GRACE seconds,
+#and entries are refreshed a little early at random (XFetch, weighted by how long they took to compute)
+#so busy pages are usually refreshed before they expire at all
+PAGE_STALE_GRACE = 60 * 5
+PAGE_LOCK_TIMEOUT = 30
+PAGE_LOCK_WAIT = 0.5   #seconds a request without a cached copy waits for the worker computing it
+PAGE_LOCK_POLL = 0.05
+XFETCH_BETA = 1.0
+
+#Release a page lock only while it still holds the token of the request that took it
+#(it may have expired and been taken by another worker meanwhile)
+#KEYS: lock key  ARGV: token
+RELEASE_PAGE_LOCK_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+def page_needs_refresh(entry, now):
+    return now - entry['delta'] * XFETCH_BETA * math.log(1.0 - random.random()) >= entry['expires']
+
+
+def page_lock_key(request):
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'pages:lock:{url}'
+
+
+#Take the lock on a page; returns the token to release it with, or None if another worker holds it
+def acquire_page_lock(lock_key):
+    token = uuid.uuid4().hex
+    if get_redis_connection('default').set(lock_key, token, nx=True, ex=PAGE_LOCK_TIMEOUT):
+        return token
+    return None
+
+def release_page_lock(lock_key, token):
+    redis = get_redis_connection('default')
+    redis.register_script(RELEASE_PAGE_LOCK_SCRIPT)(keys=[lock_key], args=[token])
+
+def page_locked(lock_key):
+    return get_redis_connection('default').exists(lock_key)
+
+
+#Cached response for the request (Vary headers are taken into account like cache_page does;
+#HEAD requests fall back to the GET copy, as in Django's cache middleware)
+def get_cached_page(request, prefix):
+    key = get_cache_key(request, prefix, request.method, cache=cache)
+    entry = cache.get(key) if key else None
+    if entry is None and request.method == 'HEAD':
+        key = get_cache_key(request, prefix, 'GET', cache=cache)
+        entry = cache.get(key) if key else None
+    return entry
+
+
+#Render and cache a response the way cache_page would (200s only, nothing setting cookies or marked private)
+def cache_response(request, response, prefix, timeout, delta):
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    if (response.status_code != 200 or response.streaming or response.cookies 
+            or 'private' in response.get('Cache-Control', '')):
+        return response
+
+    #clients and nginx keep their copy for PAGE_CLIENT_MAX_AGE only, then revalidate it with the ETag
+    patch_response_headers(response, settings.PAGE_CLIENT_MAX_AGE)
+    key = learn_cache_key(request, response, timeout + PAGE_STALE_GRACE, prefix, cache=cache)
+    cache.set(key, {'response': response, 'expires': time.time() + timeout, 'delta': delta}, 
+              timeout=timeout + PAGE_STALE_GRACE)
+    return response
+
+
+#Cached copy of the page if there is one, or the view's response, cached for the next requests
+def serve_page(request, view, prefix, page_timeout, *args, **kwargs):
+    entry = get_cached_page(request, prefix)
+    if entry and not page_needs_refresh(entry, time.time()):
+        entry['response']['X-Cache'] = 'HIT'
+        return entry['response']
+
+    lock_key = page_lock_key(request)
+    token = acquire_page_lock(lock_key)
+    if token is None:   #another worker is refreshing it
+        if entry:
+            entry['response']['X-Cache'] = 'HIT' if time.time() < entry['expires'] else 'STALE'
+            return entry['response']
+        #nothing to serve yet: wait briefly for the other worker's copy (this blocks a sync worker,
+        #so no longer than a page usually takes to compute), then compute it too, without the lock
+        deadline = time.monotonic() + PAGE_LOCK_WAIT
+        while time.monotonic() < deadline and page_locked(lock_key):
+            time.sleep(PAGE_LOCK_POLL)
+        entry = get_cached_page(request, prefix)
+        if entry:
+            entry['response']['X-Cache'] = 'HIT'
+            return entry['response']
+
+    try:
+        started = time.time()
+        response = view(request, *args, **kwargs)
+        response = cache_response(request, response, prefix, page_timeout, time.time() - started)
+    finally:
+        if token is not None:
+            release_page_lock(lock_key, token)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+#cache_page with tag-versioned keys and stampede protection; tags may use the view's url kwargs,
+#e.g. 'branch:{branch_slug}'. Responses carry X-Cache: HIT, STALE (served while refreshing) or MISS,
+#and an ETag of the tag versions, so a client whose copy is current gets a 304 before anything is read or rendered
+def cache_page_tagged(*tags, timeout=None):
+    def decorator(view):
+        @wraps(view)
+        def wrapped_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            page_timeout = timeout or settings.PAGE_CACHE_TIMEOUT
+            prefix = page_cache_prefix([tag.format(**kwargs) for tag in tags])
+            etag = make_etag(request, prefix)
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return not_modified
+            response = serve_page(request, view, prefix, page_timeout, *args, **kwargs)
+            #set per request (cached responses are shared between clients with different ETags);
+            #a stale copy is about to be replaced, so it gets none
+            if response.status_code == 200 and response.get('X-Cache') != 'STALE':
+                response['ETag'] = etag
+            return response
+        return wrapped_view
+    return decorator
+
@@ -0,0 +1,39 @@
+from django.views.decorators.http import condition
+from bookings.models import Booking
+from bookings.caching import page_cache_prefix, make_etag
+
+#Conditional GET (ETag / Last-Modified) for branch, room and booking resources. Validators come from
+#the page tag versions (see bookings.caching) and Booking.last_modified, so answering a revalidation
+#takes a cache round trip or a one-row query and never renders the body (pages cached with
+#cache_page_tagged get their ETags there)
+
+
+#(last_modified, branch slug) of the booking a detail url points to, one query per request
+#(guest urls carry the booking id, staff urls the branch slug and room number)
+def booking_version(request, **kwargs):
+    if not hasattr(request, '_booking_version'):
+        if 'id' in kwargs:
+            bookings = Booking.objects.filter(id=kwargs['id'])
+        else:
+            bookings = Booking.objects.filter(branch__branch_slug=kwargs.get('branch_slug'),
+                                              room__room_number=kwargs.get('room_number'))
+        request._booking_version = bookings.values_list('last_modified', 'branch__branch_slug').first()
+    return request._booking_version
+
+
+#The booking's own changes move last_modified; its branch and room details move the branch's page tag
+def booking_etag(request, *args, **kwargs):
+    version = booking_version(request, **kwargs)
+    if version is None:   #let the view answer 404
+        return None
+    last_modified, branch_slug = version
+    return make_etag(request, last_modified.isoformat(), page_cache_prefix([f'branch:{branch_slug}']))
+
+
+def booking_last_modified(request, *args, **kwargs):
+    version = booking_version(request, **kwargs)
+    return version[0] if version else None
+
+
+#Decorator for booking detail views: 304 Not Modified when the client's copy is current
+booking_condition = condition(etag_func=booking_etag, last_modified_func=booking_last_modified)
@@ -1,11 +1,17 @@
 import django_filters
 from django_filters import FilterSet
 from bookings.models import Booking, Room, Branch
+from bookings.forms import CachedBranchChoiceField
 from django.db.models import Q
 from django import forms
 
 
 
+#Branch filter listing its choices from the reference cache (see bookings.forms.CachedBranchChoiceField)
+class CachedBranchChoiceFilter(django_filters.ModelChoiceFilter):
+    field_class = CachedBranchChoiceField
+
+
 #Filter for branches (not used)
 class BranchFilter(FilterSet):
     name = django_filters.CharFilter(method='filter_branch_name')
@@ -57,7 +63,7 @@ class BookingFilter(FilterSet):
         widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Nationality'})
     )
 
-    branch = django_filters.ModelChoiceFilter(
+    branch = CachedBranchChoiceFilter(
         label='Branch',
         queryset=Branch.objects.all(),
         widget=forms.Select(attrs={'class': 'form-select'})
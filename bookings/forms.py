@@ -1,10 +1,40 @@
 import re 
 from django import forms 
+from django.forms.models import ModelChoiceIterator
 from accounts.models import User 
 from bookings.models import Room, Booking, Branch 
+from bookings.availability import available_rooms, is_room_available, ROOM_UNAVAILABLE_MESSAGE
+from bookings.lookups import find_guest_booking, find_guest_booking_by_contact
+from bookings.reference import branch_rows
 from datetime import datetime, timedelta
 from django.db import transaction
-from django.db.models import Q 
+
+
+#Choices of all branches from the reference cache (no choices while the field's queryset is none())
+class CachedBranchIterator(ModelChoiceIterator):
+    def rows(self):
+        return [] if self.queryset.query.is_empty() else branch_rows()
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for branch in self.rows():
+            yield self.choice(branch)
+
+    def __len__(self):
+        return len(self.rows()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.rows())
+
+
+#Branch choice field rendering its choices without a query; the submitted branch is still validated
+#against the field's queryset (all branches unless given)
+class CachedBranchChoiceField(forms.ModelChoiceField):
+    iterator = CachedBranchIterator
+
+    def __init__(self, queryset=None, **kwargs):
+        super().__init__(queryset=Branch.objects.all() if queryset is None else queryset, **kwargs)
 
 
 #Booking Creation form 
@@ -31,8 +61,10 @@ class BookingForm(forms.ModelForm):
         fields = ['guest_first_name', 'guest_last_name', 'date_of_birth', 'gender', 'nationality',
                 'phone_number', 'email', 'id_number', 'id_photo', 'room', 'check_in_date', 'check_out_date']
     
-    def __init__(self, *args, branch=None, **kwargs):
+    def __init__(self, *args, branch=None, hold_token=None, **kwargs):
         super().__init__(*args, **kwargs)
+        #let Booking.clean() ignore the guest's own room hold
+        self.instance.hold_token = hold_token
         self.order_fields(['branch_name', 'guest_first_name', 'guest_last_name', 'date_of_birth', 'gender', 
                            'nationality', 'phone_number', 'email', 'id_number', 'id_photo', 'room', 'check_in_date', 
                            'check_out_date'])
@@ -41,17 +73,18 @@ class BookingForm(forms.ModelForm):
         if branch:
             self.current_branch = branch  #assign branch object 
             self.fields['branch_name'].initial = branch.name
+            #rooms in service; free nights are checked against the chosen dates
             self.fields['room'].queryset = Room.objects.select_related('branch').filter(branch=branch, is_available=True)
 
- 
-    def clean_room(self):
-        room = self.cleaned_data.get('room')
-        if room and not room.is_available:
-            raise forms.ValidationError("This room is already booked!")
-        return room
-    
     def clean(self):
         cleaned_data = super().clean() 
+        check_in = cleaned_data.get('check_in_date')
+        check_out = cleaned_data.get('check_out_date')
+
+        if check_in and check_out and check_in >= check_out:
+            raise forms.ValidationError("Check-out date must be after check-in date.")
+
+        #room availability for [check_in, check_out) is checked by Booking.clean()
         #pass current branch back to the view 
         cleaned_data['current_branch'] = self.current_branch
         return cleaned_data
@@ -86,24 +119,8 @@ class BookingRequestForm(forms.ModelForm):
         if not (guest_first_name and guest_last_name and guest_email_or_phone):
             return cleaned_data
         
-        #validate name 
-        if not Booking.objects.filter(guest_first_name__iexact=guest_first_name, guest_last_name__iexact=guest_last_name):
-            raise forms.ValidationError("No booking with the name provided.")
-        
-        #validate email or phone number
-        if '@' in guest_email_or_phone:
-            if not Booking.objects.filter(email__iexact=guest_email_or_phone):
-                raise forms.ValidationError('No booking with the email address provided.')
-        else:
-            guest_email_or_phone = User.normalize_phone_number(guest_email_or_phone)
-            if not Booking.objects.filter(phone_number=guest_email_or_phone):
-                raise forms.ValidationError('No booking with the phone number provided.')
-
-        #get requested booking and pass it to cleaned data
-        requested_booking = Booking.objects.filter(
-            (Q(guest_first_name=guest_first_name) & Q(guest_last_name=guest_last_name)) & 
-            (Q(email=guest_email_or_phone) | Q(phone_number=guest_email_or_phone))   
-        ).first()
+        #get requested booking and pass it to cleaned data (one indexed query on the normalized keys)
+        requested_booking = find_guest_booking_by_contact(guest_first_name, guest_last_name, guest_email_or_phone)
 
         #validate that booking exists
         if not requested_booking:
@@ -121,7 +138,7 @@ class ChangeBookingForm(forms.ModelForm):
                     widget=forms.TextInput(attrs={'readonly':'readonly'}))    
     
     #get branch choices for choosing new branch
-    new_branch = forms.ModelChoiceField(   
+    new_branch = CachedBranchChoiceField(   
         queryset=Branch.objects.none(),
         label="Select New Branch",
         empty_label="Select a branch",
@@ -170,7 +187,7 @@ class ChangeBookingForm(forms.ModelForm):
             self.fields['old_branch'].initial = old_booking.branch.name
             self.fields['old_room'].initial = old_booking.room.room_number
             self.fields['new_room'].queryset = Room.objects.select_related('branch').filter(branch=old_booking.branch, is_available=True).order_by('room_number')
-            self.fields['new_branch'].queryset = Branch.objects.all().order_by('name')
+            self.fields['new_branch'].queryset = Branch.objects.all()
 
 
     def clean(self):
@@ -186,28 +203,17 @@ class ChangeBookingForm(forms.ModelForm):
         new_check_in = cleaned_data.get('new_check_in_date')
         new_check_out = cleaned_data.get('new_check_out_date')
 
-        if not new_check_in or not new_check_out:
+        if not new_check_in or not new_check_out or not new_room:
             return cleaned_data
 
-        #normalize phone number
-        guest_phone_normalized = User.normalize_phone_number(guest_phone)
-
-        #fetch and check if the booking with the details provided exists in the database
-        booking = Booking.objects.select_related('branch', 'room').filter(guest_first_name=guest_first_name, 
-                                                                          guest_last_name=guest_last_name, 
-                                                                          phone_number=guest_phone_normalized)
-        
-        if not booking.exists():
+        #check a booking with the details provided exists in the database
+        if not find_guest_booking(guest_first_name, guest_last_name, phone_number=guest_phone):
             raise forms.ValidationError("No booking with the credentials provided!")
         
         #check if room number is different
         if (old_branch == new_branch) and (int(old_room.room_number) == int(new_room.room_number)):
             raise forms.ValidationError("You're already booked in this room. Please choose a different one.")
 
-        #double check if the new room is available 
-        if not new_room.is_available:
-            raise forms.ValidationError("This room is already booked.")        
-
         #Make sure booking change is at least 24 hours in advance
         now = datetime.now().date()
         if (old_booking.check_in_date - now) < timedelta(days=1):
@@ -216,6 +222,10 @@ class ChangeBookingForm(forms.ModelForm):
         if new_check_in >= new_check_out:
             raise forms.ValidationError("Check-out date cannot be set before check-in date!")
 
+        #check the new room is free for the new dates (ignoring this booking's own nights)
+        if not is_room_available(new_room, new_check_in, new_check_out, exclude_booking=old_booking):
+            raise forms.ValidationError(ROOM_UNAVAILABLE_MESSAGE)
+
         return cleaned_data
 
 
@@ -244,11 +254,11 @@ class ChangeRoomForm(forms.ModelForm):
         #get saved booking instance
         old_booking = self.instance 
         if old_booking:
-            #Initialize fields and filter rooms to only those available in the same hotel
+            #Initialize fields and filter rooms to those free for the booked dates in the same hotel
             self.fields['current_branch'].initial = old_booking.branch.name
             self.fields['old_room'].initial = old_booking.room.room_number
-            self.fields['new_room'].queryset = Room.objects.select_related('branch').filter(
-                branch=old_booking.branch, is_available=True).order_by('room_number')
+            self.fields['new_room'].queryset = available_rooms(old_booking.branch, old_booking.check_in_date, 
+                                                               old_booking.check_out_date, exclude_booking=old_booking)
 
 
     def clean(self):
@@ -260,20 +270,13 @@ class ChangeRoomForm(forms.ModelForm):
         old_room = old_booking.room 
         new_room = cleaned_data.get('new_room')
         
-        #normalize phone number
-        guest_phone_normalized = User.normalize_phone_number(guest_phone)
-
-        #fetch and check if the booking with the details provided exists in the database
-        booking = Booking.objects.select_related('branch', 'room').filter(guest_first_name=guest_first_name, 
-                                                                          guest_last_name=guest_last_name, 
-                                                                          phone_number=guest_phone_normalized)
-        
-        if not booking.exists():
+        #check a booking with the details provided exists in the database
+        if not find_guest_booking(guest_first_name, guest_last_name, phone_number=guest_phone):
             raise forms.ValidationError("No room booked with the credentials provided!")
 
-        #double check room availability 
-        if not new_room.is_available:
-            raise forms.ValidationError("This room is already booked.")
+        #room availability is enforced by the new_room queryset (free for the booked dates)
+        if not new_room:
+            return cleaned_data
 
         #check if room number is different, belongs to the same hotel, and is available
         if (int(old_room.room_number) == int(new_room.room_number)):
@@ -298,11 +301,8 @@ class DeleteBookingForm(forms.ModelForm):
         guest_phone_normalized = User.normalize_phone_number(guest_phone)
         cleaned_data['phone_number'] = guest_phone_normalized
 
-        try:
-            booking = Booking.objects.get(guest_first_name=guest_first_name, 
-                                          guest_last_name=guest_last_name,
-                                          phone_number=guest_phone_normalized)
-        except Booking.DoesNotExist:
+        booking = find_guest_booking(guest_first_name, guest_last_name, phone_number=guest_phone_normalized)
+        if not booking:
             raise forms.ValidationError("No booking found with the credentials provided.")
 
 
@@ -0,0 +1,195 @@
+import json
+import time
+import uuid
+import logging
+from datetime import date
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from bookings.inventory import stay_nights
+
+#Instantiate logger
+logger = logging.getLogger(__name__)
+
+#How long a room stays on hold while the guest fills in the booking form
+HOLD_TTL = 60 * 10   #10 minutes
+
+#Session key for the hold token of web guests
+HOLD_SESSION_KEY = 'room_hold'
+
+#How many live holds one client (signed-in user or address) may have at once
+MAX_HOLDS_PER_CLIENT = 3
+
+ROOM_HELD_MESSAGE = 'The selected room is on hold by another guest for these dates. Please choose another room.'
+HOLD_LIMIT_MESSAGE = f'You can hold at most {MAX_HOLDS_PER_CLIENT} rooms at a time. Book or release one of your holds first.'
+
+
+#Raised when a client already has as many live holds as it may
+class HoldLimitReached(Exception):
+    pass
+
+#Place a hold on every room-night at once, unless another token already holds one of them
+#or the client is at its limit of live holds (a limit of 0 means no limit)
+#KEYS: hold key, client key, room-night keys..., night index keys...
+#ARGV: token, ttl (ms), room id, expiry (ms), now (ms), hold data, hold limit
+PLACE_HOLD_SCRIPT = '''
+local nights = (#KEYS - 2) / 2
+local limit = tonumber(ARGV[7])
+for i = 3, nights + 2 do
+    local holder = redis.call('GET', KEYS[i])
+    if holder and holder ~= ARGV[1] then
+        return 0
+    end
+end
+if limit > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[5])
+    if not redis.call('ZSCORE', KEYS[2], ARGV[1]) and redis.call('ZCARD', KEYS[2]) >= limit then
+        return -1
+    end
+    redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+    if redis.call('PTTL', KEYS[2]) < tonumber(ARGV[2]) then
+        redis.call('PEXPIRE', KEYS[2], ARGV[2])
+    end
+end
+for i = 3, nights + 2 do
+    local index = KEYS[i + nights]
+    redis.call('SET', KEYS[i], ARGV[1], 'PX', ARGV[2])
+    redis.call('ZREMRANGEBYSCORE', index, '-inf', ARGV[5])
+    redis.call('ZADD', index, ARGV[4], ARGV[3] .. ':' .. ARGV[1])
+    if redis.call('PTTL', index) < tonumber(ARGV[2]) then
+        redis.call('PEXPIRE', index, ARGV[2])
+    end
+end
+redis.call('SET', KEYS[1], ARGV[6], 'PX', ARGV[2])
+return 1
+'''
+
+#Release the room-nights still held by a token and free its client's slot
+#KEYS: hold key, client key, room-night keys..., night index keys...  ARGV: token, room id
+RELEASE_HOLD_SCRIPT = '''
+local nights = (#KEYS - 2) / 2
+redis.call('ZREM', KEYS[2], ARGV[1])
+for i = 3, nights + 2 do
+    if redis.call('GET', KEYS[i]) == ARGV[1] then
+        redis.call('DEL', KEYS[i])
+    end
+    redis.call('ZREM', KEYS[i + nights], ARGV[2] .. ':' .. ARGV[1])
+end
+redis.call('DEL', KEYS[1])
+return 1
+'''
+
+
+#Redis keys
+def hold_key(token):
+    return f'hold:{token}'
+
+def room_night_key(room_id, night):
+    return f'hold:room:{room_id}:{night.isoformat()}'
+
+def night_index_key(night):
+    return f'hold:night:{night.isoformat()}'
+
+def client_key(client):
+    return f'hold:client:{client or "-"}'
+
+def hold_keys(token, room_id, check_in, check_out, client=None):
+    nights = stay_nights(check_in, check_out)
+    return ([hold_key(token), client_key(client)] + [room_night_key(room_id, night) for night in nights]
+            + [night_index_key(night) for night in nights])
+
+
+#Who holds count against: the signed-in user, else the client's address
+def hold_client(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    #nginx appends the address it saw, anything before it comes from the client
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')[-1].strip()
+    return f'ip:{forwarded or request.META.get("REMOTE_ADDR", "")}'
+
+
+#Hold a room for [check_in, check_out); returns the hold (or None if another guest holds it)
+#With a client, raises HoldLimitReached once it has max_holds live holds
+def place_hold(room_id, check_in, check_out, token=None, ttl=HOLD_TTL, client=None, max_holds=MAX_HOLDS_PER_CLIENT):
+    token = token or uuid.uuid4().hex
+    now = int(time.time() * 1000)
+    expires_at = now + ttl * 1000
+    hold = {'token': token, 'room_id': room_id, 'check_in': check_in.isoformat(),
+            'check_out': check_out.isoformat(), 'expires_at': expires_at, 'client': client}
+
+    try:
+        redis = get_redis_connection('default')
+        place = redis.register_script(PLACE_HOLD_SCRIPT)
+        placed = place(keys=hold_keys(token, room_id, check_in, check_out, client),
+                       args=[token, ttl * 1000, room_id, expires_at, now, json.dumps(hold),
+                             max_holds if client else 0])
+    except RedisError:
+        logger.exception(f'Could not place hold on room {room_id}.')
+        return None
+    if placed == -1:
+        raise HoldLimitReached(HOLD_LIMIT_MESSAGE)
+    return hold if placed else None
+
+
+#Get a hold by its token (None once it expired or was released)
+def get_hold(token):
+    if not token:
+        return None
+    try:
+        data = get_redis_connection('default').get(hold_key(token))
+    except RedisError:
+        logger.exception('Could not read room hold.')
+        return None
+    return json.loads(data) if data else None
+
+
+#Release a hold, e.g. once its booking is committed or the guest gives up
+def release_hold(token):
+    hold = get_hold(token)
+    if not hold:
+        return
+    try:
+        redis = get_redis_connection('default')
+        release = redis.register_script(RELEASE_HOLD_SCRIPT)
+        release(keys=hold_keys(token, hold['room_id'], date.fromisoformat(hold['check_in']),
+                               date.fromisoformat(hold['check_out']), hold.get('client')),
+                args=[token, hold['room_id']])
+    except RedisError:
+        logger.exception(f'Could not release hold {token}.')
+
+
+#Ids of rooms held by other guests on any night of [check_in, check_out)
+def held_room_ids(check_in, check_out, exclude_token=None):
+    nights = stay_nights(check_in, check_out)
+    if not nights:
+        return set()
+
+    now = int(time.time() * 1000)
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        for night in nights:
+            pipe.zrangebyscore(night_index_key(night), now, '+inf')
+        results = pipe.execute()
+    except RedisError:   #bookings are still guarded by the database
+        logger.exception('Could not read room holds.')
+        return set()
+
+    room_ids = set()
+    for members in results:
+        for member in members:
+            room_id, token = member.decode().split(':', 1)
+            if token != exclude_token:
+                room_ids.add(int(room_id))
+    return room_ids
+
+
+#Check whether another guest holds a room on any night of [check_in, check_out)
+def is_room_held(room_id, check_in, check_out, exclude_token=None):
+    keys = [room_night_key(room_id, night) for night in stay_nights(check_in, check_out)]
+    if not keys:
+        return False
+    try:
+        holders = get_redis_connection('default').mget(keys)
+    except RedisError:
+        logger.exception(f'Could not read holds for room {room_id}.')
+        return False
+    return any(holder and holder.decode() != exclude_token for holder in holders)
@@ -0,0 +1,171 @@
+import calendar
+from datetime import date, timedelta
+from collections import Counter
+from django.db import connection, transaction
+from django.db.models import F, Count
+from bookings.models import Booking, Room, RoomTypeAvailability
+
+
+#Advisory lock of the calendar: bookings moving nights take it shared (so they don't wait on each other),
+#a rebuild takes it exclusively, so no booking can change the counts between its count and its insert
+CALENDAR_LOCK_KEY = 4204001
+
+def lock_calendar(shared=True):
+    function = 'pg_advisory_xact_lock_shared' if shared else 'pg_advisory_xact_lock'
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {function}(%s)', [CALENDAR_LOCK_KEY])
+
+
+#List the nights of the half-open stay [check_in, check_out)
+def stay_nights(check_in, check_out):
+    return [check_in + timedelta(days=offset) for offset in range((check_out - check_in).days)]
+
+
+#Number of rooms of a type that are in service at a branch
+def count_rooms_in_service(branch_id, room_type):
+    return Room.objects.filter(branch_id=branch_id, room_type=room_type, is_available=True).count()
+
+
+#Add (delta=1) or remove (delta=-1) one booked room for every night of a stay
+def adjust_booked_nights(branch_id, room_type, check_in, check_out, delta):
+    nights = stay_nights(check_in, check_out)
+    if not nights:
+        return
+
+    rows = RoomTypeAvailability.objects.filter(branch_id=branch_id, room_type=room_type,
+                                               night__gte=check_in, night__lt=check_out)
+
+    #create the calendar rows that don't exist yet
+    existing_nights = set(rows.values_list('night', flat=True))
+    missing_nights = [night for night in nights if night not in existing_nights]
+    if missing_nights:
+        total_rooms = count_rooms_in_service(branch_id, room_type)
+        RoomTypeAvailability.objects.bulk_create(
+            [RoomTypeAvailability(branch_id=branch_id, room_type=room_type, night=night, total_rooms=total_rooms)
+             for night in missing_nights],
+            ignore_conflicts=True)
+
+    #atomic in-place counter update
+    if delta < 0:
+        rows = rows.filter(booked_rooms__gt=0)
+    rows.update(booked_rooms=F('booked_rooms') + delta)
+
+
+#Refresh the room totals of future nights after rooms are added, removed or changed
+def refresh_room_totals(branch_id, room_type):
+    with transaction.atomic():
+        lock_calendar()
+        total_rooms = count_rooms_in_service(branch_id, room_type)
+        RoomTypeAvailability.objects.filter(branch_id=branch_id, room_type=room_type,
+                                            night__gte=date.today()).update(total_rooms=total_rooms)
+
+
+#Nights a booking currently holds, as (branch_id, room_type, check_in, check_out)
+def current_stay(booking):
+    if booking.is_deleted or not (booking.room_id and booking.check_in_date and booking.check_out_date):
+        return None
+    return (booking.branch_id, booking.room.room_type, booking.check_in_date, booking.check_out_date)
+
+
+#Fields a booking's stay is made of
+STAY_FIELDS = ('branch_id', 'room_id', 'check_in_date', 'check_out_date', 'is_deleted')
+
+
+#Whether a booking was loaded with all of its stay fields (not deferred with only() or defer())
+def stay_loaded(booking):
+    loaded = getattr(booking, '_loaded_values', None)
+    return loaded is not None and all(field in loaded for field in STAY_FIELDS)
+
+
+#Nights a booking held when it was loaded from the database (None for new bookings, or when
+#the stay fields weren't loaded)
+def previous_stay(booking):
+    loaded = getattr(booking, '_loaded_values', None)
+    if not loaded or loaded.get('is_deleted') or not loaded.get('room_id'):
+        return None
+    branch_id, check_in, check_out = loaded.get('branch_id'), loaded.get('check_in_date'), loaded.get('check_out_date')
+    if not (branch_id and check_in and check_out):
+        return None
+
+    room_id = loaded['room_id']
+    if room_id == booking.room_id:
+        room_type = booking.room.room_type
+    else:
+        room_type = Room.objects.filter(pk=room_id).values_list('room_type', flat=True).first()
+    return (branch_id, room_type, check_in, check_out)
+
+
+#Remember the saved state so that later saves only apply their own difference
+def mark_stay_saved(booking):
+    loaded = getattr(booking, '_loaded_values', None)
+    if loaded is None:
+        loaded = booking._loaded_values = {}
+    for field in STAY_FIELDS:
+        loaded[field] = getattr(booking, field)
+
+
+#Move the booked counts from a booking's previous stay to its current one
+#(in the booking's transaction, so a rebuild waits for the booking to commit and then counts it)
+def apply_stay_change(old_stay, new_stay):
+    if old_stay == new_stay:
+        return
+    with transaction.atomic():
+        lock_calendar()
+        if old_stay:
+            adjust_booked_nights(*old_stay, delta=-1)
+        if new_stay:
+            adjust_booked_nights(*new_stay, delta=1)
+
+
+#Rebuild the calendar from the bookings table for the next number of days (a repair, e.g. after
+#restoring a backup: the signals keep the calendar up to date). Counting and rewriting happen in one
+#transaction under the exclusive calendar lock, so bookings saved meanwhile wait and are applied on top
+def rebuild_calendar(days=365, start=None):
+    start = start or date.today()
+    end = start + timedelta(days=days)
+
+    with transaction.atomic():
+        lock_calendar(shared=False)
+
+        #rooms in service per (branch, room type)
+        totals = {(row['branch_id'], row['room_type']): row['total'] for row in
+                  Room.objects.filter(is_available=True, branch__isnull=False)
+                  .values('branch_id', 'room_type').annotate(total=Count('id'))}
+
+        #booked rooms per (branch, room type, night)
+        booked = Counter()
+        stays = (Booking.objects.filter(room__isnull=False, check_in_date__lt=end, check_out_date__gt=start)
+                 .values_list('branch_id', 'room__room_type', 'check_in_date', 'check_out_date'))
+        for branch_id, room_type, check_in, check_out in stays.iterator(chunk_size=5000):
+            for night in stay_nights(max(check_in, start), min(check_out, end)):
+                booked[(branch_id, room_type, night)] += 1
+
+        rows = [RoomTypeAvailability(branch_id=branch_id, room_type=room_type, night=night, total_rooms=total,
+                                     booked_rooms=booked[(branch_id, room_type, night)])
+                for (branch_id, room_type), total in totals.items()
+                for night in stay_nights(start, end)]
+
+        RoomTypeAvailability.objects.filter(night__gte=start, night__lt=end).delete()
+        RoomTypeAvailability.objects.bulk_create(rows, batch_size=5000)
+    return len(rows)
+
+
+#Free rooms per room type for every night of a month at a branch
+def month_calendar(branch, year, month, room_type=None):
+    first_night = date(year, month, 1)
+    last_night = date(year, month, calendar.monthrange(year, month)[1])
+
+    rooms = Room.objects.filter(branch=branch, is_available=True)
+    if room_type:
+        rooms = rooms.filter(room_type=room_type)
+    totals = dict(rooms.values_list('room_type').annotate(total=Count('id')))
+
+    #nights without a calendar row have nothing booked
+    rows = RoomTypeAvailability.objects.filter(branch=branch, night__gte=first_night, night__lte=last_night)
+    if room_type:
+        rows = rows.filter(room_type=room_type)
+    booked = {(row.night, row.room_type): row.booked_rooms for row in rows}
+
+    return [{'night': night,
+             'free_rooms': {r_type: max(total - booked.get((night, r_type), 0), 0) for r_type, total in totals.items()}}
+            for night in stay_nights(first_night, last_night + timedelta(days=1))]
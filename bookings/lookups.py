@@ -0,0 +1,44 @@
+from django.db.models import Q
+from accounts.models import User
+from bookings.models import Booking, GUEST_KEYS
+
+
+#Guest details normalized the same way as the indexed key expressions on Booking (GUEST_KEYS)
+def name_key(name):
+    return name.lower()
+
+def email_key(email):
+    return email.lower()
+
+def phone_key(phone_number):
+    return User.normalize_phone_number(phone_number)
+
+
+#Query for a guest's active bookings by name and email and/or phone number, served by the key indexes
+#(names and email match case-insensitively, phone numbers in any format normalize_phone_number accepts)
+def guest_booking_lookup(first_name, last_name, email=None, phone_number=None):
+    contact = Q()
+    if email:
+        contact |= Q(email_key=email_key(email))
+    if phone_number:
+        contact |= Q(phone_key=phone_key(phone_number))
+
+    return (Booking.objects
+            .alias(**GUEST_KEYS)
+            .select_related('branch', 'room')
+            .filter(contact, first_name_key=name_key(first_name), last_name_key=name_key(last_name))
+            .order_by('check_in_date'))
+
+
+#A guest's (earliest) active booking, in a single query
+def find_guest_booking(first_name, last_name, email=None, phone_number=None):
+    if not (first_name and last_name and (email or phone_number)):
+        return None
+    return guest_booking_lookup(first_name, last_name, email=email, phone_number=phone_number).first()
+
+
+#Same lookup from a single 'email or phone number' input
+def find_guest_booking_by_contact(first_name, last_name, email_or_phone):
+    if email_or_phone and '@' in email_or_phone:
+        return find_guest_booking(first_name, last_name, email=email_or_phone)
+    return find_guest_booking(first_name, last_name, phone_number=email_or_phone)
@@ -0,0 +1,31 @@
+from datetime import date
+from django.db import IntegrityError
+from bookings.models import Branch, Room
+from bookings.allotments import allot_rooms
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Set aside rooms of a type at a branch for a partner's allotment, for every night of [start, end)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partner', required=True)
+        parser.add_argument('--branch', required=True, help='Branch slug')
+        parser.add_argument('--room-type', required=True, choices=[r_type for r_type, _ in Room.ROOM_TYPES])
+        parser.add_argument('--start', required=True, type=date.fromisoformat, help='First night (YYYY-MM-DD)')
+        parser.add_argument('--end', required=True, type=date.fromisoformat, help='Check-out date (YYYY-MM-DD)')
+        parser.add_argument('--rooms', required=True, type=int)
+
+    def handle(self, *args, **kwargs):
+        branch = Branch.objects.filter(branch_slug=kwargs['branch']).first()
+        if branch is None:
+            raise CommandError(f"Unknown branch: {kwargs['branch']}")
+        if kwargs['start'] >= kwargs['end']:
+            raise CommandError('End date must be after start date.')
+
+        try:
+            allot_rooms(kwargs['partner'], branch, kwargs['room_type'], kwargs['start'], kwargs['end'], kwargs['rooms'])
+        except IntegrityError:
+            raise CommandError('Cannot allot fewer rooms than have already been sold.')
+        self.stdout.write(self.style.SUCCESS(
+            f"Allotted {kwargs['rooms']} {kwargs['room_type']} rooms at {branch.name} to {kwargs['partner']}."))
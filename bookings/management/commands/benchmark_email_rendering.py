@@ -0,0 +1,49 @@
+import time
+from datetime import date, timedelta
+from django.template.loader import render_to_string
+from django.core.management.base import BaseCommand
+from accounts.emails import render_email, render_emails
+from bookings.models import Booking, Branch, Room
+
+
+class Command(BaseCommand):
+    help = 'Compare renders per second of the check-in reminder email: render_to_string vs the email renderer (run with production settings to measure the cached template loader).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renders', type=int, default=2000)
+
+    def handle(self, *args, **kwargs):
+        renders = kwargs['renders']
+
+        #in-memory booking, nothing is read from or written to the database
+        branch = Branch(name='Benchmark Branch', branch_slug='benchmark-branch')
+        room = Room(branch=branch, room_number=101, room_type='double', price_per_night=100)
+        booking = Booking(id=1, guest_first_name='Jane', guest_last_name='Doe', phone_number='0020100000000', 
+                          email='jane@example.com', branch=branch, room=room, 
+                          check_in_date=date.today() + timedelta(days=1), check_out_date=date.today() + timedelta(days=3))
+        context = {'booking': booking, 'booking_detail_url': 'https://example.com/guests/bookings/1'}
+
+        #current path: template looked up on every call and the plain text built by hand
+        def render_current():
+            render_to_string('emails/check_in_reminder_email.html', context=context)
+            return (f"Hi {booking.guest_first_name} {booking.guest_last_name},\n\n"
+                    f"Branch: {booking.branch.name}\nRoom Number: {booking.room.room_number}\n"
+                    f"Check-in Date: {booking.check_in_date}\nCheck-out Date: {booking.check_out_date}\n")
+
+        #warm up both paths so only steady-state rendering is measured
+        render_current()
+        render_email('check_in_reminder_email', context)
+
+        results = {
+            'render_to_string': self.measure(lambda: [render_current() for _ in range(renders)], renders),
+            'render_email': self.measure(lambda: [render_email('check_in_reminder_email', context) for _ in range(renders)], renders),
+            'render_emails (bulk)': self.measure(lambda: render_emails('check_in_reminder_email', [context] * renders), renders),
+        }
+        for name, per_second in results.items():
+            self.stdout.write(f'{name:<22} {per_second:>10.0f} renders/s')
+
+    #renders per second
+    def measure(self, run, renders):
+        start = time.perf_counter()
+        run()
+        return renders / (time.perf_counter() - start)
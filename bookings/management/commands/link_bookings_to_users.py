@@ -0,0 +1,49 @@
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+from accounts.models import User
+from bookings.models import Booking, ArchivedBooking
+
+
+class Command(BaseCommand):
+    help = ("Link bookings made before Booking.user existed to the registered guest they belong to "
+            "(same names, email and phone number), in batches. Safe to re-run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    #Users that may own the bookings, by email (one query per batch)
+    def candidate_users(self, bookings):
+        emails = {booking.email for booking in bookings}
+        users = User.objects.filter(email__in=emails, is_staff=False).only('id', 'first_name', 'last_name', 'email', 'phone_number')
+        return {user.email: user for user in users}
+
+    def link(self, queryset, batch_size):
+        linked, last_id = 0, 0
+        while True:
+            batch = list(queryset.filter(user__isnull=True, email__isnull=False, id__gt=last_id)
+                         .order_by('id').only('id', 'guest_first_name', 'guest_last_name', 'email', 'phone_number')[:batch_size])
+            if not batch:
+                return linked
+
+            users = self.candidate_users(batch)
+            matched, now = [], timezone.now()
+            for booking in batch:
+                user = users.get(booking.email)
+                if (user and user.first_name == booking.guest_first_name and user.last_name == booking.guest_last_name
+                        and User.normalize_phone_number(user.phone_number) == User.normalize_phone_number(booking.phone_number)):
+                    booking.user = user
+                    booking.last_modified = now
+                    matched.append(booking)
+
+            #bulk_update sends no signals and skips auto_now, so active bookings get last_modified
+            #(their ETag, see bookings.conditional) set here; archived ones keep the value they were archived with
+            fields = ['user', 'last_modified'] if queryset.model is Booking else ['user']
+            queryset.bulk_update(matched, fields)
+            linked += len(matched)
+            last_id = batch[-1].id
+            self.stdout.write(f'{queryset.model._meta.verbose_name_plural}: up to id {last_id}, {linked} linked')
+
+    def handle(self, *args, **kwargs):
+        bookings = self.link(Booking.all_objects.all(), kwargs['batch_size'])
+        archived = self.link(ArchivedBooking.objects.all(), kwargs['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Linked {bookings} bookings and {archived} archived bookings to their guests.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+from bookings.reference import REFERENCE_STATS_KEY
+
+
+class Command(BaseCommand):
+    help = ("Hit and miss counters of the reference data cache, summed over all workers "
+            "(each worker adds its counts about once a minute).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them.')
+
+    def handle(self, *args, **kwargs):
+        connection = get_redis_connection('default')
+        counters = {name.decode(): int(value) for name, value in connection.hgetall(REFERENCE_STATS_KEY).items()}
+        for tier in ('l1', 'l2'):
+            hits, misses = counters.get(f'{tier}_hits', 0), counters.get(f'{tier}_misses', 0)
+            ratio = hits / (hits + misses) if hits + misses else 0.0
+            self.stdout.write(f'{tier}: {hits} hits, {misses} misses ({ratio:.1%} hit ratio)')
+
+        if kwargs['reset']:
+            connection.delete(REFERENCE_STATS_KEY)
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
@@ -1,14 +1,33 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from bookings.startup import run_startup_tasks
 
+#Works in both sync (WSGI) and async (ASGI) request chains, so async views aren't pushed onto a thread
 class StartupSchedulerMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
         self.has_run = False
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
         if not self.has_run:
             run_startup_tasks()
             self.has_run = True
 
         response = self.get_response(request)
         return response
+
+    async def __acall__(self, request):
+        if not self.has_run:
+            await sync_to_async(run_startup_tasks)()
+            self.has_run = True
+
+        response = await self.get_response(request)
+        return response
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.2 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+#Room.is_available used to be flipped on every booking; it now only marks rooms in service
+def reset_room_availability(apps, schema_editor):
+    Room = apps.get_model('bookings', 'Room')
+    Room.objects.filter(is_available=False).update(is_available=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0004_alter_booking_id_number'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['room', 'check_in_date', 'check_out_date'], name='booking_room_stay_idx'),
+        ),
+        migrations.RunPython(reset_room_availability, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.2 on 2026-10-18 11:05
+
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0005_booking_room_stay_idx'),
+    ]
+
+    operations = [
+        #needed for the equality operator on room_id inside a GiST index
+        BtreeGistExtension(),
+        migrations.AddField(
+            model_name='booking',
+            name='stay',
+            field=models.GeneratedField(db_persist=True, expression=models.Func(models.F('check_in_date'), models.F('check_out_date'), function='DATERANGE', output_field=django.contrib.postgres.fields.ranges.DateRangeField()), output_field=django.contrib.postgres.fields.ranges.DateRangeField()),
+        ),
+        #superseded by the GiST index behind the exclusion constraint
+        migrations.RemoveIndex(
+            model_name='booking',
+            name='booking_room_stay_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=models.CheckConstraint(condition=models.Q(('check_out_date__gt', models.F('check_in_date'))), name='booking_check_out_after_check_in'),
+        ),
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('is_deleted', False)), expressions=[('room', '='), ('stay', '&&')], name='exclude_overlapping_room_stays'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.2 on 2026-10-18 12:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0006_booking_stay_exclusion_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomTypeAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_type', models.CharField(choices=[('single', 'Single'), ('double', 'Double'), ('deluxe', 'Deluxe'), ('double deluxe', 'Double Deluxe'), ('suite', 'Suite')], max_length=20)),
+                ('night', models.DateField()),
+                ('total_rooms', models.PositiveIntegerField(default=0)),
+                ('booked_rooms', models.PositiveIntegerField(default=0)),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='bookings.branch')),
+            ],
+            options={
+                'verbose_name_plural': 'Room Availability',
+                'db_table': 'Room_Availability_table',
+                'ordering': ['branch', 'night', 'room_type'],
+                'constraints': [models.UniqueConstraint(fields=('branch', 'night', 'room_type'), name='unique_branch_night_room_type')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0007_roomtypeavailability'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='allotment_partner',
+            field=models.SlugField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Allotment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('partner', models.SlugField()),
+                ('room_type', models.CharField(choices=[('single', 'Single'), ('double', 'Double'), ('deluxe', 'Deluxe'), ('double deluxe', 'Double Deluxe'), ('suite', 'Suite')], max_length=20)),
+                ('night', models.DateField()),
+                ('rooms', models.PositiveIntegerField(default=0)),
+                ('sold', models.PositiveIntegerField(default=0)),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allotments', to='bookings.branch')),
+            ],
+            options={
+                'verbose_name_plural': 'Allotments',
+                'db_table': 'Allotments_table',
+                'ordering': ['partner', 'branch', 'night', 'room_type'],
+                'constraints': [models.UniqueConstraint(fields=('partner', 'branch', 'room_type', 'night'), name='unique_partner_branch_room_type_night'), models.CheckConstraint(condition=models.Q(('sold__lte', models.F('rooms'))), name='allotment_sold_within_rooms')],
+            },
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.2 on 2026-10-18 14:30
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0008_allotment_booking_allotment_partner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatePlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('room_type', models.CharField(blank=True, choices=[('single', 'Single'), ('double', 'Double'), ('deluxe', 'Deluxe'), ('double deluxe', 'Double Deluxe'), ('suite', 'Suite')], max_length=20)),
+                ('weekend_multiplier', models.DecimalField(decimal_places=2, default=1, max_digits=4, validators=[django.core.validators.MinValueValidator(0)])),
+                ('is_active', models.BooleanField(default=True)),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rate_plans', to='bookings.branch')),
+            ],
+            options={
+                'verbose_name_plural': 'Rate Plans',
+                'db_table': 'Rate_Plans_table',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Season',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('multiplier', models.DecimalField(decimal_places=2, max_digits=4, validators=[django.core.validators.MinValueValidator(0)])),
+                ('rate_plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seasons', to='bookings.rateplan')),
+            ],
+            options={
+                'verbose_name_plural': 'Seasons',
+                'db_table': 'Seasons_table',
+                'ordering': ['start_date'],
+                'constraints': [models.CheckConstraint(condition=models.Q(('end_date__gte', models.F('start_date'))), name='season_end_after_start')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StayDiscount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_nights', models.PositiveIntegerField()),
+                ('discount_percent', models.DecimalField(decimal_places=2, max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('rate_plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stay_discounts', to='bookings.rateplan')),
+            ],
+            options={
+                'verbose_name_plural': 'Stay Discounts',
+                'db_table': 'Stay_Discounts_table',
+                'ordering': ['min_nights'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OccupancyRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_occupancy', models.PositiveIntegerField(validators=[django.core.validators.MaxValueValidator(100)])),
+                ('multiplier', models.DecimalField(decimal_places=2, max_digits=4, validators=[django.core.validators.MinValueValidator(0)])),
+                ('rate_plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy_rates', to='bookings.rateplan')),
+            ],
+            options={
+                'verbose_name_plural': 'Occupancy Rates',
+                'db_table': 'Occupancy_Rates_table',
+                'ordering': ['min_occupancy'],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.2 on 2026-10-18 16:05
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0009_rateplan_season_staydiscount_occupancyrate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBooking',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('guest_first_name', models.CharField(max_length=120)),
+                ('guest_last_name', models.CharField(max_length=120)),
+                ('date_of_birth', models.DateField(null=True)),
+                ('gender', models.CharField(choices=[('male', 'Male'), ('female', 'Female')], max_length=10)),
+                ('nationality', models.CharField(max_length=50)),
+                ('phone_number', models.CharField(max_length=20)),
+                ('email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('id_number', models.CharField(max_length=40, null=True)),
+                ('id_photo', models.ImageField(blank=True, null=True, upload_to='id_photos/')),
+                ('check_in_date', models.DateField(verbose_name='Check-in date')),
+                ('check_out_date', models.DateField(verbose_name='Check-out date')),
+                ('booking_date', models.DateTimeField()),
+                ('last_modified', models.DateTimeField()),
+                ('allotment_partner', models.SlugField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to='bookings.branch')),
+                ('room', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_bookings', to='bookings.room')),
+            ],
+            options={
+                'verbose_name_plural': 'Archived bookings',
+                'db_table': 'Archived_Bookings_table',
+                'ordering': ['-check_out_date'],
+                'indexes': [django.contrib.postgres.indexes.BrinIndex(fields=['check_out_date'], name='archived_check_out_brin'), models.Index(fields=['phone_number', 'email'], name='archived_guest_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 5.2.2 on 2026-10-18 16:40
+
+import accounts.validators
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    #indexes (unique ones included) are built concurrently, so Bookings_table stays writable while they are built
+    atomic = False
+
+    dependencies = [
+        ('bookings', '0010_archivedbooking'),
+    ]
+
+    operations = [
+        #partial unique constraints first, so uniqueness of active bookings never lapses; Postgres enforces them
+        #with unique indexes, which are built concurrently (AddConstraint would block writes while it builds them)
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql='CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "unique_active_booking_phone_number" ON "Bookings_table" ("phone_number") WHERE NOT "is_deleted"',
+                    reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS "unique_active_booking_phone_number"',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='booking',
+                    constraint=models.UniqueConstraint(condition=models.Q(('is_deleted', False)), fields=('phone_number',), name='unique_active_booking_phone_number', violation_error_message='A booking with this phone number already exists.'),
+                ),
+            ],
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql='CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "unique_active_booking_email" ON "Bookings_table" ("email") WHERE NOT "is_deleted"',
+                    reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS "unique_active_booking_email"',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='booking',
+                    constraint=models.UniqueConstraint(condition=models.Q(('is_deleted', False)), fields=('email',), name='unique_active_booking_email', violation_error_message='A booking with this email already exists.'),
+                ),
+            ],
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql='CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "unique_active_booking_id_number" ON "Bookings_table" ("id_number") WHERE NOT "is_deleted"',
+                    reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS "unique_active_booking_id_number"',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='booking',
+                    constraint=models.UniqueConstraint(condition=models.Q(('is_deleted', False)), fields=('id_number',), name='unique_active_booking_id_number', violation_error_message='A booking with this ID number already exists.'),
+                ),
+            ],
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql='CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "unique_active_booking_guest_room_check_in" ON "Bookings_table" ("guest_first_name", "guest_last_name", "branch_id", "room_id", "check_in_date") WHERE NOT "is_deleted"',
+                    reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS "unique_active_booking_guest_room_check_in"',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='booking',
+                    constraint=models.UniqueConstraint(condition=models.Q(('is_deleted', False)), fields=('guest_first_name', 'guest_last_name', 'branch', 'room', 'check_in_date'), name='unique_active_booking_guest_room_check_in', violation_error_message='This guest already has a booking for this room and check-in date.'),
+                ),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='booking',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='phone_number',
+            field=models.CharField(max_length=20, validators=[accounts.validators.validate_phone_number]),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='email',
+            field=models.EmailField(blank=True, max_length=254, null=True),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='id_number',
+            field=models.CharField(max_length=40, null=True),
+        ),
+        AddIndexConcurrently(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['branch', '-booking_date'], name='booking_branch_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('check_in_reminder_sent', False), ('is_deleted', False)), fields=['check_in_date'], name='booking_check_in_reminder_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['guest_first_name', 'guest_last_name', 'phone_number'], name='booking_guest_lookup_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.2 on 2026-10-18 17:20
+
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    #only expression indexes are added, built concurrently: the table isn't rewritten and takes writes throughout
+    atomic = False
+
+    dependencies = [
+        ('bookings', '0011_booking_partial_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='booking',
+            index=models.Index(django.db.models.functions.text.Lower('guest_last_name'), django.db.models.functions.text.Lower('guest_first_name'), models.Func(models.Func(models.F('phone_number'), models.Value('^\\+'), models.Value('00'), function='REGEXP_REPLACE'), models.Value('[^0-9]'), models.Value(''), models.Value('g'), function='REGEXP_REPLACE'), condition=models.Q(('is_deleted', False)), name='booking_guest_phone_key_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='booking',
+            index=models.Index(django.db.models.functions.text.Lower('email'), condition=models.Q(('is_deleted', False)), name='booking_email_key_idx'),
+        ),
+        #superseded by the index on the normalized keys (dropped once that one is in place)
+        RemoveIndexConcurrently(
+            model_name='booking',
+            name='booking_guest_lookup_idx',
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.2 on 2026-10-18 17:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    #indexes are built concurrently so Bookings_table stays writable during the migration
+    atomic = False
+
+    dependencies = [
+        ('bookings', '0012_booking_lookup_keys'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bookings', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedbooking',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_bookings', to=settings.AUTH_USER_MODEL),
+        ),
+        AddIndexConcurrently(
+            model_name='booking',
+            index=models.Index(fields=['user', 'check_in_date'], name='booking_user_check_in_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='archivedbooking',
+            index=models.Index(fields=['user', '-check_out_date'], name='archived_user_check_out_idx'),
+        ),
+    ]
@@ -1,5 +1,11 @@
 from django.db import models
+from django.conf import settings
 from django.db import transaction
+from django.db.models.functions import Lower
+from django.contrib.postgres.fields import DateRangeField
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.indexes import BrinIndex
+from django.contrib.postgres.fields.ranges import RangeOperators
 from django.template.defaultfilters import slugify
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -26,6 +32,13 @@ class Branch(models.Model):
 
     def __str__(self):
         return self.name   #the string stand-in for its value as a foreign key
+
+    #Keep the values loaded from the database (used to detect changes in signals)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
     
      #Customize the save method 
     def save(self, *args, **kwargs):
@@ -46,13 +59,22 @@ class Room(models.Model):
         ('suite', 'Suite')
     ]
 
+    #maximum number of guests per room type
+    ROOM_CAPACITIES = {
+        'single': 1, 
+        'double': 2, 
+        'deluxe': 2, 
+        'double deluxe': 4, 
+        'suite': 4
+    }
+
     #Model Fields
     branch = models.ForeignKey(Branch, on_delete=models.CASCADE, null=True)  
     room_number = models.IntegerField(unique=False)   
     room_type = models.CharField(max_length=20, choices=ROOM_TYPES) 
     room_img = models.ImageField(upload_to='room_images/', blank=True, null=True)  
     price_per_night = models.DecimalField(max_digits=7, decimal_places=2, validators=[MinValueValidator(0)])
-    is_available = models.BooleanField(default=True) 
+    is_available = models.BooleanField(default=True)   #room is in service (per-night availability comes from bookings)
 
     class Meta:
         db_table = 'Rooms_table'  
@@ -63,6 +85,18 @@ class Room(models.Model):
     def __str__(self):
         return f'{self.room_number}'   #the string stand-in for its value as a foreign key
 
+    #Keep the values loaded from the database (used to detect changes in signals)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    #room types that can host the given number of guests
+    @classmethod
+    def room_types_for_guests(cls, guests):
+        return [r_type for r_type, capacity in cls.ROOM_CAPACITIES.items() if capacity >= guests]
+
 
 #Guests manager class (for soft deleting guests)
 class BookingsManager(models.Manager):
@@ -75,9 +109,7 @@ class BookingsManager(models.Manager):
     def delete_booking(self, booking_id):
         try:
             booking = self.get(id=booking_id)   #get booking by id 
-            booking.room.is_available = True   #change room's availability
-            booking.room.save()
-            booking.is_deleted = True  # Soft delete
+            booking.is_deleted = True  # Soft delete (frees the room's nights)
             booking.save()
             return True   
         
@@ -88,13 +120,23 @@ class BookingsManager(models.Manager):
     def remove_canceled_booking(self, booking_id):
         try: 
             booking = self.get(id=booking_id)   #get booking by id 
-            booking.room.is_available = True   #change room's availability
-            booking.room.save()
-            booking.delete()  #remove completely
+            booking.delete()  #remove completely (frees the room's nights)
             return True 
         except self.model.DoesNotExist:
             return False 
 
+#Normalized guest details for indexed lookups (see bookings.lookups): lower-cased names and email,
+#phone number in the format of User.normalize_phone_number ('+' becomes '00', digits only).
+#Booking.Meta indexes these expressions, so queries alias them (Booking.objects.alias(**GUEST_KEYS))
+GUEST_KEYS = {
+    'first_name_key': Lower('guest_first_name'),
+    'last_name_key': Lower('guest_last_name'),
+    'email_key': Lower('email'),
+    'phone_key': models.Func(
+        models.Func(models.F('phone_number'), models.Value(r'^\+'), models.Value('00'), function='REGEXP_REPLACE'),
+        models.Value('[^0-9]'), models.Value(''), models.Value('g'), function='REGEXP_REPLACE'),
+}
+
 #Guests model to register hotel guests 
 class Booking(models.Model):
     #Model Fields 
@@ -104,9 +146,9 @@ class Booking(models.Model):
     date_of_birth = models.DateField(blank=False, null=True, validators=[validate_age])
     gender = models.CharField(max_length=10, choices=(('male', 'Male'), ('female', 'Female')))
     nationality = models.CharField(max_length=50)
-    phone_number = models.CharField(max_length=20, unique=True, validators=[validate_phone_number])
-    email = models.EmailField(blank=True, null=True, unique=True)
-    id_number = models.CharField(max_length=40, unique=True, blank=False, null=True)
+    phone_number = models.CharField(max_length=20, validators=[validate_phone_number])   #unique among active bookings (see Meta)
+    email = models.EmailField(blank=True, null=True)
+    id_number = models.CharField(max_length=40, blank=False, null=True)
     id_photo = models.ImageField (upload_to='id_photos/', blank=True, null=True, validators=[validate_image_size])  
     
     #Hotel-related fields 
@@ -114,9 +156,20 @@ class Booking(models.Model):
     room = models.ForeignKey(Room, null=True, on_delete=models.CASCADE) 
     check_in_date = models.DateField(verbose_name='Check-in date')
     check_out_date = models.DateField(verbose_name='Check-out date')
+    #nights occupied by the booking, i.e. [check_in_date, check_out_date) 
+    stay = models.GeneratedField(
+        expression=models.Func(models.F('check_in_date'), models.F('check_out_date'), 
+                               function='DATERANGE', output_field=DateRangeField()),
+        output_field=DateRangeField(),
+        db_persist=True,
+    )
     booking_date = models.DateTimeField(auto_now_add=True) 
     last_modified = models.DateTimeField(auto_now=True)
     check_in_reminder_sent = models.BooleanField(default=False)  #Reminder email flag
+    allotment_partner = models.SlugField(max_length=50, blank=True, null=True)  #partner whose allotment the booking was sold from
+    #registered guest the booking belongs to (indexed with check-in date in Meta)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True, on_delete=models.SET_NULL, 
+                             related_name='bookings', db_index=False)
     is_deleted = models.BooleanField(default=False)  #Soft delete field
 
     #Objects after filtering by manager
@@ -129,28 +182,234 @@ class Booking(models.Model):
     class Meta:
         db_table = 'Bookings_table'
         verbose_name_plural = 'Bookings'
-        unique_together = ('guest_first_name', 'guest_last_name', 'branch', 'room', 'check_in_date')
+        #uniqueness and indexes only cover active bookings (what Booking.objects reads); 
+        #soft-deleted rows stay out of the hot indexes until they're archived
+        constraints = [
+            models.CheckConstraint(condition=models.Q(check_out_date__gt=models.F('check_in_date')), 
+                                   name='booking_check_out_after_check_in'),
+            #no two active bookings may hold the same room on the same night (GiST-backed)
+            ExclusionConstraint(
+                name='exclude_overlapping_room_stays',
+                expressions=[('room', RangeOperators.EQUAL), ('stay', RangeOperators.OVERLAPS)],
+                condition=models.Q(is_deleted=False),
+            ),
+            models.UniqueConstraint(fields=['phone_number'], condition=models.Q(is_deleted=False), 
+                                    name='unique_active_booking_phone_number',
+                                    violation_error_message='A booking with this phone number already exists.'),
+            models.UniqueConstraint(fields=['email'], condition=models.Q(is_deleted=False), 
+                                    name='unique_active_booking_email',
+                                    violation_error_message='A booking with this email already exists.'),
+            models.UniqueConstraint(fields=['id_number'], condition=models.Q(is_deleted=False), 
+                                    name='unique_active_booking_id_number',
+                                    violation_error_message='A booking with this ID number already exists.'),
+            models.UniqueConstraint(fields=['guest_first_name', 'guest_last_name', 'branch', 'room', 'check_in_date'], 
+                                    condition=models.Q(is_deleted=False), name='unique_active_booking_guest_room_check_in',
+                                    violation_error_message='This guest already has a booking for this room and check-in date.'),
+        ]
+        indexes = [
+            #staff booking lists: one branch, newest first
+            models.Index(fields=['branch', '-booking_date'], condition=models.Q(is_deleted=False), 
+                         name='booking_branch_date_idx'),
+            #check-in reminders: upcoming arrivals that haven't been reminded yet
+            models.Index(fields=['check_in_date'], condition=models.Q(is_deleted=False, check_in_reminder_sent=False), 
+                         name='booking_check_in_reminder_idx'),
+            #guest lookups by name and phone number or email (normalized keys, see GUEST_KEYS)
+            models.Index(GUEST_KEYS['last_name_key'], GUEST_KEYS['first_name_key'], GUEST_KEYS['phone_key'], 
+                         condition=models.Q(is_deleted=False), name='booking_guest_phone_key_idx'),
+            models.Index(GUEST_KEYS['email_key'], condition=models.Q(is_deleted=False), 
+                         name='booking_email_key_idx'),
+            #registered guest's profile page (active and not yet archived bookings)
+            models.Index(fields=['user', 'check_in_date'], name='booking_user_check_in_idx'),
+        ]
 
     def __str__(self):
         return f'{self.guest_first_name} {self.guest_last_name}'
+
+    #Keep the values loaded from the database (used to detect changes in signals)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
     
 
     def clean(self):        
-        #Check if selected room is available
-        if self.room:   #if the room exists 
-            #if this is a new guest
-            if not self.pk:  
-                if not self.room.is_available:    
-                    raise ValidationError({'room': 'The selected room is already booked or unavailable'})            
-            
-            else:  
-                #else, if existing guest, fetch original booking object
-                guest_data = Booking.all_objects.get(pk=self.pk)  
-                #check if the room has changed
-                if self.room.room_number != guest_data.room.room_number: 
-                    #check if the new room is available
-                    if not self.room.is_available:   
-                        raise ValidationError({'room': 'The selected room is already booked or unavailable'})
+        #Check if selected room is free for the requested dates
+        if self.room and self.check_in_date and self.check_out_date:   #if the room and dates exist 
+            from bookings.availability import is_room_available, ROOM_UNAVAILABLE_MESSAGE
+
+            if self.check_in_date >= self.check_out_date:
+                raise ValidationError({'check_out_date': 'Check-out date must be after check-in date.'})
+
+            #ignore the booking itself when it is being changed, and the guest's own room hold
+            if not is_room_available(self.room, self.check_in_date, self.check_out_date, 
+                                     exclude_booking=self if self.pk else None,
+                                     hold_token=getattr(self, 'hold_token', None)):
+                raise ValidationError({'room': ROOM_UNAVAILABLE_MESSAGE})
         super().clean()
-    
 
+
+#History store for bookings moved out of Bookings_table once soft-deleted (expired or cancelled)
+#Rows keep their original booking id and are only ever appended, in roughly check-out order,
+#so a BRIN index covers date range scans at a fraction of a btree's size
+class ArchivedBooking(models.Model):
+    id = models.BigIntegerField(primary_key=True)   #id the booking had in Bookings_table
+    guest_first_name = models.CharField(max_length=120)
+    guest_last_name = models.CharField(max_length=120)
+    date_of_birth = models.DateField(null=True)
+    gender = models.CharField(max_length=10, choices=(('male', 'Male'), ('female', 'Female')))
+    nationality = models.CharField(max_length=50)
+    phone_number = models.CharField(max_length=20)   #not unique: guests come back
+    email = models.EmailField(blank=True, null=True)
+    id_number = models.CharField(max_length=40, null=True)
+    id_photo = models.ImageField(upload_to='id_photos/', blank=True, null=True)
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='archived_bookings')
+    room = models.ForeignKey(Room, null=True, on_delete=models.SET_NULL, related_name='archived_bookings')
+    check_in_date = models.DateField(verbose_name='Check-in date')
+    check_out_date = models.DateField(verbose_name='Check-out date')
+    booking_date = models.DateTimeField()
+    last_modified = models.DateTimeField()
+    allotment_partner = models.SlugField(max_length=50, blank=True, null=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True, on_delete=models.SET_NULL, 
+                             related_name='archived_bookings', db_index=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    #Booking fields copied over when archiving
+    COPIED_FIELDS = ['id', 'guest_first_name', 'guest_last_name', 'date_of_birth', 'gender', 'nationality',
+                     'phone_number', 'email', 'id_number', 'id_photo', 'branch_id', 'room_id', 'check_in_date',
+                     'check_out_date', 'booking_date', 'last_modified', 'allotment_partner', 'user_id']
+
+    class Meta:
+        db_table = 'Archived_Bookings_table'
+        verbose_name_plural = 'Archived bookings'
+        ordering = ['-check_out_date']
+        indexes = [
+            BrinIndex(fields=['check_out_date'], name='archived_check_out_brin'),
+            models.Index(fields=['phone_number', 'email'], name='archived_guest_idx'),
+            models.Index(fields=['user', '-check_out_date'], name='archived_user_check_out_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.guest_first_name} {self.guest_last_name}'
+
+    @classmethod
+    def from_booking(cls, booking):
+        return cls(**{field: getattr(booking, field) for field in cls.COPIED_FIELDS})
+
+
+#Materialized free-room counts per branch, room type and night (kept up to date by signals)
+class RoomTypeAvailability(models.Model):
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='availability')
+    room_type = models.CharField(max_length=20, choices=Room.ROOM_TYPES)
+    night = models.DateField()
+    total_rooms = models.PositiveIntegerField(default=0)   #rooms of this type in service
+    booked_rooms = models.PositiveIntegerField(default=0)   #rooms of this type booked for the night
+
+    class Meta:
+        db_table = 'Room_Availability_table'
+        verbose_name_plural = 'Room Availability'
+        ordering = ['branch', 'night', 'room_type']
+        constraints = [
+            models.UniqueConstraint(fields=['branch', 'night', 'room_type'], name='unique_branch_night_room_type'),
+        ]
+
+    def __str__(self):
+        return f'{self.branch_id} - {self.room_type} - {self.night}'
+
+    @property
+    def free_rooms(self):
+        return max(self.total_rooms - self.booked_rooms, 0)
+
+
+#Rooms of a type set aside for a partner (group or travel agency) at a branch, per night
+class Allotment(models.Model):
+    partner = models.SlugField(max_length=50)   #partner code, e.g. 'acme-travel'
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='allotments')
+    room_type = models.CharField(max_length=20, choices=Room.ROOM_TYPES)
+    night = models.DateField()
+    rooms = models.PositiveIntegerField(default=0)   #rooms set aside for the night
+    sold = models.PositiveIntegerField(default=0)   #rooms already booked from the allotment
+
+    class Meta:
+        db_table = 'Allotments_table'
+        verbose_name_plural = 'Allotments'
+        ordering = ['partner', 'branch', 'night', 'room_type']
+        constraints = [
+            models.UniqueConstraint(fields=['partner', 'branch', 'room_type', 'night'], name='unique_partner_branch_room_type_night'),
+            models.CheckConstraint(condition=models.Q(sold__lte=models.F('rooms')), name='allotment_sold_within_rooms'),
+        ]
+
+    def __str__(self):
+        return f'{self.partner} - {self.branch_id} - {self.room_type} - {self.night}'
+
+    @property
+    def remaining(self):
+        return self.rooms - self.sold
+
+
+#Rate plans: multipliers applied on top of Room.price_per_night 
+#(the most specific active plan for a branch and room type wins; blank branch/room type means all)
+class RatePlan(models.Model):
+    name = models.CharField(max_length=100)
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, null=True, blank=True, related_name='rate_plans')
+    room_type = models.CharField(max_length=20, choices=Room.ROOM_TYPES, blank=True)
+    weekend_multiplier = models.DecimalField(max_digits=4, decimal_places=2, default=1, validators=[MinValueValidator(0)])  #Friday and Saturday nights
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        db_table = 'Rate_Plans_table'
+        verbose_name_plural = 'Rate Plans'
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+#Season calendar: multiplier for the nights in [start_date, end_date]
+class Season(models.Model):
+    rate_plan = models.ForeignKey(RatePlan, on_delete=models.CASCADE, related_name='seasons')
+    name = models.CharField(max_length=100)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    multiplier = models.DecimalField(max_digits=4, decimal_places=2, validators=[MinValueValidator(0)])
+
+    class Meta:
+        db_table = 'Seasons_table'
+        verbose_name_plural = 'Seasons'
+        ordering = ['start_date']
+        constraints = [
+            models.CheckConstraint(condition=models.Q(end_date__gte=models.F('start_date')), name='season_end_after_start'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.start_date} - {self.end_date})'
+
+
+#Length-of-stay discount for stays of at least min_nights
+class StayDiscount(models.Model):
+    rate_plan = models.ForeignKey(RatePlan, on_delete=models.CASCADE, related_name='stay_discounts')
+    min_nights = models.PositiveIntegerField()
+    discount_percent = models.DecimalField(max_digits=5, decimal_places=2, validators=[MinValueValidator(0), MaxValueValidator(100)])
+
+    class Meta:
+        db_table = 'Stay_Discounts_table'
+        verbose_name_plural = 'Stay Discounts'
+        ordering = ['min_nights']
+
+    def __str__(self):
+        return f'{self.discount_percent}% from {self.min_nights} nights'
+
+
+#Occupancy-based multiplier for nights at least min_occupancy percent booked
+class OccupancyRate(models.Model):
+    rate_plan = models.ForeignKey(RatePlan, on_delete=models.CASCADE, related_name='occupancy_rates')
+    min_occupancy = models.PositiveIntegerField(validators=[MaxValueValidator(100)])   #percent of rooms of the type booked
+    multiplier = models.DecimalField(max_digits=4, decimal_places=2, validators=[MinValueValidator(0)])
+
+    class Meta:
+        db_table = 'Occupancy_Rates_table'
+        verbose_name_plural = 'Occupancy Rates'
+        ordering = ['min_occupancy']
+
+    def __str__(self):
+        return f'x{self.multiplier} from {self.min_occupancy}% occupancy'
@@ -0,0 +1,90 @@
+from decimal import Decimal
+from django.db.models import Q, Prefetch
+from bookings.models import RatePlan, Season, RoomTypeAvailability
+from bookings.inventory import stay_nights
+
+ONE = Decimal('1')
+CENTS = Decimal('0.01')
+WEEKEND_NIGHTS = {4, 5}   #Friday and Saturday nights (date.weekday())
+
+
+#Active rate plans that may apply to the branches, with their seasons overlapping the stay
+def load_rate_plans(branch_ids, check_in, check_out):
+    seasons = Season.objects.filter(start_date__lt=check_out, end_date__gte=check_in)
+    return list(RatePlan.objects
+                .filter(Q(branch__isnull=True) | Q(branch_id__in=branch_ids), is_active=True)
+                .prefetch_related(Prefetch('seasons', queryset=seasons), 'stay_discounts', 'occupancy_rates'))
+
+
+#Most specific plan for a branch and room type (branch and room type > branch > room type > all)
+def pick_rate_plan(plans, branch_id, room_type):
+    candidates = [plan for plan in plans if plan.branch_id in (None, branch_id) and plan.room_type in ('', room_type)]
+    return max(candidates, key=lambda plan: (plan.branch_id is not None, plan.room_type != ''), default=None)
+
+
+#Booked percentage of each branch's rooms per room type and night (from the availability calendar)
+def night_occupancy(branch_ids, check_in, check_out):
+    rows = (RoomTypeAvailability.objects
+            .filter(branch_id__in=branch_ids, night__gte=check_in, night__lt=check_out, total_rooms__gt=0)
+            .values_list('branch_id', 'room_type', 'night', 'total_rooms', 'booked_rooms'))
+    return {(branch_id, room_type, night): booked * 100 / total
+            for branch_id, room_type, night, total, booked in rows}
+
+
+#Price multiplier of every night of the stay under a plan (weekend x season x occupancy)
+def night_multipliers(plan, nights, occupancy):
+    if plan is None:
+        return [ONE] * len(nights)
+
+    seasons = list(plan.seasons.all())
+    tiers = sorted(plan.occupancy_rates.all(), key=lambda tier: tier.min_occupancy, reverse=True)
+
+    multipliers = []
+    for night, occupied in zip(nights, occupancy):
+        multiplier = ONE
+        if night.weekday() in WEEKEND_NIGHTS:
+            multiplier *= plan.weekend_multiplier
+        season = next((season for season in seasons if season.start_date <= night <= season.end_date), None)
+        if season:
+            multiplier *= season.multiplier
+        tier = next((tier for tier in tiers if occupied >= tier.min_occupancy), None)
+        if tier:
+            multiplier *= tier.multiplier
+        multipliers.append(multiplier)
+    return multipliers
+
+
+#Length-of-stay discount factor (the best discount the stay qualifies for)
+def stay_discount(plan, total_nights):
+    if plan is None:
+        return ONE
+    eligible = [discount.discount_percent for discount in plan.stay_discounts.all() if discount.min_nights <= total_nights]
+    return ONE - max(eligible, default=Decimal(0)) / 100
+
+
+#Total price of the stay for many rooms in one call, as {room id: total}
+#Multipliers only depend on branch and room type, so they are worked out once per group over the
+#nights of the stay and each room then costs a single multiplication of its base price
+def quote_rooms(rooms, check_in, check_out):
+    rooms = list(rooms)
+    nights = stay_nights(check_in, check_out)
+    if not rooms or not nights:
+        return {}
+
+    branch_ids = {room.branch_id for room in rooms}
+    plans = load_rate_plans(branch_ids, check_in, check_out)
+    occupancy = night_occupancy(branch_ids, check_in, check_out)
+
+    factors = {}
+    for branch_id, room_type in {(room.branch_id, room.room_type) for room in rooms}:
+        plan = pick_rate_plan(plans, branch_id, room_type)
+        vector = night_multipliers(plan, nights, [occupancy.get((branch_id, room_type, night), 0) for night in nights])
+        factors[(branch_id, room_type)] = sum(vector) * stay_discount(plan, len(nights))
+
+    return {room.pk: (room.price_per_night * factors[(room.branch_id, room.room_type)]).quantize(CENTS)
+            for room in rooms}
+
+
+#Total price of the stay for a single room
+def quote_room(room, check_in, check_out):
+    return quote_rooms([room], check_in, check_out).get(room.pk)
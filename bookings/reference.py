@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from bookings.models import Branch
+from bookings.caching import get_versions, page_tag_key
+
+#Instantiate logger
+logger = logging.getLogger(__name__)
+
+#Two-tier cache for reference data read on nearly every page but changed a few times a year (branches):
+#an LRU in each worker process, kept for REFERENCE_CACHE_TTL seconds, in front of Redis. Redis entries are
+#stored under the version of their page tag (see bookings.caching), and changes publish the tag on
+#REFERENCE_CHANNEL so every worker drops its local copy at once (the TTL bounds staleness if a message is lost)
+REFERENCE_CHANNEL = 'reference:invalidate'
+REFERENCE_STATS_KEY = 'reference:stats'
+REFERENCE_MAX_ENTRIES = 32
+REFERENCE_STATS_FLUSH = 60   #seconds between flushes of a worker's counters to Redis
+
+_local = OrderedDict()   #name -> (expires, tag, value)
+_lock = threading.Lock()
+_generation = 0   #bumped by every invalidation, so a fill that raced one isn't kept
+_listener_pid = None
+_counters = Counter()
+_unflushed = Counter()
+_flushed_at = time.monotonic()
+
+
+def drop_local(tag=None):
+    global _generation
+    with _lock:
+        for name in [name for name, (_, entry_tag, _) in _local.items() if tag is None or entry_tag == tag]:
+            del _local[name]
+        _generation += 1
+
+
+#Subscribe to invalidations; on any connection problem drop everything (messages may have been missed) and resubscribe
+def listen():
+    while True:
+        try:
+            pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(REFERENCE_CHANNEL)
+            drop_local()
+            for message in pubsub.listen():
+                drop_local(message['data'].decode())
+        except (RedisError, OSError):
+            logger.warning('Reference cache lost its invalidation channel, resubscribing.', exc_info=True)
+            drop_local()
+            time.sleep(1)
+
+
+#One listener thread per worker process (started lazily, so it runs in the forked worker and not the master)
+def ensure_listener():
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _lock:
+        if _listener_pid != os.getpid():
+            _local.clear()
+            _counters.clear()
+            _unflushed.clear()
+            threading.Thread(target=listen, name='reference-cache-listener', daemon=True).start()
+            _listener_pid = os.getpid()
+
+
+def count(counter):
+    global _flushed_at
+    with _lock:
+        _counters[counter] += 1
+        _unflushed[counter] += 1
+        if time.monotonic() - _flushed_at < REFERENCE_STATS_FLUSH:
+            return
+        pending = dict(_unflushed)
+        _unflushed.clear()
+        _flushed_at = time.monotonic()
+
+    #add this worker's counts to the totals of all workers (see the reference_cache_stats command)
+    try:
+        pipeline = get_redis_connection('default').pipeline()
+        for name, value in pending.items():
+            pipeline.hincrby(REFERENCE_STATS_KEY, name, value)
+        pipeline.execute()
+    except (RedisError, OSError):
+        logger.warning('Could not flush reference cache counters.', exc_info=True)
+
+
+#Counters of this worker: hits and misses of the local LRU (l1) and of Redis (l2)
+def reference_stats():
+    with _lock:
+        return dict(_counters)
+
+
+#Value of a reference entry: from this worker's LRU, else from Redis, else computed (compute must return a
+#picklable value that is never None); tag is the page tag whose bumps invalidate it
+def get_reference(name, tag, compute):
+    ensure_listener()
+    now = time.monotonic()
+    with _lock:
+        entry = _local.get(name)
+        if entry and entry[0] > now:
+            _local.move_to_end(name)
+            value = entry[2]
+        else:
+            value = None
+        generation = _generation
+    if value is not None:
+        count('l1_hits')
+        return value
+
+    count('l1_misses')
+    version_key = page_tag_key(tag)
+    key = f'reference:{name}:{get_versions([version_key])[version_key]}'
+    value = cache.get(key)
+    if value is None:
+        count('l2_misses')
+        value = compute()
+        cache.set(key, value, timeout=settings.PAGE_CACHE_TIMEOUT)
+    else:
+        count('l2_hits')
+
+    with _lock:
+        if generation == _generation:
+            _local[name] = (now + settings.REFERENCE_CACHE_TTL, tag, value)
+            _local.move_to_end(name)
+            while len(_local) > REFERENCE_MAX_ENTRIES:
+                _local.popitem(last=False)
+    return value
+
+
+#Drop every worker's local copies of a tag's entries once the change is committed
+#(call after bump_page_tags, so workers refilling read the new version)
+def invalidate_reference(tag):
+    def publish():
+        try:
+            get_redis_connection('default').publish(REFERENCE_CHANNEL, tag)
+        except (RedisError, OSError):
+            logger.warning(f'Could not publish reference cache invalidation for {tag}.', exc_info=True)
+    transaction.on_commit(publish)
+
+
+#All branches in name order, as sorted by the database (Branch.Meta.ordering); the instances are shared
+#between requests, so they are only read (listing pages and choice fields, see bookings.forms.CachedBranchChoiceField)
+def branch_rows():
+    return get_reference('branches', 'branches', lambda: list(Branch.objects.all()))
@@ -16,6 +16,21 @@ def clean_up_expired_bookings_schedule():
         task.enabled = True
         task.save()
 
+def archive_deleted_bookings_schedule():
+    crontab_schedule, _ = CrontabSchedule.objects.get_or_create(
+        hour='1', minute='0')  #runs an hour after the nightly clean up
+
+    #Create the periodic task with the defined schedule
+    task, created = PeriodicTask.objects.get_or_create(
+        crontab=crontab_schedule,
+        name='Archive deleted bookings',
+        task='bookings.tasks.archive_deleted_bookings_task'
+    )
+
+    if created:
+        task.enabled = True
+        task.save()
+
 def check_in_reminder_schedule():
     interval_schedule, _ = IntervalSchedule.objects.get_or_create(
         period='hours', every=4)  #runs every 4 hours
@@ -30,3 +45,18 @@ def check_in_reminder_schedule():
     if created:
         task.enabled = True
         task.save()
+
+def email_outbox_schedule():
+    interval_schedule, _ = IntervalSchedule.objects.get_or_create(
+        period='seconds', every=30)  #runs every 30 seconds
+
+    #Create the periodic task with the defined schedule
+    task, created = PeriodicTask.objects.get_or_create(
+        interval=interval_schedule,
+        name='Send queued emails from the outbox',
+        task='accounts.tasks.dispatch_email_outbox_task'
+    )
+
+    if created:
+        task.enabled = True
+        task.save()
@@ -0,0 +1,150 @@
+import time
+import logging
+from django.db import connection, transaction, IntegrityError, OperationalError
+from django.core.exceptions import ValidationError
+from bookings.models import Room
+from bookings.availability import is_room_available, is_overlap_violation, ROOM_UNAVAILABLE_MESSAGE
+from bookings.holds import release_hold
+from bookings.allotments import (claim_allotment, release_allotment, pick_free_room,
+                                  ALLOTMENT_SOLD_OUT_MESSAGE, NO_ROOM_LEFT_MESSAGE)
+
+#Instantiate logger
+logger = logging.getLogger(__name__)
+
+#Bounded retries for lock conflicts and serialization failures
+BOOKING_MAX_ATTEMPTS = 3
+BOOKING_RETRY_DELAY = 0.05   #seconds, grows linearly with each attempt
+
+#Postgres error codes worth retrying: lock not available, serialization failure, deadlock
+RETRYABLE_SQLSTATES = {'55P03', '40001', '40P01'}
+
+ROOM_BUSY_MESSAGE = 'The selected room is being booked by someone else. Please try again.'
+
+
+#Check whether a database error is a transient locking/serialization conflict
+def is_retryable(exc):
+    cause = exc.__cause__
+    sqlstate = getattr(cause, 'sqlstate', None) or getattr(cause, 'pgcode', None)
+    return sqlstate in RETRYABLE_SQLSTATES
+
+
+#Count the queries run on the default connection (used with connection.execute_wrapper)
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+#Lock room rows in primary-key order, so concurrent swaps can't deadlock
+def lock_rooms(*room_ids):
+    room_ids = sorted({room_id for room_id in room_ids if room_id})
+    rooms = Room.objects.select_for_update(nowait=True).filter(pk__in=room_ids).order_by('pk')
+    return {room.pk: room for room in rooms}
+
+
+#Run an operation in its own transaction, retrying transient lock conflicts
+#(an overlap caught by the exclusion constraint is reported on error_field)
+def run_with_retries(operation, error_field):
+    for attempt in range(1, BOOKING_MAX_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                return operation()
+
+        except OperationalError as exc:
+            if not is_retryable(exc):
+                raise
+            logger.info(f'Rooms are locked (attempt {attempt}/{BOOKING_MAX_ATTEMPTS}).')
+            if attempt == BOOKING_MAX_ATTEMPTS:
+                raise ValidationError({error_field: ROOM_BUSY_MESSAGE})
+            time.sleep(BOOKING_RETRY_DELAY * attempt)
+
+        except IntegrityError as exc:
+            #last line of defence: the exclusion constraint on (room, stay)
+            if not is_overlap_violation(exc):
+                raise
+            raise ValidationError({error_field: ROOM_UNAVAILABLE_MESSAGE})
+
+
+#Create a new booking while holding a row lock on its room
+#(raises ValidationError when the room is taken for the requested nights)
+#A guest's room hold is turned into the booking: it is ignored by the check and released on commit
+def create_booking(booking, hold_token=None):
+    def save_booking():
+        room = lock_rooms(booking.room_id)[booking.room_id]
+        if not is_room_available(room, booking.check_in_date, booking.check_out_date, hold_token=hold_token):
+            raise ValidationError({'room': ROOM_UNAVAILABLE_MESSAGE})
+        booking.save()
+        if hold_token:
+            transaction.on_commit(lambda: release_hold(hold_token))
+        return booking
+
+    return run_with_retries(save_booking, 'room')
+
+
+#Sell a booking from a partner's allotment: take the rooms off the allotment counter and
+#insert the booking in the same transaction, on the first free room of the type
+def create_allotment_booking(booking, partner, room_type):
+    def save_booking():
+        if not claim_allotment(partner, booking.branch_id, room_type, booking.check_in_date, booking.check_out_date):
+            raise ValidationError({'room_type': ALLOTMENT_SOLD_OUT_MESSAGE})
+
+        room = pick_free_room(booking.branch_id, room_type, booking.check_in_date, booking.check_out_date)
+        if room is None:
+            raise ValidationError({'room_type': NO_ROOM_LEFT_MESSAGE})
+
+        booking.room = room
+        booking.allotment_partner = partner
+        booking.save()
+        return booking
+
+    return run_with_retries(save_booking, 'room_type')
+
+
+#Move a booking to another room (and optionally branch and dates) in a single UPDATE,
+#holding locks on both the old and the new room. Returns the number of queries it ran.
+def change_booking(booking, new_room, new_branch=None, check_in=None, check_out=None):
+    changes = {'room': new_room}
+    if new_branch is not None:
+        changes['branch'] = new_branch
+    if check_in is not None:
+        changes['check_in_date'] = check_in
+    if check_out is not None:
+        changes['check_out_date'] = check_out
+
+    def apply_change():
+        room = lock_rooms(booking.room_id, new_room.pk)[new_room.pk]
+        if not is_room_available(room, changes.get('check_in_date', booking.check_in_date),
+                                 changes.get('check_out_date', booking.check_out_date), exclude_booking=booking):
+            raise ValidationError({'new_room': ROOM_UNAVAILABLE_MESSAGE})
+
+        #move an allotment booking's rooms to its new nights/room type (rolled back if sold out)
+        if booking.allotment_partner:
+            old_stay = (booking.branch_id, booking.room.room_type, booking.check_in_date, booking.check_out_date)
+            new_stay = (changes.get('branch', booking.branch).pk, room.room_type,
+                        changes.get('check_in_date', booking.check_in_date), changes.get('check_out_date', booking.check_out_date))
+            if old_stay != new_stay:
+                release_allotment(booking.allotment_partner, *old_stay)
+                if not claim_allotment(booking.allotment_partner, *new_stay):
+                    raise ValidationError({'new_room': ALLOTMENT_SOLD_OUT_MESSAGE})
+
+        previous = {field: getattr(booking, field) for field in changes}
+        for field, value in changes.items():
+            setattr(booking, field, value)
+        try:
+            #auto_now only applies to fields in update_fields (last_modified is the booking's ETag, see bookings.conditional)
+            booking.save(update_fields=[*changes, 'last_modified'])
+        except Exception:
+            #leave the booking as it was if the database rejects the change
+            for field, value in previous.items():
+                setattr(booking, field, value)
+            raise
+
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        run_with_retries(apply_change, 'new_room')
+
+    logger.debug(f'Booking {booking.pk} changed in {counter.count} queries.')
+    return counter.count
@@ -2,11 +2,15 @@ import logging
 from django.dispatch import receiver
 from django.conf import settings
 from django.dispatch import Signal
-from accounts.utils import EmailThread
+from accounts.emails import queue_templated_email
 from django.contrib.auth import get_user_model
 from django.db.models.signals import post_save, post_delete
-from django.template.loader import render_to_string
-from bookings.models import Booking
+from bookings.models import Booking, Branch, Room
+from bookings.allotments import release_allotment
+from bookings.caching import bump_availability, bump_branch_rooms, bump_page_tags
+from bookings.reference import invalidate_reference
+from bookings.inventory import (apply_stay_change, current_stay, previous_stay, 
+                                mark_stay_saved, refresh_room_totals, stay_loaded)
 
 #get user model 
 User = get_user_model()
@@ -29,19 +33,9 @@ def get_booking_detail_url(booking_id):
 def booking_confirmation_email(sender, instance, created, **kwargs):
     if created: 
         booking_detail_url = get_booking_detail_url(instance.id)
-        html_message = render_to_string('emails/booking_confirmation_email.html', 
-                        context={'booking': instance, 'booking_detail_url': booking_detail_url})
-        plain_message = (f'Hi {instance.guest_first_name} {instance.guest_last_name}, thank you for booking with us!\n'
-                         f'You can view or change your booking details here: {booking_detail_url}')
-        
-        EmailThread(
-            subject='Your room was booked successfully',
-            message=plain_message,
-            html_message=html_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[instance.email],
-            fail_silently=False
-        ).start()
+        queue_templated_email('booking_confirmation_email', 'Your room was booked successfully', 
+                              context={'booking': instance, 'booking_detail_url': booking_detail_url}, 
+                              recipient_list=[instance.email])
 
 
 
@@ -52,29 +46,8 @@ booking_updated_signal = Signal()
 #booking change signal
 @receiver(booking_updated_signal, dispatch_uid='booking_updated_email_handler')
 def booking_updated_email(sender, booking, **kwargs):
-    #html template with the booking
-    html_message = render_to_string('emails/booking_update_confirmation.html', context={'booking': booking})
-    #plain message
-    plain_message = (
-        f'Hi {booking.guest_first_name} {booking.guest_last_name},\n\n'
-        f'Your booking has been updated successfully.\n\n'
-        f'Current booking details:\n'
-        f'Guest name: {booking.guest_first_name} {booking.guest_last_name}\n'
-        f'Phone number: {booking.phone_number}\n' 
-        f'Branch: {booking.branch.name}\n'
-        f'Room: {booking.room.room_number}\n'
-        f'Check-in date: {booking.check_in_date}\n'
-        f'Check-out date: {booking.check_out_date}'
-    )
-
-    EmailThread(
-        subject='Your booking has been updated',
-        message=plain_message,
-        html_message=html_message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[booking.email],
-        fail_silently=False
-    ).start()
+    queue_templated_email('booking_update_confirmation', 'Your booking has been updated', 
+                          context={'booking': booking}, recipient_list=[booking.email])
 
 
 #Room changed email signal 
@@ -83,38 +56,104 @@ room_changed_signal = Signal()
 
 @receiver(room_changed_signal, dispatch_uid='room_changed_email_handler')
 def room_changed_email(sender, booking, old_room, **kwargs):
-    html_message = render_to_string('emails/room_change_confirmation.html', 
-                    context={'booking': booking, 'old_room': old_room})
-
-    plain_message = (
-        f'Hi {booking.guest_first_name} {booking.guest_last_name},\n\n'
-        f'Your room has been successfully changed from Room {old_room.room_number} to Room {booking.room.room_number}.'
-    )
-
-    EmailThread(
-        subject='Your room has been changed',
-        message=plain_message,
-        html_message=html_message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[booking.email],
-        fail_silently=False
-    ).start()
+    queue_templated_email('room_change_confirmation', 'Your room has been changed', 
+                          context={'booking': booking, 'old_room': old_room}, recipient_list=[booking.email])
 
 
 #Booking canceled email signal 
 @receiver(post_delete, sender=Booking, dispatch_uid='booking_cancelled_email_handler')
 def booking_cancellation_email(sender, instance, **kwargs):
-    html_message = render_to_string('emails/booking_cancelled_email.html', context={'booking': instance})
-    
-    plain_message = (f"Hi {instance.guest_first_name} {instance.guest_last_name},\n\n"
-                     f"Your booking has been cancelled successfully. If this was a mistake, please contact our support team immediately.\n")
-    
-    EmailThread(
-        subject='Your booking has been cancelled',
-        message=plain_message,
-        html_message=html_message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[instance.email],
-        fail_silently=False
-    ).start()
+    if instance.is_deleted:   #soft-deleted bookings being moved to the archive
+        return
+    queue_templated_email('booking_cancelled_email', 'Your booking has been cancelled', 
+                          context={'booking': instance}, recipient_list=[instance.email])
+
+
+#Availability calendar maintenance
+#Move booked nights when a booking is created, changed or soft-deleted
+@receiver(post_save, sender=Booking, dispatch_uid='booking_inventory_save_handler')
+def update_inventory_on_booking_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:   #skip fixture loading
+        return
+    #loaded with its stay deferred (e.g. only('check_in_reminder_sent')): Django saves loaded fields only, 
+    #so the stay didn't move
+    if not created and not stay_loaded(instance):
+        return
+    old_stay, new_stay = previous_stay(instance), current_stay(instance)
+    apply_stay_change(old_stay, new_stay)
+
+    #invalidate cached availability for the weeks the booking left and entered
+    if old_stay != new_stay:
+        for stay in (old_stay, new_stay):
+            if stay:
+                bump_availability(stay[0], stay[2], stay[3])
+
+    #give the partner's allotment its rooms back when the booking is cancelled
+    if instance.allotment_partner and old_stay and not new_stay:
+        release_allotment(instance.allotment_partner, *old_stay)
+    mark_stay_saved(instance)
+
+
+#Free booked nights when a booking is removed
+@receiver(post_delete, sender=Booking, dispatch_uid='booking_inventory_delete_handler')
+def update_inventory_on_booking_delete(sender, instance, **kwargs):
+    saved_stay = previous_stay(instance) if hasattr(instance, '_loaded_values') else current_stay(instance)
+    apply_stay_change(saved_stay, None)
+    if saved_stay:
+        bump_availability(saved_stay[0], saved_stay[2], saved_stay[3])
+    if instance.allotment_partner and saved_stay:
+        release_allotment(instance.allotment_partner, *saved_stay)
+
+
+#Refresh room totals when rooms are added, changed or taken out of service
+@receiver(post_save, sender=Room, dispatch_uid='room_inventory_save_handler')
+def update_inventory_on_room_save(sender, instance, raw=False, **kwargs):
+    if raw or not instance.branch_id:
+        return
+    refresh_room_totals(instance.branch_id, instance.room_type)
+    bump_branch_rooms(instance.branch_id)
+    bump_branch_pages(instance.branch_id)
+
+    #the room moved to another branch or room type
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded and loaded.get('branch_id') and (loaded['branch_id'], loaded['room_type']) != (instance.branch_id, instance.room_type):
+        refresh_room_totals(loaded['branch_id'], loaded['room_type'])
+        bump_branch_rooms(loaded['branch_id'])
+        bump_branch_pages(loaded['branch_id'])
+    instance._loaded_values = {**(loaded or {}), 'branch_id': instance.branch_id, 'room_type': instance.room_type}
+
+
+@receiver(post_delete, sender=Room, dispatch_uid='room_inventory_delete_handler')
+def update_inventory_on_room_delete(sender, instance, **kwargs):
+    if instance.branch_id:
+        refresh_room_totals(instance.branch_id, instance.room_type)
+        bump_branch_rooms(instance.branch_id)
+        bump_branch_pages(instance.branch_id)
+
+
+#Cached page invalidation (see caching.cache_page_tagged)
+#A branch's own pages show its details and rooms; branch lists only show branch details
+def bump_branch_pages(branch_id):
+    branch_slug = Branch.objects.filter(pk=branch_id).values_list('branch_slug', flat=True).first()
+    if branch_slug:   #None when the branch itself is being deleted (its own handler bumps it)
+        bump_page_tags(f'branch:{branch_slug}')
+
+
+@receiver(post_save, sender=Branch, dispatch_uid='branch_pages_save_handler')
+def invalidate_pages_on_branch_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    tags = {'branches', f'branch:{instance.branch_slug}'}
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded and loaded.get('branch_slug'):   #pages cached under the old slug
+        tags.add(f"branch:{loaded['branch_slug']}")
+    bump_page_tags(*tags)
+    invalidate_reference('branches')   #drop the branch lists cached in every worker
+    instance._loaded_values = {**(loaded or {}), 'branch_slug': instance.branch_slug}
+
+
+@receiver(post_delete, sender=Branch, dispatch_uid='branch_pages_delete_handler')
+def invalidate_pages_on_branch_delete(sender, instance, **kwargs):
+    bump_page_tags('branches', f'branch:{instance.branch_slug}')
+    invalidate_reference('branches')
 
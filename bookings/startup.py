@@ -9,7 +9,9 @@ def run_startup_tasks():
     if not already_executed.is_set():
         from bookings.schedules import (
             clean_up_expired_bookings_schedule,
-            check_in_reminder_schedule
+            archive_deleted_bookings_schedule,
+            check_in_reminder_schedule,
+            email_outbox_schedule
         )
 
         try:
@@ -18,10 +20,22 @@ def run_startup_tasks():
             logger.error('\nBookings clean up task failed to execute...')
             logger.exception(exc)
 
+        try:
+            archive_deleted_bookings_schedule()
+        except Exception as exc:
+            logger.error('\nArchive deleted bookings schedule failed to execute...')
+            logger.exception(exc)
+
         try:
             check_in_reminder_schedule()
         except Exception as exc:
             logger.error('\nCheck-in reminder schedule failed to execute...')
             logger.exception(exc)
 
+        try:
+            email_outbox_schedule()
+        except Exception as exc:
+            logger.error('\nEmail outbox schedule failed to execute...')
+            logger.exception(exc)
+
         already_executed.set()
@@ -1,11 +1,15 @@
 import logging
 from django.conf import settings
-from celery import shared_task
+from celery import shared_task, chord
+from django.core.cache import cache
+from django.db.models import Min, Max
 from django.utils import timezone
-from bookings.models import Booking
-from accounts.utils import EmailThread
-from datetime import date, timedelta
-from django.template.loader import render_to_string
+from django.db import transaction
+from bookings.models import Booking, Branch, RoomTypeAvailability
+from bookings.archive import archive_deleted_bookings
+from accounts.utils import queue_emails
+from accounts.emails import render_emails
+from datetime import date, datetime, timedelta
 
 #Instantiate logger 
 logger = logging.getLogger(__name__) 
@@ -18,70 +22,166 @@ def get_booking_detail_url(booking_id):
     return f'{protocol}://{domain}{path}'
 
 
-#Clean up expired bookings (set is_deleted to False)
+#Nightly cleanup is split into id ranges handled by parallel subtasks (a chord), each soft-deleting
+#expired bookings in small batches and checkpointing its progress so a retried subtask resumes where it stopped
+CLEANUP_RANGE_SIZE = 100000   #booking ids per subtask
+CLEANUP_BATCH_SIZE = 1000   #rows per UPDATE (keeps row locks short)
+CLEANUP_CHECKPOINT_TIMEOUT = 60 * 60 * 24
+
+
+def cleanup_checkpoint_key(run_date, start_id):
+    return f'cleanup:expired-bookings:{run_date}:{start_id}'
+
+
+#Past nights are no longer sellable; drop them from the availability calendar in batches (keeps row locks short)
+def drop_past_nights(today):
+    dropped = 0
+    while True:
+        batch = list(RoomTypeAvailability.objects.filter(night__lt=today).values_list('id', flat=True)[:CLEANUP_BATCH_SIZE])
+        if not batch:
+            return dropped
+        dropped += RoomTypeAvailability.objects.filter(id__in=batch).delete()[0]
+
+
+#Clean up expired bookings (set is_deleted to True)
 @shared_task(bind=True)
 def cleanup_expired_bookings_task(self):
     try:
         today = date.today()
-        expired_bookings = Booking.objects.filter(check_out_date__lt=today)
-        expired_bookings.update(is_deleted=True)
+        drop_past_nights(today)
+
+        bounds = Booking.objects.filter(check_out_date__lt=today).aggregate(first_id=Min('id'), last_id=Max('id'))
+        if bounds['first_id'] is None:
+            logger.info('Cleaning up expired bookings: nothing to do.')
+            return {'date': today.isoformat(), 'ranges': 0, 'bookings_expired': 0}
+
+        ranges = [(start_id, min(start_id + CLEANUP_RANGE_SIZE - 1, bounds['last_id'])) 
+                  for start_id in range(bounds['first_id'], bounds['last_id'] + 1, CLEANUP_RANGE_SIZE)]
+        chord(cleanup_expired_bookings_range_task.s(start_id, end_id, today.isoformat()) for start_id, end_id in ranges)(
+            cleanup_expired_bookings_summary_task.s(today.isoformat()))
+        logger.info(f'Cleaning up expired bookings in {len(ranges)} ranges.')
+
     except Exception as exc:
         logger.error(f'\nCleaning up expired bookings task failed:\n{exc}.\n\nTrying again...')
         self.retry(exc=exc, countdown=60, max_retries=10, retry_backoff=True, retry_backoff_max=60*5)
 
 
+#Soft-delete expired bookings with ids in [start_id, end_id], batch by batch
+@shared_task(bind=True)
+def cleanup_expired_bookings_range_task(self, start_id, end_id, run_date):
+    checkpoint_key = cleanup_checkpoint_key(run_date, start_id)
+    try:
+        checkpoint = cache.get(checkpoint_key) or {'last_id': start_id - 1, 'expired': 0}
+        last_id, expired = checkpoint['last_id'], checkpoint['expired']
+        while True:
+            batch = list(Booking.objects.filter(id__gt=last_id, id__lte=end_id, check_out_date__lt=run_date)
+                         .order_by('id').values_list('id', flat=True)[:CLEANUP_BATCH_SIZE])
+            if not batch:
+                break
+            expired += Booking.objects.filter(id__in=batch).update(is_deleted=True)
+            last_id = batch[-1]
+            cache.set(checkpoint_key, {'last_id': last_id, 'expired': expired}, timeout=CLEANUP_CHECKPOINT_TIMEOUT)
+
+        return {'start_id': start_id, 'end_id': end_id, 'bookings_expired': expired}
+
+    except Exception as exc:
+        logger.error(f'\nCleaning up expired bookings {start_id}-{end_id} failed:\n{exc}.\n\nTrying again...')
+        self.retry(exc=exc, countdown=60, max_retries=10, retry_backoff=True, retry_backoff_max=60*5)
+
+
+#Summary of a nightly cleanup run (stored in the Celery results backend)
+@shared_task
+def cleanup_expired_bookings_summary_task(results, run_date):
+    summary = {'date': run_date, 
+               'ranges': len(results), 
+               'bookings_expired': sum(result['bookings_expired'] for result in results)}
+    logger.info(f'Cleaning up expired bookings completed: {summary}')
+    return summary
+
+
+#Move soft-deleted (expired or cancelled) bookings to the archive
+@shared_task(bind=True)
+def archive_deleted_bookings_task(self):
+    try:
+        archived = archive_deleted_bookings()
+        logger.info(f'Archived {archived} deleted bookings.')
+        return {'bookings_archived': archived}
+
+    except Exception as exc:
+        logger.error(f'\nArchiving deleted bookings failed:\n{exc}.\n\nTrying again...')
+        self.retry(exc=exc, countdown=60, max_retries=10, retry_backoff=True, retry_backoff_max=60*5)
+
+
+#Check-in reminders are sent in chunks of bookings: one keyset query, one bulk render,
+#one bulk INSERT into the outbox and one UPDATE per chunk, so memory stays flat however many guests arrive
+REMINDER_CHUNK_SIZE = 500
+
+
+def send_check_in_reminders(window_start, window_end, branch_id=None):
+    bookings = Booking.objects.filter(check_in_date__gte=window_start, 
+                                      check_in_date__lt=window_end, 
+                                      check_in_reminder_sent=False)
+    if branch_id is not None:
+        bookings = bookings.filter(branch_id=branch_id)
+
+    sent, last_id = 0, 0
+    while True:
+        #keyset pagination on the primary key (no OFFSET scans, no long-lived cursor)
+        chunk = list(bookings.filter(id__gt=last_id).select_related('branch', 'room').order_by('id')[:REMINDER_CHUNK_SIZE])
+        if not chunk:
+            break
+
+        contexts = [{'booking': booking, 'booking_detail_url': get_booking_detail_url(booking.id)} for booking in chunk]
+        rendered = render_emails('check_in_reminder_email', contexts)
+
+        #queue the emails and mark the chunk together, so a retry never sends a reminder twice
+        with transaction.atomic():
+            queue_emails({'subject': 'Upcoming Check-In Reminder - Khalifa Hotels', 
+                          'message': text, 
+                          'html_message': html,
+                          'from_email': settings.DEFAULT_FROM_EMAIL, 
+                          'recipient_list': [booking.email]} 
+                         for booking, (text, html) in zip(chunk, rendered))
+            Booking.objects.filter(id__in=[booking.id for booking in chunk]).update(check_in_reminder_sent=True, last_modified=timezone.now())
+
+        sent += len(chunk)
+        last_id = chunk[-1].id
+    return sent
+
+
 #Reminder email one day before check-in task
+#(with fan_out, every branch is handled by its own task so the work spreads across workers)
 @shared_task(bind=True)
-def check_in_reminder_email_task(self):
+def check_in_reminder_email_task(self, fan_out=None):
     try:
         date_now = timezone.now()
         window_start = date_now + timedelta(hours=24)
         window_end = date_now + timedelta(hours=28) 
 
-        bookings = Booking.objects.filter(check_in_date__gte=window_start, 
-                                          check_in_date__lt=window_end, 
-                                          check_in_reminder_sent=False)
-
-        for booking in bookings:
-            booking_detail_url = get_booking_detail_url(booking.id)
-            html_message = render_to_string('emails/check_in_reminder_email.html', 
-                            context={'booking': booking, 'booking_detail_url': booking_detail_url})
-
-            plain_message = (
-                f"Hi {booking.guest_first_name} {booking.guest_last_name},\n\n"
-                f"This is a friendly reminder that your stay at Khalifa Hotels is scheduled to begin in less than 24 hours.\n\n"
-                f"Here are your booking details:\n"
-                f"Guest Name: {booking.guest_first_name} {booking.guest_last_name}\n"
-                f"Phone Number: {booking.phone_number}\n"
-                f"Email: {booking.email}\n"
-                f"Branch: {booking.branch.name}\n"
-                f"Room Number: {booking.room.room_number}\n"
-                f"Check-in Date: {booking.check_in_date}\n"
-                f"Check-out Date: {booking.check_out_date}\n\n"
-                f"Please double-check your check-in date and let us know if you need to make any changes.\n\n"
-                f"You can view your booking here: {booking_detail_url}\n\n"
-                f"If you have any questions or need assistance, feel free to contact our support team.\n\n"
-                f"Warm regards,\n"
-                f"Khalifa Hotels"
-            )
-
-            EmailThread(
-                subject='Upcoming Check-In Reminder - Khalifa Hotels',
-                message=plain_message,
-                html_message=html_message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[booking.email],
-                fail_silently=False
-            ).start()
-
-            #mark check-in reminder as sent
-            booking.check_in_reminder_sent = True
-            booking.save(update_fields=['check_in_reminder_sent'])
-
-        logger.info(f"Check-in reminder task completed successfully. {bookings.count()} emails sent.")
+        if fan_out is None:
+            fan_out = settings.CHECK_IN_REMINDER_FAN_OUT
+        if fan_out:
+            branch_ids = list(Branch.objects.values_list('id', flat=True))
+            for branch_id in branch_ids:
+                branch_check_in_reminder_email_task.delay(branch_id, window_start.isoformat(), window_end.isoformat())
+            logger.info(f"Check-in reminder task dispatched for {len(branch_ids)} branches.")
+            return
+
+        sent = send_check_in_reminders(window_start, window_end)
+        logger.info(f"Check-in reminder task completed successfully. {sent} emails queued.")
     
     except Exception as exc:
         logger.error(f'\nCheck-in reminder email task failed:\n{exc}.\n\nTrying again...')
         self.retry(exc=exc, countdown=30, max_retries=10, retry_backoff=True, retry_backoff_max=60*10)
 
 
+#Check-in reminders for a single branch (used when fanning out)
+@shared_task(bind=True)
+def branch_check_in_reminder_email_task(self, branch_id, window_start, window_end):
+    try:
+        sent = send_check_in_reminders(datetime.fromisoformat(window_start), datetime.fromisoformat(window_end), branch_id)
+        logger.info(f"Check-in reminders for branch {branch_id} completed successfully. {sent} emails queued.")
+
+    except Exception as exc:
+        logger.error(f'\nCheck-in reminder email task for branch {branch_id} failed:\n{exc}.\n\nTrying again...')
+        self.retry(exc=exc, countdown=30, max_retries=10, retry_backoff=True, retry_backoff_max=60*10)
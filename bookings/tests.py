@@ -1,3 +1,926 @@
-from django.test import TestCase
+import os
+import time
+import threading
+from itertools import count
+from collections import Counter
+from unittest import mock
+from decimal import Decimal
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_max_age
+from django.urls import reverse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, Client
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction, IntegrityError
+from django.core.exceptions import ValidationError
+from bookings.models import Booking, Branch, Room, RoomTypeAvailability, ArchivedBooking
+from bookings.models import RatePlan, Season, StayDiscount, OccupancyRate
+from bookings.inventory import stay_nights, previous_stay, rebuild_calendar
+from bookings.availability import is_room_available, filter_bookable, available_rooms, is_overlap_violation
+from bookings.services import create_booking, change_booking, create_allotment_booking
+from bookings.allotments import allot_rooms, allotment_remaining
+from bookings.pricing import quote_rooms, quote_room
+from bookings.caching import cached_filter_available, cache_page_tagged, bump_versions, page_tag_key
+from bookings.caching import page_lock_key, acquire_page_lock, release_page_lock, page_locked
+from bookings.archive import archive_deleted_bookings, guest_booking_history
+from bookings.lookups import guest_booking_lookup, find_guest_booking, find_guest_booking_by_contact
+from accounts.models import User, OutboundEmail
+from accounts.utils import queue_emails
+from bookings.holds import place_hold, get_hold, release_hold, is_room_held, held_room_ids, HoldLimitReached
+from bookings import reference
+from bookings.reference import get_reference, drop_local, invalidate_reference, reference_stats, branch_rows
+from bookings.forms import CachedBranchChoiceField
+from bookings import tasks
+from HotelBookingProject.celery import app as celery_app
 
-# Create your tests here.
+
+#Test data helpers (unique values for the fields that must be unique)
+sequence = count(1)
+
+def make_branch(**fields):
+    n = next(sequence)
+    defaults = {'name': f'Branch {n}', 'address': f'{n} Test Street', 'zipcode': f'{n:05d}',
+                'phone_number': f'+2010000{n:05d}', 'email': f'branch{n}@example.com'}
+    return Branch.objects.create(**{**defaults, **fields})
+
+def make_room(branch, room_type='double', **fields):
+    defaults = {'room_number': 100 + next(sequence), 'price_per_night': 100}
+    return Room.objects.create(branch=branch, room_type=room_type, **{**defaults, **fields})
+
+def new_booking(room, check_in, check_out, **fields):
+    n = next(sequence)
+    defaults = {'guest_first_name': 'Guest', 'guest_last_name': f'Number{n}', 'gender': 'female',
+                'nationality': 'Egyptian', 'phone_number': f'+2011000{n:05d}', 'email': f'guest{n}@example.com'}
+    return Booking(branch=room.branch, room=room, check_in_date=check_in, check_out_date=check_out,
+                   **{**defaults, **fields})
+
+def make_booking(room, check_in, check_out, **fields):
+    booking = new_booking(room, check_in, check_out, **fields)
+    booking.save()
+    return booking
+
+def make_user(**fields):
+    n = next(sequence)
+    defaults = {'first_name': 'Guest', 'last_name': f'Number{n}', 'date_of_birth': date(1990, 1, 1), 'gender': 'female',
+                'phone_number': f'+2012000{n:05d}'}
+    return User.objects.create_user(f'user{n}@example.com', 'password', **{**defaults, **fields})
+
+#Start this process's reference cache listener and let it subscribe (it drops every local entry once it has),
+#so it can't drop entries in the middle of a test
+def start_reference_listener():
+    if reference._listener_pid == os.getpid():
+        return
+    generation = reference._generation
+    reference.ensure_listener()
+    deadline = time.monotonic() + 5
+    while reference._generation == generation and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+#A night some days from today (bookings in tests are always in the future)
+def night(days):
+    return date.today() + timedelta(days=days)
+
+
+#Availability engine: stays are half-open [check_in, check_out), so a check-out day is free for the next arrival
+class AvailabilityEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch()
+        cls.room = make_room(cls.branch)
+        cls.booking = make_booking(cls.room, night(10), night(13))   #nights 10, 11 and 12
+
+    def test_stay_nights_are_half_open(self):
+        self.assertEqual(stay_nights(night(10), night(13)), [night(10), night(11), night(12)])
+        self.assertEqual(stay_nights(night(10), night(10)), [])
+
+    def test_overlapping_stays_are_unavailable(self):
+        for check_in, check_out in [(10, 13), (9, 11), (12, 14), (11, 12), (5, 20)]:
+            with self.subTest(check_in=check_in, check_out=check_out):
+                self.assertFalse(is_room_available(self.room, night(check_in), night(check_out)))
+
+    def test_adjacent_stays_are_available(self):
+        for check_in, check_out in [(13, 15), (8, 10), (13, 14), (9, 10)]:
+            with self.subTest(check_in=check_in, check_out=check_out):
+                self.assertTrue(is_room_available(self.room, night(check_in), night(check_out)))
+
+    def test_boundary_nights_are_booked(self):
+        #first night and last night (the one before check-out) of the stay
+        self.assertFalse(is_room_available(self.room, night(10), night(11)))
+        self.assertFalse(is_room_available(self.room, night(12), night(13)))
+
+    def test_booking_being_changed_does_not_block_itself(self):
+        self.assertTrue(is_room_available(self.room, night(11), night(14), exclude_booking=self.booking))
+        self.assertFalse(is_room_available(self.room, night(11), night(14)))
+
+    def test_soft_deleted_bookings_free_their_nights(self):
+        Booking.objects.delete_booking(self.booking.id)
+        self.assertTrue(is_room_available(self.room, night(10), night(13)))
+
+    def test_rooms_out_of_service_are_unavailable(self):
+        room = make_room(self.branch, is_available=False)
+        self.assertFalse(is_room_available(room, night(30), night(31)))
+        self.assertNotIn(room, filter_bookable(Room.objects.all(), night(30), night(31)))
+
+    def test_available_rooms_leave_out_booked_rooms(self):
+        free_room = make_room(self.branch)
+        self.assertEqual(list(available_rooms(self.branch, night(11), night(12))), [free_room])
+        self.assertEqual(list(available_rooms(self.branch, night(13), night(14))), [self.room, free_room])
+
+    def test_model_validation_rejects_overlapping_stays(self):
+        booking = Booking(branch=self.branch, room=self.room, check_in_date=night(12), check_out_date=night(15))
+        with self.assertRaises(ValidationError) as raised:
+            booking.clean()
+        self.assertIn('room', raised.exception.message_dict)
+
+    def test_model_validation_rejects_empty_stays(self):
+        booking = Booking(branch=self.branch, room=self.room, check_in_date=night(40), check_out_date=night(40))
+        with self.assertRaises(ValidationError) as raised:
+            booking.clean()
+        self.assertIn('check_out_date', raised.exception.message_dict)
+
+
+#Exclusion constraint: the database itself rejects overlapping active stays of a room
+class OverlapConstraintTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.room = make_room(make_branch())
+        cls.booking = make_booking(cls.room, night(10), night(13))
+
+    def insert_rejected(self, *args, **fields):
+        with self.assertRaises(IntegrityError) as raised, transaction.atomic():
+            make_booking(*args, **fields)
+        return raised.exception
+
+    def test_overlapping_stay_is_rejected(self):
+        exc = self.insert_rejected(self.room, night(12), night(14))
+        self.assertTrue(is_overlap_violation(exc))
+
+    def test_adjacent_stays_are_accepted(self):
+        make_booking(self.room, night(13), night(15))
+        make_booking(self.room, night(8), night(10))
+
+    def test_soft_deleted_bookings_are_ignored(self):
+        Booking.objects.delete_booking(self.booking.id)
+        make_booking(self.room, night(10), night(13))
+
+    def test_other_constraints_are_not_overlaps(self):
+        exc = self.insert_rejected(self.room, night(20), night(22), phone_number=self.booking.phone_number)
+        self.assertFalse(is_overlap_violation(exc))
+
+
+#Availability calendar: booked rooms per branch, room type and night, kept current by the booking signals
+class AvailabilityCalendarTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch()
+        cls.rooms = [make_room(cls.branch), make_room(cls.branch)]
+
+    def booked_rooms(self, *days):
+        counts = dict(RoomTypeAvailability.objects.filter(branch=self.branch, room_type='double')
+                      .values_list('night', 'booked_rooms'))
+        return [counts.get(night(day)) for day in days]
+
+    def test_bookings_count_their_nights(self):
+        make_booking(self.rooms[0], night(10), night(12))
+        make_booking(self.rooms[1], night(11), night(13))
+        self.assertEqual(self.booked_rooms(10, 11, 12, 13), [1, 2, 1, None])
+
+    def test_soft_deleted_bookings_free_their_nights(self):
+        booking = make_booking(self.rooms[0], night(10), night(12))
+        Booking.objects.delete_booking(booking.id)
+        self.assertEqual(self.booked_rooms(10, 11), [0, 0])
+
+    def test_moved_bookings_move_their_nights(self):
+        booking = Booking.objects.get(pk=make_booking(self.rooms[0], night(10), night(12)).pk)
+        booking.check_in_date, booking.check_out_date = night(11), night(13)
+        booking.save()
+        self.assertEqual(self.booked_rooms(10, 11, 12), [0, 1, 1])
+
+    def test_rebuild_repairs_drifted_counts(self):
+        make_booking(self.rooms[0], night(10), night(12))
+        make_booking(self.rooms[1], night(11), night(12))
+        RoomTypeAvailability.objects.update(booked_rooms=0)
+
+        rebuild_calendar(days=30)
+        self.assertEqual(self.booked_rooms(10, 11, 12), [1, 2, 0])
+        self.assertEqual(RoomTypeAvailability.objects.get(branch=self.branch, room_type='double', night=night(10)).total_rooms, 2)
+
+    def test_previous_stay_of_a_booking_loaded_without_its_dates(self):
+        booking = make_booking(self.rooms[0], night(10), night(12))
+        self.assertIsNone(previous_stay(Booking.objects.only('id', 'room', 'is_deleted').get(pk=booking.pk)))
+
+    def test_saving_a_booking_loaded_without_its_stay_keeps_the_counts(self):
+        booking = make_booking(self.rooms[0], night(10), night(12))
+        partial = Booking.objects.only('id', 'check_in_reminder_sent').get(pk=booking.pk)
+        partial.check_in_reminder_sent = True
+        partial.save()
+        self.assertEqual(self.booked_rooms(10, 11), [1, 1])
+
+
+#Parallel attempts to book the same rooms and nights (threads with their own connections, against the test
+#database): the room row lock and the exclusion constraint let exactly one booking per room through
+class ConcurrentBookingTests(TransactionTestCase):
+    ATTEMPTS = 24
+    WORKERS = 8
+
+    def test_exactly_one_winner_per_room(self):
+        branch = make_branch()
+        rooms = [make_room(branch), make_room(branch), make_room(branch)]
+        check_in, check_out = night(10), night(12)
+
+        attempts = list(range(self.ATTEMPTS))
+        start_gate = threading.Barrier(self.WORKERS)
+        lock = threading.Lock()
+        winners, outcomes = [], Counter()
+
+        def worker():
+            try:
+                start_gate.wait()
+                while True:
+                    with lock:
+                        if not attempts:
+                            return
+                        number = attempts.pop()
+                    booking = new_booking(rooms[number % len(rooms)], check_in, check_out)
+                    try:
+                        create_booking(booking)
+                        outcome = 'booked'
+                    except ValidationError:
+                        outcome = 'rejected'
+                    except Exception as exc:
+                        outcome = type(exc).__name__
+                    with lock:
+                        outcomes[outcome] += 1
+                        if outcome == 'booked':
+                            winners.append(booking)
+            finally:
+                connection.close()   #each thread has its own connection
+
+        threads = [threading.Thread(target=worker) for _ in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(dict(outcomes), {'booked': len(rooms), 'rejected': self.ATTEMPTS - len(rooms)})
+        self.assertEqual(Counter(booking.room_id for booking in winners), {room.id: 1 for room in rooms})
+        self.assertEqual(Booking.objects.filter(room__in=rooms, check_in_date=check_in).count(), len(rooms))
+
+
+#Booking changes: one locked UPDATE, checked against the other bookings of the new room
+class ChangeBookingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch()
+        cls.room, cls.other_room = make_room(cls.branch), make_room(cls.branch)
+        cls.booking = make_booking(cls.room, night(10), night(13))
+
+    def test_move_to_a_free_room(self):
+        change_booking(self.booking, self.other_room)
+        self.assertEqual(Booking.objects.get(pk=self.booking.pk).room, self.other_room)
+        self.assertTrue(is_room_available(self.room, night(10), night(13)))
+
+    def test_move_to_a_booked_room_is_rejected(self):
+        make_booking(self.other_room, night(12), night(14))
+        with self.assertRaises(ValidationError) as raised:
+            change_booking(self.booking, self.other_room)
+        self.assertIn('new_room', raised.exception.message_dict)
+        self.assertEqual(self.booking.room, self.room)
+        self.assertEqual(Booking.objects.get(pk=self.booking.pk).room, self.room)
+
+    def test_new_dates_in_the_same_room(self):
+        change_booking(self.booking, self.room, check_in=night(11), check_out=night(15))
+        saved = Booking.objects.get(pk=self.booking.pk)
+        self.assertEqual((saved.check_in_date, saved.check_out_date), (night(11), night(15)))
+
+    #query budgets: the savepoint and its release, the room locks, the overlap check and the UPDATE,
+    #plus the old room's type for a swap or the calendar moves (lock, read, fill, update per stay) for new dates
+    def test_room_swap_query_count(self):
+        self.assertLessEqual(change_booking(self.booking, self.other_room), 6)
+
+    def test_date_change_query_count(self):
+        self.assertLessEqual(change_booking(self.booking, self.room, check_in=night(11), check_out=night(15)), 14)
+
+    def test_changes_move_last_modified(self):
+        before = Booking.objects.get(pk=self.booking.pk).last_modified
+        change_booking(self.booking, self.other_room)
+        self.assertGreater(Booking.objects.get(pk=self.booking.pk).last_modified, before)
+
+
+#Stay pricing: the most specific rate plan, priced night by night and discounted by the length of the stay
+class PricingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch, cls.other_branch = make_branch(), make_branch()
+
+    def plan(self, branch=None, room_type='', discount=None, **fields):
+        plan = RatePlan.objects.create(name=f'Plan {next(sequence)}', branch=branch, room_type=room_type, **fields)
+        if discount is not None:
+            StayDiscount.objects.create(rate_plan=plan, min_nights=1, discount_percent=discount)
+        return plan
+
+    #first Thursday at least a month ahead
+    def thursday(self):
+        day = night(30)
+        return day + timedelta(days=(3 - day.weekday()) % 7)
+
+    def test_most_specific_plan_applies(self):
+        self.plan(discount=10)
+        self.plan(room_type='suite', discount=20)
+        self.plan(branch=self.branch, discount=30)
+        self.plan(branch=self.branch, room_type='suite', discount=40)
+        self.plan(branch=self.other_branch, room_type='single', discount=50, is_active=False)
+        rooms = [make_room(self.branch, 'suite'), make_room(self.branch, 'double'),
+                 make_room(self.other_branch, 'suite'), make_room(self.other_branch, 'single')]
+        quotes = quote_rooms(rooms, night(10), night(11))
+        self.assertEqual([quotes[room.pk] for room in rooms],
+                         [Decimal('60.00'), Decimal('70.00'), Decimal('80.00'), Decimal('90.00')])
+
+    def test_stay_across_a_weekend_and_a_season_boundary(self):
+        thursday = self.thursday()
+        plan = self.plan(weekend_multiplier=Decimal('1.20'))
+        Season.objects.create(rate_plan=plan, name='High season', start_date=thursday + timedelta(days=2),
+                              end_date=thursday + timedelta(days=60), multiplier=Decimal('1.50'))
+        StayDiscount.objects.create(rate_plan=plan, min_nights=4, discount_percent=10)
+        StayDiscount.objects.create(rate_plan=plan, min_nights=7, discount_percent=20)
+        room = make_room(self.branch, price_per_night=Decimal('99.99'))
+
+        #Thu x1, Fri x1.2, Sat x1.2 x1.5, Sun x1.5 = 5.5 nights' worth, less 10% for four nights
+        self.assertEqual(quote_room(room, thursday, thursday + timedelta(days=4)), Decimal('494.95'))
+        #Thu x1, Fri x1.2: too short for a discount and before the season
+        self.assertEqual(quote_room(room, thursday, thursday + timedelta(days=2)), Decimal('219.98'))
+
+    def test_busy_nights_cost_more(self):
+        plan = self.plan()
+        OccupancyRate.objects.create(rate_plan=plan, min_occupancy=50, multiplier=Decimal('1.30'))
+        OccupancyRate.objects.create(rate_plan=plan, min_occupancy=100, multiplier=Decimal('2.00'))
+        rooms = [make_room(self.branch), make_room(self.branch)]
+        make_booking(rooms[0], night(10), night(11))
+        self.assertEqual(quote_room(rooms[1], night(10), night(12)), Decimal('230.00'))
+
+    def test_rooms_without_a_plan_cost_their_base_price(self):
+        room = make_room(self.branch, price_per_night=Decimal('80.50'))
+        self.assertEqual(quote_room(room, night(10), night(13)), Decimal('241.50'))
+        self.assertIsNone(quote_room(room, night(13), night(10)))
+
+
+#Room holds in Redis (room ids that no test database room uses, so real holds can't interfere)
+class RoomHoldTests(SimpleTestCase):
+    def setUp(self):
+        self.room_id = 10 ** 9 + next(sequence)
+
+    def hold(self, check_in, check_out, **kwargs):
+        hold = place_hold(self.room_id, night(check_in), night(check_out), **kwargs)
+        if hold:
+            self.addCleanup(release_hold, hold['token'])
+        return hold
+
+    def test_hold_blocks_other_guests_only(self):
+        hold = self.hold(10, 12)
+        self.assertEqual(get_hold(hold['token'])['room_id'], self.room_id)
+        self.assertTrue(is_room_held(self.room_id, night(11), night(13)))
+        self.assertFalse(is_room_held(self.room_id, night(11), night(13), exclude_token=hold['token']))
+        self.assertIn(self.room_id, held_room_ids(night(10), night(11)))
+        self.assertNotIn(self.room_id, held_room_ids(night(10), night(11), exclude_token=hold['token']))
+
+    def test_overlapping_holds_are_refused(self):
+        self.hold(10, 12)
+        self.assertIsNone(self.hold(11, 13))
+        self.assertIsNotNone(self.hold(12, 14))   #starts on the first hold's check-out day
+
+    def test_guest_can_renew_their_own_hold(self):
+        hold = self.hold(10, 12)
+        self.assertIsNotNone(self.hold(10, 12, token=hold['token']))
+
+    def test_released_holds_free_the_room(self):
+        hold = self.hold(10, 12)
+        release_hold(hold['token'])
+        self.assertIsNone(get_hold(hold['token']))
+        self.assertFalse(is_room_held(self.room_id, night(10), night(12)))
+        self.assertNotIn(self.room_id, held_room_ids(night(10), night(12)))
+
+    def test_holds_expire(self):
+        hold = self.hold(10, 12, ttl=1)
+        time.sleep(1.2)
+        self.assertIsNone(get_hold(hold['token']))
+        self.assertFalse(is_room_held(self.room_id, night(10), night(12)))
+        self.assertNotIn(self.room_id, held_room_ids(night(10), night(12)))
+
+    def test_clients_have_a_limited_number_of_live_holds(self):
+        client = f'test:{self.room_id}'
+        first = self.hold(10, 11, client=client, max_holds=2)
+        self.hold(11, 12, client=client, max_holds=2)
+        with self.assertRaises(HoldLimitReached):
+            self.hold(12, 13, client=client, max_holds=2)
+        self.assertIsNotNone(self.hold(10, 11, token=first['token'], client=client, max_holds=2))   #renewing is not a new hold
+        release_hold(first['token'])
+        self.assertIsNotNone(self.hold(12, 13, client=client, max_holds=2))
+
+    def test_expired_holds_do_not_count_against_the_limit(self):
+        client = f'test:{self.room_id}'
+        self.hold(10, 11, client=client, max_holds=1, ttl=1)
+        time.sleep(1.2)
+        self.assertIsNotNone(self.hold(11, 12, client=client, max_holds=1))
+
+
+#Partner allotments: rooms set aside per night, sold with one conditional UPDATE per booking
+class AllotmentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch()
+        cls.rooms = [make_room(cls.branch), make_room(cls.branch)]
+        allot_rooms('acme-travel', cls.branch, 'double', night(10), night(13), rooms=1)
+
+    def remaining(self, check_in, check_out):
+        return allotment_remaining('acme-travel', self.branch.id, 'double', night(check_in), night(check_out))
+
+    def book(self, check_in, check_out):
+        return create_allotment_booking(new_booking(self.rooms[0], night(check_in), night(check_out)), 'acme-travel', 'double')
+
+    def test_remaining_rooms(self):
+        self.assertEqual(self.remaining(10, 13), 1)
+        self.assertEqual(self.remaining(12, 14), 0)   #night 13 isn't allotted
+
+    def test_booking_from_the_allotment(self):
+        booking = self.book(10, 12)
+        self.assertEqual(booking.room, self.rooms[0])
+        self.assertEqual(booking.allotment_partner, 'acme-travel')
+        self.assertEqual(self.remaining(10, 12), 0)
+        self.assertEqual(self.remaining(12, 13), 1)
+
+    def test_sold_out_nights_roll_the_whole_claim_back(self):
+        self.book(10, 12)
+        with self.assertRaises(ValidationError) as raised:
+            self.book(11, 13)
+        self.assertIn('room_type', raised.exception.message_dict)
+        self.assertEqual(self.remaining(12, 13), 1)   #night 12 was claimed before night 11 turned out sold out
+
+    def test_cancelled_bookings_give_their_rooms_back(self):
+        booking = self.book(10, 12)
+        Booking.objects.delete_booking(booking.id)
+        self.assertEqual(self.remaining(10, 13), 1)
+
+
+#Cached availability searches: booked rooms are cached per branch and week, holds are read live
+class CachedAvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch()
+        cls.rooms = [make_room(cls.branch) for _ in range(3)]
+        make_room(make_branch())   #another branch's room, never searched
+
+    def search(self, check_in, check_out, **kwargs):
+        rooms = cached_filter_available(Room.objects.filter(branch=self.branch), night(check_in), night(check_out), **kwargs)
+        return set(rooms)
+
+    def book(self, room, check_in, check_out):
+        with self.captureOnCommitCallbacks(execute=True):   #availability versions are bumped on commit
+            return make_booking(room, night(check_in), night(check_out))
+
+    def test_booked_and_held_rooms_are_left_out(self):
+        self.book(self.rooms[0], 10, 12)
+        hold = place_hold(self.rooms[1].pk, night(10), night(12))
+        self.addCleanup(release_hold, hold['token'])
+        self.assertEqual(self.search(11, 13), {self.rooms[2]})
+        self.assertEqual(self.search(11, 13, hold_token=hold['token']), {self.rooms[1], self.rooms[2]})
+        self.assertEqual(self.search(12, 14), set(self.rooms))
+
+    def test_bookings_replace_cached_answers(self):
+        self.assertEqual(self.search(10, 12), set(self.rooms))
+        self.book(self.rooms[2], 11, 12)
+        self.assertEqual(self.search(10, 12), set(self.rooms[:2]))
+
+    def test_cached_answers_skip_the_bookings_query(self):
+        self.search(10, 12)
+        with self.assertNumQueries(2):   #branches of the rooms, then the rooms themselves
+            self.search(10, 12)
+
+
+#Check-in reminders: guests arriving in the window are emailed chunk by chunk, once
+@mock.patch('bookings.tasks.REMINDER_CHUNK_SIZE', 2)
+class CheckInReminderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch, cls.other_branch = make_branch(), make_branch()
+        cls.arriving = [make_booking(make_room(cls.branch), night(1), night(3)) for _ in range(5)]
+        cls.other_arriving = make_booking(make_room(cls.other_branch), night(1), night(2))
+        make_booking(make_room(cls.branch), night(5), night(6))   #outside the window
+
+    def send(self, branch_id=None):
+        return tasks.send_check_in_reminders(night(1), night(2), branch_id)
+
+    def reminded(self):
+        return sorted(OutboundEmail.objects.values_list('recipients', flat=True))
+
+    def test_guests_in_the_window_are_reminded_once(self):
+        self.assertEqual(self.send(), 6)
+        self.assertEqual(self.reminded(), sorted([booking.email] for booking in self.arriving + [self.other_arriving]))
+        self.assertEqual(Booking.objects.filter(check_in_reminder_sent=True).count(), 6)
+        self.assertEqual(self.send(), 0)
+        self.assertEqual(OutboundEmail.objects.count(), 6)
+
+    def test_each_chunk_is_queued_and_marked_in_bulk(self):
+        with mock.patch('bookings.tasks.queue_emails', wraps=queue_emails) as queue, \
+             CaptureQueriesContext(connection) as queries:
+            self.send(self.branch.id)
+        self.assertEqual(queue.call_count, 3)   #5 bookings in chunks of 2
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 3)
+        self.assertTrue(all(Booking._meta.db_table in sql for sql in updates))
+
+    def test_queries_are_constant_per_chunk(self):
+        #per chunk: SELECT, SAVEPOINT, INSERT, UPDATE, RELEASE; plus the SELECT that finds nothing left
+        with self.assertNumQueries(5 * 3 + 1):
+            self.send(self.branch.id)
+        with self.assertNumQueries(5 * 1 + 1):
+            self.send(self.other_branch.id)
+
+    def test_branch_task_only_reminds_its_guests(self):
+        tasks.branch_check_in_reminder_email_task(self.other_branch.id, night(1).isoformat(), night(2).isoformat())
+        self.assertEqual(self.reminded(), [[self.other_arriving.email]])
+
+    @mock.patch('bookings.tasks.branch_check_in_reminder_email_task.delay')
+    def test_fan_out_dispatches_a_task_per_branch(self, delay):
+        tasks.check_in_reminder_email_task(fan_out=True)
+        self.assertLessEqual({self.branch.id, self.other_branch.id}, {call.args[0] for call in delay.call_args_list})
+        self.assertEqual(OutboundEmail.objects.count(), 0)
+
+
+#Nightly cleanup: expired bookings are soft-deleted by a chord of id range subtasks (run eagerly here)
+@mock.patch('bookings.tasks.CLEANUP_RANGE_SIZE', 2)
+@mock.patch('bookings.tasks.CLEANUP_BATCH_SIZE', 1)
+class CleanupExpiredBookingsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch()
+        cls.room = make_room(cls.branch)
+        cls.expired = [make_booking(cls.room, night(-days - 1), night(-days)) for days in range(1, 6)]
+        cls.current = make_booking(cls.room, night(0), night(2))
+        cls.deleted = make_booking(cls.room, night(-10), night(-8))
+        Booking.objects.delete_booking(cls.deleted.id)
+
+    def setUp(self):
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+        self.today = date.today().isoformat()
+
+    def checkpoint(self, start_id, **value):
+        key = tasks.cleanup_checkpoint_key(self.today, start_id)
+        self.addCleanup(cache.delete, key)
+        if value:
+            cache.set(key, value)
+
+    def deleted_ids(self):
+        return set(Booking.all_objects.filter(is_deleted=True).values_list('id', flat=True))
+
+    def test_expired_bookings_are_deleted_and_summed(self):
+        first_id = self.expired[0].id
+        for start_id in range(first_id, self.expired[-1].id + 1, 2):
+            self.checkpoint(start_id)
+        with self.assertLogs('bookings.tasks', 'INFO') as logs:
+            tasks.cleanup_expired_bookings_task()
+
+        self.assertEqual(self.deleted_ids(), {booking.id for booking in self.expired} | {self.deleted.id})
+        self.assertFalse(Booking.all_objects.get(pk=self.current.pk).is_deleted)
+        self.assertIn("'ranges': 3, 'bookings_expired': 5}", '\n'.join(logs.output))
+
+    def test_reruns_resume_from_the_checkpoint(self):
+        start_id, end_id = self.expired[0].id, self.expired[-1].id
+        self.checkpoint(start_id, last_id=self.expired[1].id, expired=2)   #a previous attempt got this far
+
+        result = tasks.cleanup_expired_bookings_range_task(start_id, end_id, self.today)
+        self.assertEqual(result, {'start_id': start_id, 'end_id': end_id, 'bookings_expired': 5})
+        self.assertEqual(self.deleted_ids(), {booking.id for booking in self.expired[2:]} | {self.deleted.id})
+
+    def test_summary_sums_the_ranges(self):
+        results = [{'start_id': 1, 'end_id': 2, 'bookings_expired': 2}, {'start_id': 3, 'end_id': 4, 'bookings_expired': 0},
+                   {'start_id': 5, 'end_id': 5, 'bookings_expired': 1}]
+        self.assertEqual(tasks.cleanup_expired_bookings_summary_task(results, self.today),
+                         {'date': self.today, 'ranges': 3, 'bookings_expired': 3})
+
+    def test_past_nights_leave_the_calendar(self):
+        self.assertTrue(RoomTypeAvailability.objects.filter(night__lt=night(0)).exists())
+        self.assertEqual(tasks.drop_past_nights(night(0)), 7)
+        self.assertFalse(RoomTypeAvailability.objects.filter(night__lt=night(0)).exists())
+        self.assertTrue(RoomTypeAvailability.objects.filter(night=night(0)).exists())
+
+
+#Soft-deleted bookings move to the archive; a guest's history reads both tables
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch()
+        cls.room = make_room(cls.branch)
+        cls.user = make_user()
+
+    def cancel(self, booking):
+        Booking.objects.delete_booking(booking.id)
+
+    def test_only_deleted_bookings_are_archived(self):
+        kept = make_booking(self.room, night(10), night(12))
+        cancelled = make_booking(self.room, night(12), night(14), user=self.user)
+        self.cancel(cancelled)
+
+        self.assertEqual(archive_deleted_bookings(batch_size=1), 1)
+        self.assertTrue(Booking.objects.filter(pk=kept.pk).exists())
+        self.assertFalse(Booking.all_objects.filter(pk=cancelled.pk).exists())
+        archived = ArchivedBooking.objects.get(pk=cancelled.pk)
+        self.assertEqual((archived.check_in_date, archived.user), (night(12), self.user))
+        self.assertEqual(archive_deleted_bookings(), 0)
+
+    def test_archived_stays_can_be_booked_again(self):
+        cancelled = make_booking(self.room, night(10), night(12))
+        self.cancel(cancelled)
+        archive_deleted_bookings()
+        self.assertTrue(is_room_available(self.room, night(10), night(12)))
+        make_booking(self.room, night(10), night(12), phone_number=cancelled.phone_number, email=cancelled.email)
+
+    def test_history_covers_active_pending_and_archived_bookings(self):
+        active = make_booking(self.room, night(20), night(22), user=self.user)
+        archived = make_booking(self.room, night(10), night(12), user=self.user)
+        self.cancel(archived)
+        archive_deleted_bookings()
+        pending = make_booking(self.room, night(14), night(16), user=self.user)
+        self.cancel(pending)   #deleted after the archiver ran
+        make_booking(self.room, night(16), night(18))   #someone else's
+
+        active_bookings, past_bookings = guest_booking_history(self.user)
+        self.assertEqual(active_bookings, [active])
+        self.assertEqual([booking.pk for booking in past_bookings], [pending.pk, archived.pk])
+
+
+    def test_history_includes_the_guests_unlinked_bookings(self):
+        user = self.user
+        details = {'guest_first_name': user.first_name, 'guest_last_name': user.last_name}
+        active = make_booking(self.room, night(20), night(22), phone_number=user.phone_number.replace('+', '00'),
+                              email=user.email.upper(), **details)
+        archived = make_booking(self.room, night(10), night(12), phone_number=user.phone_number, email=user.email, **details)
+        self.cancel(archived)
+        archive_deleted_bookings()
+        make_booking(self.room, night(14), night(16), email=user.email, **details)   #same names and email, another phone
+
+        active_bookings, past_bookings = guest_booking_history(user)
+        self.assertEqual(active_bookings, [active])
+        self.assertEqual([booking.pk for booking in past_bookings], [archived.pk])
+
+#Guest lookups match names and email case-insensitively and phone numbers in any format
+class GuestLookupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.room = make_room(make_branch())
+        cls.booking = make_booking(cls.room, night(10), night(12), guest_first_name='Jane', guest_last_name='Doe',
+                                   phone_number='+201100000001', email='Jane.Doe@example.com')
+
+    def test_names_and_email_ignore_case(self):
+        self.assertEqual(find_guest_booking('JANE', 'doe', email='jane.doe@EXAMPLE.com'), self.booking)
+
+    def test_phone_numbers_are_normalized(self):
+        self.assertEqual(find_guest_booking('Jane', 'Doe', phone_number='00201100000001'), self.booking)
+        self.assertEqual(find_guest_booking_by_contact('Jane', 'Doe', '+20 110-000-0001'), self.booking)
+
+    def test_names_must_match_the_contact(self):
+        self.assertIsNone(find_guest_booking('John', 'Doe', email='jane.doe@example.com'))
+        self.assertIsNone(find_guest_booking('Jane', 'Doe'))
+
+    def test_deleted_bookings_are_not_found(self):
+        Booking.objects.delete_booking(self.booking.id)
+        self.assertIsNone(find_guest_booking('Jane', 'Doe', email='jane.doe@example.com'))
+
+#The hot booking queries are served by their partial indexes (checks the index is usable, not the planner's
+#costs: the tables are nearly empty here, so sequential scans are turned off)
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, *indexes):
+        plan = queryset.explain()
+        self.assertTrue(any(index in plan for index in indexes), f'No index scan on {", ".join(indexes)}:\n{plan}')
+
+    def test_staff_booking_list(self):
+        self.assertUsesIndex(Booking.objects.filter(branch_id=1).order_by('-booking_date')[:12], 'booking_branch_date_idx')
+
+    def test_check_in_reminders(self):
+        bookings = Booking.objects.filter(check_in_date__gte=night(0), check_in_date__lt=night(1), check_in_reminder_sent=False)
+        self.assertUsesIndex(bookings, 'booking_check_in_reminder_idx')
+
+    def test_guest_lookup_by_phone_number(self):
+        self.assertUsesIndex(guest_booking_lookup('Jane', 'Doe', phone_number='+10000000000'), 'booking_guest_phone_key_idx')
+
+    def test_guest_lookup_by_email(self):
+        self.assertUsesIndex(guest_booking_lookup('Jane', 'Doe', email='jane@example.com'),
+                             'booking_guest_phone_key_idx', 'booking_email_key_idx')
+
+    def test_active_bookings_are_unique_by_phone_number(self):
+        room = make_room(make_branch())
+        booking = make_booking(room, night(10), night(12))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            make_booking(room, night(12), night(14), phone_number=booking.phone_number)
+
+
+#Pages cached with cache_page_tagged: kept server-side under their tags' versions, while clients only
+#keep them for PAGE_CLIENT_MAX_AGE before revalidating
+class PageCacheTests(SimpleTestCase):
+    def setUp(self):
+        n = next(sequence)
+        self.tag, self.path, self.renders = f'test-page:{n}', f'/test-pages/{n}/', 0
+
+        @cache_page_tagged(self.tag)
+        def view(request):
+            self.renders += 1
+            return HttpResponse(f'render {self.renders}')
+        self.view = view
+
+    def get(self, **headers):
+        return self.view(RequestFactory().get(self.path, headers=headers))
+
+    def head(self):
+        return self.view(RequestFactory().head(self.path))
+
+    def test_pages_are_served_from_the_cache(self):
+        self.assertEqual(self.get()['X-Cache'], 'MISS')
+        response = self.get()
+        self.assertEqual((response['X-Cache'], response.content), ('HIT', b'render 1'))
+
+    def test_clients_keep_pages_briefly(self):
+        self.assertLessEqual(get_max_age(self.get()), settings.PAGE_CLIENT_MAX_AGE)
+        self.assertLessEqual(get_max_age(self.get()), settings.PAGE_CLIENT_MAX_AGE)   #cached copy
+
+    def test_bumped_tags_replace_cached_pages(self):
+        self.get()
+        bump_versions([page_tag_key(self.tag)])
+        response = self.get()
+        self.assertEqual((response['X-Cache'], response.content), ('MISS', b'render 2'))
+
+    def test_head_requests_use_the_cached_page(self):
+        self.assertEqual(self.head()['X-Cache'], 'MISS')
+        self.assertEqual(self.head()['X-Cache'], 'HIT')
+        self.get()
+        self.assertEqual(self.head()['X-Cache'], 'HIT')
+        self.assertEqual(self.renders, 2)   #one render for HEAD, one for GET
+
+    def test_locks_held_by_other_workers_are_left_alone(self):
+        lock_key = page_lock_key(RequestFactory().get(self.path))
+        token = acquire_page_lock(lock_key)
+        self.addCleanup(release_page_lock, lock_key, token)
+
+        started = time.monotonic()
+        self.assertEqual(self.get()['X-Cache'], 'MISS')   #computed after a short wait
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertTrue(page_locked(lock_key))
+        self.assertIsNone(acquire_page_lock(lock_key))
+
+    def test_locks_are_released_by_their_holder(self):
+        self.get()
+        self.assertFalse(page_locked(page_lock_key(RequestFactory().get(self.path))))
+
+    def test_current_copies_are_not_modified(self):
+        etag = self.get()['ETag']
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.renders, 1)
+
+    def test_etags_change_with_the_tags_and_the_requester(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(if_none_match=etag, authorization='Bearer other').status_code, 200)
+        bump_versions([page_tag_key(self.tag)])
+        self.assertEqual(self.get(if_none_match=etag).status_code, 200)
+
+
+#Template fragments built from branches and rooms ({% cache %} blocks keyed by the page tags' versions)
+#are shared by every session and page copy until a branch or room change bumps their tags
+class FragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch(name=f'Fragment {next(sequence)}')
+        cls.room = make_room(cls.branch, 'suite', price_per_night=250)
+        cls.user = make_user()
+
+    def setUp(self):
+        #branch and room saves only bump the tags on commit, so start from fresh fragments
+        bump_versions([page_tag_key('branches'), page_tag_key(f'branch:{self.branch.branch_slug}')])
+
+    def save(self, instance):
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.save()
+
+    def test_branch_cards_are_shared_across_sessions(self):
+        self.assertContains(self.client.get(reverse('branches_all')), self.branch.name)
+        Branch.objects.filter(pk=self.branch.pk).update(address='Unseen Street')   #no tag bump
+        signed_in = Client()
+        signed_in.force_login(self.user)
+        response = signed_in.get(reverse('branches_all'))
+        self.assertContains(response, self.branch.address)
+        self.assertNotContains(response, 'Unseen Street')
+
+    def test_branch_edits_replace_branch_cards(self):
+        self.client.get(reverse('branches_all'))
+        self.branch.address = 'New Street'
+        self.save(self.branch)
+        self.assertContains(self.client.get(reverse('branches_all')), 'New Street')
+
+    def test_room_cards_are_shared_across_page_copies_until_a_room_edit(self):
+        url = reverse('branch_details', args=[self.branch.branch_slug])
+        self.assertContains(self.client.get(url, {'copy': 1}), '$250')
+        Room.objects.filter(pk=self.room.pk).update(price_per_night=300)   #no tag bump
+        response = self.client.get(url, {'copy': 2})
+        self.assertEqual(response['X-Cache'], 'MISS')   #a page of its own, with the cached fragment
+        self.assertContains(response, '$250')
+
+        self.room.price_per_night = 300
+        self.save(self.room)
+        self.assertContains(self.client.get(url, {'copy': 3}), '$300')
+
+
+#Reference data: a per-worker LRU in front of Redis, dropped by invalidations published over pub/sub
+class ReferenceCacheTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        start_reference_listener()
+
+    def setUp(self):
+        n = next(sequence)
+        self.name, self.tag, self.computed = f'test-reference:{n}', f'test-reference:{n}', 0
+
+    def compute(self):
+        self.computed += 1
+        return [self.computed]
+
+    def read(self, compute=None):
+        return get_reference(self.name, self.tag, compute or self.compute)
+
+    def counted(self, read):
+        before = reference_stats()
+        value = read()
+        after = reference_stats()
+        return value, {name: after[name] - before.get(name, 0) for name in after if after[name] != before.get(name, 0)}
+
+    def test_repeated_reads_stay_in_the_worker(self):
+        self.read()
+        self.assertEqual(self.counted(self.read), ([1], {'l1_hits': 1}))
+        self.assertEqual(self.computed, 1)
+
+    def test_dropped_entries_are_read_back_from_redis(self):
+        self.read()
+        drop_local(self.tag)
+        self.assertEqual(self.counted(self.read), ([1], {'l1_misses': 1, 'l2_hits': 1}))
+
+    def test_drops_only_touch_their_tag(self):
+        self.read()
+        drop_local('some-other-tag')
+        self.assertEqual(self.counted(self.read)[1], {'l1_hits': 1})
+
+    def test_fills_racing_an_invalidation_are_not_kept(self):
+        def compute_while_invalidated():
+            drop_local(self.tag)   #invalidation arriving while the value is being computed
+            return self.compute()
+
+        self.assertEqual(self.read(compute_while_invalidated), [1])
+        self.assertEqual(self.counted(self.read)[1], {'l1_misses': 1, 'l2_hits': 1})
+
+    def test_published_invalidations_reach_the_worker(self):
+        self.read()
+        invalidate_reference(self.tag)   #no transaction open, so published right away
+        deadline = time.monotonic() + 5
+        while self.name in reference._local and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertNotIn(self.name, reference._local)
+
+
+#Branch choice fields list branches from the reference cache and validate against the database
+class CachedBranchChoiceTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        start_reference_listener()
+
+    @classmethod
+    def setUpTestData(cls):
+        n = next(sequence)
+        cls.branches = [make_branch(name=f'Zamalek {n}'), make_branch(name=f'alexandria {n}'), make_branch(name=f'Giza {n}')]
+
+    def setUp(self):
+        #branches were created inside this test's transaction, so no commit bumped the tag
+        bump_versions([page_tag_key('branches')])
+        drop_local('branches')
+
+    def test_choices_are_listed_without_queries_in_database_order(self):
+        names = list(Branch.objects.values_list('name', flat=True))   #ordered by the database's collation
+        field = CachedBranchChoiceField()
+        branch_rows()
+        with self.assertNumQueries(0):
+            choices = list(field.choices)
+        self.assertEqual([label for _, label in choices[1:]], names)
+
+    def test_submitted_branches_are_validated_by_the_queryset(self):
+        field = CachedBranchChoiceField()
+        self.assertEqual(field.clean(str(self.branches[0].pk)), self.branches[0])
+        with self.assertRaises(ValidationError):
+            field.clean('0')
+
+    def test_empty_querysets_have_no_choices(self):
+        field = CachedBranchChoiceField(queryset=Branch.objects.none(), empty_label=None)
+        self.assertEqual(list(field.choices), [])
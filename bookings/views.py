@@ -1,5 +1,7 @@
 from django.db import transaction
 from django.urls import reverse, reverse_lazy
+from django.http import HttpResponseRedirect
+from django.core.exceptions import ValidationError
 from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
 from django.contrib.auth.decorators import login_required, user_passes_test
@@ -14,18 +16,26 @@ from accounts.models import User, Guest
 from bookings.models import Booking, Branch, Room
 from django_filters.views import FilterView
 from bookings.filters import BookingFilter
+from bookings.services import create_booking, change_booking
+from bookings.archive import guest_booking_history
+from bookings.caching import cache_page_tagged, fragment_cache_context
+from bookings.reference import branch_rows
+from bookings.conditional import booking_condition
+from bookings.availability import is_room_available, stay_error
+from bookings.holds import place_hold, get_hold, release_hold, hold_client, HoldLimitReached, HOLD_SESSION_KEY
+from datetime import date, datetime, timezone as dt_timezone
 
 
 
 
 #Define home page view 
-cache_page(60*30)   #caching every 30 minutes
+@cache_page_tagged('branches')
 def Home(request):
-    branches_list = Branch.objects.all()
-    return render(request, 'home.html', context={'branches_list': branches_list})  
+    #the template calls branch_rows, so branches are only read when the branch cards fragment isn't cached
+    return render(request, 'home.html', context={'branches_list': branch_rows, **fragment_cache_context('branches')})  
 
 #Define contacts view
-@cache_page(60*30) 
+@cache_page_tagged('branch:{branch_slug}')
 def ContactUs(request, branch_slug):
     branch = get_object_or_404(Branch, branch_slug=branch_slug)
     return render(request, 'branches/contact_us.html', {'branch': branch})
@@ -39,47 +49,41 @@ def About(request, branch_slug):
 @login_required(login_url=reverse_lazy('staff_login'))
 @user_passes_test(staff_permission, login_url=reverse_lazy('staff_login'))
 def staff_home(request):
-    branches = Branch.objects.all()
-    return render(request, 'staff/staff_home.html', {'branches': branches})
+    branches = branch_rows   #called by the template, only when the fragment isn't cached
+    return render(request, 'staff/staff_home.html', {'branches': branches, **fragment_cache_context('branches')})
 
 #Define guest home view
-@cache_page(60*30)
+@cache_page_tagged('branches')
 def guest_home(request):
-    branches = Branch.objects.all()
+    branches = branch_rows()
     return render(request, 'guests/guest_home.html', {'branches': branches})  
 
 #Define guest profile view 
 @login_required(login_url=reverse_lazy('guest_login'))
 @user_passes_test(guest_permission, login_url=reverse_lazy('guest_login'))
 def guest_me(request):
-    #get registered user's data 
-    guest = Guest.objects.get(guest=request.user)
-    # first_name = request.user.first_name
-    # last_name = request.user.last_name
-    # phone_number = request.user.phone_number 
-    
-    #fetch registered guest's booking history 
-    guest_bookings = Booking.all_objects.filter(guest_first_name=guest.guest.first_name, 
-                                                guest_last_name=guest.guest.last_name, 
-                                                phone_number=guest.guest.phone_number,
-                                                email=guest.guest.email)
-    active_bookings = guest_bookings.filter(is_deleted=False) 
-    past_bookings = guest_bookings.filter(is_deleted=True)
+    #fetch registered guest's current bookings and booking history (from the archive)
+    active_bookings, past_bookings = guest_booking_history(request.user)
     return render(request, 'guests/guest_me.html', {'active_bookings': active_bookings, 'past_bookings': past_bookings})
 
 
 #CBV to preview list of branches
-@method_decorator(cache_page(60*15), name='dispatch')
+@method_decorator(cache_page_tagged('branches'), name='dispatch')
 class PreviewBranches(ListView):
     model = Branch 
     template_name = 'branches/preview_branches.html'
     context_object_name = 'branches_list'  #variable name used by template
 
     def get_queryset(self):    
-        return Branch.objects.all()
+        return Branch.objects.all()   #lazy: only read when the branch cards fragment isn't cached
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(fragment_cache_context('branches'))
+        return context
 
 #Define CBV to preview room types per branch 
-@method_decorator(cache_page(60*15), name='dispatch')
+@method_decorator(cache_page_tagged('branch:{branch_slug}'), name='dispatch')
 class PreviewRooms_byBranch(TemplateView):
     template_name = 'branches/preview_room_types.html'
 
@@ -88,16 +92,20 @@ class PreviewRooms_byBranch(TemplateView):
         branch_slug = self.kwargs.get('branch_slug')
         branch = get_object_or_404(Branch, branch_slug=branch_slug)
 
+        context['branch'] = branch
+        #passed uncalled: the template only calls it when the room cards fragment isn't cached
+        context['room_samples'] = lambda: self.room_samples(branch)
+        context.update(fragment_cache_context(f'branch:{branch_slug}'))
+        return context
+
+    def room_samples(self, branch):
         room_types = ['single', 'double', 'deluxe', 'double deluxe', 'suite']
         room_samples = []
         for r_type in room_types:
             room = Room.objects.select_related('branch').filter(branch=branch, room_type=r_type).first()
             if room:
                 room_samples.append(room)
-
-        context['branch'] = branch
-        context['room_samples'] = room_samples
-        return context
+        return room_samples
     
 #CLASS VIEWS FOR STAFF MEMBERS TO VIEW AND MODIFY DATA 
 #CBV for displaying bookings for a given branch 
@@ -121,7 +129,8 @@ class DisplayBookings_byBranch(FilterView, LoginRequiredMixin, StaffOnlyMixin):
         context['branch'] = get_object_or_404(Branch, branch_slug=self.kwargs['branch_slug'])
         return context
 
-#CBV for displaying details of one particular booking 
+#CBV for displaying details of one particular booking (304 when the staff member's copy is current)
+@method_decorator(booking_condition, name='get')
 class DisplayBookingDetail_byStaff(DetailView, LoginRequiredMixin, StaffOnlyMixin):   
     model = Booking  
     template_name = 'staff/booking_detail.html' 
@@ -167,12 +176,8 @@ class DeleteBooking_byStaff(DeleteView, LoginRequiredMixin, StaffOnlyMixin):
     def delete(self, request, *args, **kwargs):
         #get current booking 
         booking = self.get_object()  
-        #change room availability 
-        room = booking.room
-        room.is_available = True 
-        room.save() 
 
-        #Call the manager method to delete the canceled booking and change room availability
+        #Call the manager method to delete the canceled booking (frees the room's nights)
         Booking.all_objects.remove_canceled_booking(booking_id=booking.id)
 
         return super().delete(request, *args, **kwargs)
@@ -186,13 +191,54 @@ class CreateBookingView(CreateView):
     template_name = 'booking/booking_form.html'  
     success_url = reverse_lazy('booking_successful')
 
-    #pass branch object to the form (accessible via its __init__() method)
+    #hold the room picked on the search page (?room=&check_in_date=&check_out_date=) while the form is filled in
+    def get(self, request, *args, **kwargs):
+        self.room_hold = self.place_room_hold()
+        return super().get(request, *args, **kwargs)
+
+    def place_room_hold(self):
+        params = self.request.GET
+        token = self.request.session.get(HOLD_SESSION_KEY)
+        try:
+            room_id = int(params['room'])
+            check_in = date.fromisoformat(params['check_in_date'])
+            check_out = date.fromisoformat(params['check_out_date'])
+        except (KeyError, ValueError):
+            return get_hold(token)
+
+        room = Room.objects.filter(pk=room_id, branch__branch_slug=self.kwargs['branch_slug']).first()
+        if not room or stay_error(check_in, check_out):
+            return None
+        if not is_room_available(room, check_in, check_out, hold_token=token):
+            return None
+
+        #a guest holds one room at a time per session, and a few at most across sessions
+        if token:
+            release_hold(token)
+        try:
+            hold = place_hold(room.pk, check_in, check_out, client=hold_client(self.request))
+        except HoldLimitReached:
+            return None
+        if hold:
+            self.request.session[HOLD_SESSION_KEY] = hold['token']
+        return hold
+
+    #prefill the form with the held room and dates
+    def get_initial(self):
+        initial = super().get_initial()
+        hold = getattr(self, 'room_hold', None)
+        if hold:
+            initial.update({'room': hold['room_id'], 'check_in_date': hold['check_in'], 
+                            'check_out_date': hold['check_out']})
+        return initial
+
+    #pass branch object and the guest's room hold to the form (accessible via its __init__() method)
     def get_form_kwargs(self):
         form_kwargs = super().get_form_kwargs()
         form_kwargs['branch'] = get_object_or_404(Branch, branch_slug=self.kwargs['branch_slug']) 
+        form_kwargs['hold_token'] = self.request.session.get(HOLD_SESSION_KEY)
         return form_kwargs
     
-    @transaction.atomic 
     def form_valid(self, form):
         #get new booking and set branch 
         new_booking = form.save(commit=False)
@@ -202,20 +248,28 @@ class CreateBookingView(CreateView):
         phone_number = form.cleaned_data.get('phone_number')
         new_booking.phone_number = User.normalize_phone_number(phone_number)
 
-        #save new booking 
-        new_booking.save()
+        #link bookings made by registered guests to their account
+        if self.request.user.is_authenticated and not self.request.user.is_staff:
+            new_booking.user = self.request.user
 
-        #change room availability and save
-        new_room = new_booking.room
-        new_room.is_available = False 
-        new_room.save(update_fields=['is_available'])
+        #save new booking while holding a lock on its room (turning the guest's hold into the booking)
+        try:
+            self.object = create_booking(new_booking, hold_token=self.request.session.get(HOLD_SESSION_KEY))
+        except ValidationError as exc:
+            form.add_error(None, exc)
+            return self.form_invalid(form)
+        self.request.session.pop(HOLD_SESSION_KEY, None)
 
-        return super().form_valid(form)
+        #booking is already saved, so redirect without saving the form again
+        return HttpResponseRedirect(self.get_success_url())
 
     #pass form as context data to the template (renaming to 'booking_form')
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['booking_form'] = context.get('form')  
+        hold = getattr(self, 'room_hold', None)
+        if hold:
+            context['room_hold_expires_at'] = datetime.fromtimestamp(hold['expires_at'] / 1000, tz=dt_timezone.utc)
         return context
 
 
@@ -236,6 +290,7 @@ class RequestBooking_guest(FormView):
 
 
 #Define CBV to render the details of the booking requested 
+@method_decorator(booking_condition, name='get')
 class DisplayBookingDetail_guest(DetailView):
     model = Booking
     template_name = 'guests/booking_detail.html'
@@ -260,7 +315,6 @@ class ChangeBookingView(UpdateView):
                     branch__branch_slug=branch_slug, room__room_number=room_number)
         return booking 
 
-    @transaction.atomic 
     def form_valid(self, form):
         #get current booking instance from the form
         booking = form.save(commit=False)  #don't save yet
@@ -271,33 +325,24 @@ class ChangeBookingView(UpdateView):
         new_check_in_date = form.cleaned_data.get('new_check_in_date')
         new_check_out_date = form.cleaned_data.get('new_check_out_date')
 
-        #change new room's availability and save 
-        new_room.is_available = False 
-        new_room.save(update_fields=['is_available'])   
-
-        #Change old room's availability and save 
-        old_room = booking.room
-        old_room.is_available = True 
-        old_room.save(update_fields=['is_available'])  
-
-        #Change existing booking's details with the new details 
-        booking.branch = new_branch 
-        booking.room = new_room 
-        booking.check_in_date = new_check_in_date
-        booking.check_out_date = new_check_out_date
-
-        #save changes
-        booking.save(update_fields=['branch', 'room', 'check_in_date', 'check_out_date'])
+        #Apply the new details in one locked update 
+        try:
+            change_booking(booking, new_room, new_branch=new_branch, 
+                           check_in=new_check_in_date, check_out=new_check_out_date)
+        except ValidationError as exc:
+            form.add_error(None, exc)
+            return self.form_invalid(form)
         
         #Trigger booking update email signal
         booking_updated_signal.send(sender=self.__class__, booking=booking)
         
-        return super().form_valid(form)
+        #booking is already saved, so redirect without saving the form again
+        return HttpResponseRedirect(self.get_success_url())
 
     #pass context data to the template 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['booking'] = self.get_object()
+        context['booking'] = self.object
         context['booking_change_form'] = context.get('form') 
         return context
 
@@ -319,7 +364,6 @@ class ChangeRoomView(UpdateView):
                     branch__branch_slug=branch_slug, room__room_number=room_number)
         return booking 
 
-    @transaction.atomic  
     def form_valid(self, form):
         #get current booking object from the form before saving
         booking = form.save(commit=False) 
@@ -327,23 +371,21 @@ class ChangeRoomView(UpdateView):
         #Get new room object from the form
         new_room = form.cleaned_data.get('new_room')
 
-        #change new room's availability and save 
-        new_room.is_available = False 
-        new_room.save(update_fields=['is_available'])
-
-        #Change old room's availability and save 
+        #keep old room for the email signal 
         old_room = booking.room
-        old_room.is_available = True 
-        old_room.save(update_fields=['is_available']) 
 
-        #Change room and save 
-        booking.room = new_room 
-        booking.save(update_fields=['room'])        
+        #Change room in one locked update 
+        try:
+            change_booking(booking, new_room)
+        except ValidationError as exc:
+            form.add_error(None, exc)
+            return self.form_invalid(form)
 
         #Trigger room change email signal
         room_changed_signal.send(sender=self.__class__, booking=booking, old_room=old_room)
 
-        return super().form_valid(form)
+        #booking is already saved, so redirect without saving the form again
+        return HttpResponseRedirect(self.get_success_url())
 
 
 #CLASS VIEW FOR DELETING EXISTING BOOKING 
@@ -357,7 +399,7 @@ class DeleteBooking_byGuest(FormView):
         #get booking object from form
         booking = form.cleaned_booking
 
-        #Call the manager method to delete the canceled booking and change room availability
+        #Call the manager method to delete the canceled booking (frees the room's nights)
         Booking.all_objects.remove_canceled_booking(booking_id=booking.id)
 
         return super().form_valid(form)
@@ -17,19 +17,32 @@ if [ ! -f "/app/.seeded" ]; then
   python manage.py import_rooms --csv-file seed/rooms.csv
   echo "Creating dummy bookings..."
   python manage.py create_dummy_bookings
+  echo "Building availability calendar..."
+  python manage.py rebuild_availability_calendar --days 365
   touch /app/.seeded
 fi
 
 #Identify number of CPU cores on system
 CPU_CORES=$(nproc --all)
 
-#Rule of thumb: (2 * cores) + 1
-WORKERS=$(( 2 * CPU_CORES + 1 ))
+#Rule of thumb: (2 * cores) + 1 (GUNICORN_WORKERS overrides it, e.g. one worker per core for ASGI workers or load tests)
+WORKERS=${GUNICORN_WORKERS:-$(( 2 * CPU_CORES + 1 ))}
+
+
+#Worker class: sync WSGI workers by default; GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker
+#(needs uvicorn installed in the image) serves the ASGI application instead, for the async endpoints under /api/async/
+WORKER_CLASS=${GUNICORN_WORKER_CLASS:-sync}
+if [ "$WORKER_CLASS" = "sync" ]; then
+  APPLICATION=HotelBookingProject.wsgi:application
+else
+  APPLICATION=HotelBookingProject.asgi:application
+fi
 
 
 #Start Gunicorn server
-echo "Starting Gunicorn (dev) on 0.0.0.0:8000..."
-exec gunicorn HotelBookingProject.wsgi:application \
+echo "Starting Gunicorn (dev, $WORKER_CLASS workers) on 0.0.0.0:8000..."
+exec gunicorn "$APPLICATION" \
+  --worker-class "$WORKER_CLASS" \
   --bind 0.0.0.0:8000 \
   --workers "$WORKERS" \
   --timeout 60 \
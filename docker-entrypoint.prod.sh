@@ -10,7 +10,6 @@ python manage.py migrate --noinput
 echo "Collecting files..."
 python manage.py collectstatic --noinput
 
-
 #Gunicorn socket directory
 mkdir -p /run/gunicorn
 
@@ -18,13 +17,24 @@ mkdir -p /run/gunicorn
 #Identify number of CPU cores on system
 CPU_CORES=$(nproc --all)
 
-#Rule of thumb: (2 * cores) + 1
-WORKERS=$(( 2 * CPU_CORES + 1 ))
+#Rule of thumb: (2 * cores) + 1 (GUNICORN_WORKERS overrides it, e.g. one worker per core for ASGI workers or load tests)
+WORKERS=${GUNICORN_WORKERS:-$(( 2 * CPU_CORES + 1 ))}
+
+
+#Worker class: sync WSGI workers by default; GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker
+#(needs uvicorn installed in the image) serves the ASGI application instead, for the async endpoints under /api/async/
+WORKER_CLASS=${GUNICORN_WORKER_CLASS:-sync}
+if [ "$WORKER_CLASS" = "sync" ]; then
+  APPLICATION=HotelBookingProject.wsgi:application
+else
+  APPLICATION=HotelBookingProject.asgi:application
+fi
 
 
 #Start Gunicorn server
-echo "Starting Gunicorn (prod) on unix socket..."
-exec gunicorn HotelBookingProject.wsgi:application \
+echo "Starting Gunicorn (prod, $WORKER_CLASS workers) on unix socket..."
+exec gunicorn "$APPLICATION" \
+  --worker-class "$WORKER_CLASS" \
   --bind "unix:/run/gunicorn/gunicorn.sock" \
   --workers "$WORKERS" \
   --timeout 60 \
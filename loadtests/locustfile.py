@@ -0,0 +1,97 @@
+import os
+import time
+import random
+from collections import Counter
+from locust import HttpUser, task, between, constant, events
+
+#Load test of the public read endpoints, sync (/api/) versus async (/api/async/)
+#
+#Compare concurrent connections per worker by running the app with a single worker, once per worker class:
+#    GUNICORN_WORKERS=1 ./docker-entrypoint.dev.sh
+#    GUNICORN_WORKERS=1 GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker ./docker-entrypoint.dev.sh
+#then ramp up users against each and note the users reached before response times climb:
+#    locust -f loadtests/locustfile.py --host http://localhost:8000 --headless -u 500 -r 25 -t 3m SyncReadUser
+#    locust -f loadtests/locustfile.py --host http://localhost:8000 --headless -u 500 -r 25 -t 3m AsyncReadUser
+
+BRANCH_SLUGS = [slug for slug in os.environ.get('LOADTEST_BRANCH_SLUGS', '').split(',') if slug]
+
+
+class ReadUser(HttpUser):
+    abstract = True
+    wait_time = between(0.5, 2)
+    prefix = '/api/'
+
+    def on_start(self):
+        #branch slugs to browse, from the branch list unless given
+        self.branch_slugs = BRANCH_SLUGS
+        if not self.branch_slugs:
+            response = self.client.get(f'{self.prefix}branches/', name=f'{self.prefix}branches/')
+            self.branch_slugs = [branch['branch_slug'] for branch in response.json().get('results', [])] or ['unknown']
+
+    @task(4)
+    def home(self):
+        self.client.get(self.prefix, name=self.prefix)
+
+    @task(3)
+    def preview_branches(self):
+        self.client.get(f'{self.prefix}branches/', name=f'{self.prefix}branches/')
+
+    @task(3)
+    def preview_rooms_by_branch(self):
+        slug = random.choice(self.branch_slugs)
+        self.client.get(f'{self.prefix}branches/{slug}/', name=f'{self.prefix}branches/[slug]/')
+
+    @task(1)
+    def contact_us(self):
+        slug = random.choice(self.branch_slugs)
+        self.client.get(f'{self.prefix}branches/{slug}/contact-us/', name=f'{self.prefix}branches/[slug]/contact-us/')
+
+
+class SyncReadUser(ReadUser):
+    prefix = '/api/'
+
+
+class AsyncReadUser(ReadUser):
+    prefix = '/api/async/'
+
+
+#Cache stampede scenario: many users on the cached branch list pages (web and API) across cache expiry boundaries
+#Run the app with a short page TTL so several expiries happen during the test:
+#    PAGE_CACHE_TIMEOUT=30 ./docker-entrypoint.dev.sh
+#    locust -f loadtests/locustfile.py --host http://localhost:8000 --headless -u 200 -r 50 -t 3m PageStampedeUser
+#Every MISS is a page computed against the database; with the stampede protection there should be about
+#one MISS per page per expiry (a flat query rate), where plain cache_page shows a burst of one per worker
+page_misses = Counter()
+
+
+@events.request.add_listener
+def count_page_misses(name, response, exception, **kwargs):
+    if response is not None and not exception and response.headers.get('X-Cache') == 'MISS':
+        page_misses[(name, int(time.time()))] += 1
+
+
+@events.quitting.add_listener
+def report_page_misses(environment, **kwargs):
+    if not page_misses:
+        return
+    print('\nPage misses (computed against the database), per page and second:')
+    for (name, second), misses in sorted(page_misses.items(), key=lambda item: item[0][1]):
+        print(f'  {time.strftime("%H:%M:%S", time.localtime(second))}  {name}: {misses}')
+    worst = max(page_misses.values())
+    print(f'Most misses of one page in a single second: {worst}')
+
+
+class PageStampedeUser(HttpUser):
+    wait_time = constant(0.1)
+
+    @task(1)
+    def branches(self):
+        self.client.get('/branches/', name='/branches/')
+
+    @task(1)
+    def api_branches(self):
+        self.client.get('/api/branches/', name='/api/branches/')
+
+    @task(1)
+    def api_home(self):
+        self.client.get('/api/', name='api_home')
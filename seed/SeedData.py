@@ -19,6 +19,7 @@ django.setup()
 
 #import models 
 from bookings.models import Branch, Room, Booking
+from bookings.availability import is_room_available
 
 #Instantiate faker
 fake = Faker()
@@ -110,16 +111,16 @@ def populate_bookings(total_bookings):
 
     for _ in range(total_bookings):
         room = random.choice(rooms)
+        check_in = fake.date_between(start_date='-10d', end_date='today')
+        check_out = check_in + timedelta(days=random.randint(1, 7))
         
-        #Extra safeguard to double-check availability
-        if not room.is_available:
+        #Extra safeguard to double-check availability for the dates
+        if not is_room_available(room, check_in, check_out):
             continue
 
         branch = room.branch
         gender = random.choice(['male', 'female'])
         dob = fake.date_of_birth(minimum_age=18, maximum_age=70)
-        check_in = fake.date_between(start_date='-10d', end_date='today')
-        check_out = check_in + timedelta(days=random.randint(1, 7))
 
         #Generate raw phone number and clean it
         raw_phone = fake.unique.phone_number()
@@ -145,9 +146,6 @@ def populate_bookings(total_bookings):
             booking.full_clean()  #Run model validators before saving
             booking.save()
 
-            room.is_available = False
-            room.save()
-
             print('Bookings created successfully.')
 
         except ValidationError as e: